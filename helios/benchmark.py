@@ -0,0 +1,168 @@
+"""
+Benchmarks for the crypto and data paths of Helios
+
+Every benchmark runs one operation over a set of ballots, e.g. encrypting or
+verifying them, and reports the operations per second and the peak memory
+allocated by Python while it runs. Sizes are configurable, so the numbers can
+be compared between releases to catch regressions, or extrapolated to size
+the workers for an election of a given size.
+
+Timings come from a run without memory tracing, the peak memory from a second
+traced run of the same operation, since tracing slows big-integer code down.
+"""
+
+import platform
+import time
+import tracemalloc
+import uuid
+
+from Crypto.Util.number import getPrime, getRandomNBitInteger, isPrime
+
+from helios import datatypes
+from helios import utils
+from helios.crypto import elgamal
+from helios.crypto.utils import random
+from helios.models import Election
+from helios.workflows.homomorphic import EncryptedVote
+
+DEFAULT_KEY_BITS = 2048
+DEFAULT_Q_BITS = 256
+DEFAULT_NUM_QUESTIONS = 1
+DEFAULT_NUM_ANSWERS = 3
+DEFAULT_NUM_BALLOTS = 10
+
+
+def generate_params(key_bits, q_bits=DEFAULT_Q_BITS):
+    """
+    a Schnorr group with a key_bits-bit p and a q_bits-bit q, p = k*q + 1.
+    meant for benchmarks only, production elections use the parameters in helios.views.
+    """
+    q = getPrime(q_bits)
+    while True:
+        k = getRandomNBitInteger(key_bits - q_bits)
+        k -= k % 2
+        p = k * q + 1
+        if p.bit_length() == key_bits and isPrime(p):
+            break
+
+    # any h with h^k != 1 gives a generator of the order-q subgroup
+    h = 2
+    while pow(h, k, p) == 1:
+        h += 1
+
+    params = elgamal.Cryptosystem()
+    params.p, params.q, params.g = p, q, pow(h, k, p)
+    return params
+
+
+def benchmark_election(params, num_questions, num_answers):
+    """
+    an unsaved election with num_questions questions of num_answers answers, and its secret key
+    """
+    keypair = params.generate_keypair()
+
+    election = Election(uuid=str(uuid.uuid4()), short_name='benchmark', name='Benchmark',
+                        description='', cast_url='', public_key=keypair.pk)
+    election.questions = [{
+        'question': 'Question %s' % question_num,
+        'short_name': 'Q%s' % question_num,
+        'answers': ['Answer %s' % answer_num for answer_num in range(num_answers)],
+        'answer_urls': [None] * num_answers,
+        'choice_type': 'approval',
+        'tally_type': 'homomorphic',
+        'result_type': 'absolute',
+        'min': 0,
+        'max': 1,
+    } for question_num in range(num_questions)]
+
+    return election, keypair.sk
+
+
+def measure(name, operation, items):
+    """
+    run operation on every item, once timed and once with memory tracing
+    """
+    start = time.perf_counter()
+    results = [operation(item) for item in items]
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    try:
+        for item in items:
+            operation(item)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return results, {
+        'name': name,
+        'ops': len(items),
+        'seconds': seconds,
+        'ops_per_sec': len(items) / seconds if seconds else None,
+        'peak_memory_bytes': peak_memory,
+    }
+
+
+def run(key_bits=DEFAULT_KEY_BITS, num_questions=DEFAULT_NUM_QUESTIONS, num_answers=DEFAULT_NUM_ANSWERS,
+        num_ballots=DEFAULT_NUM_BALLOTS, params=None):
+    """
+    run all the benchmarks, returns a JSON-ready dict
+    """
+    if params is None:
+        params = generate_params(key_bits)
+
+    election, sk = benchmark_election(params, num_questions, num_answers)
+
+    # every ballot picks one random answer per question
+    ballots_answers = [[[random.randint(0, num_answers - 1)] for _ in range(num_questions)] for _ in range(num_ballots)]
+
+    benchmarks = []
+
+    votes, result = measure('encrypt_vote', lambda answers: EncryptedVote.fromElectionAndAnswers(election, answers), ballots_answers)
+    benchmarks.append(result)
+
+    _, result = measure('verify_vote', lambda vote: vote.verify(election), votes)
+    benchmarks.append(result)
+
+    serialized_votes, result = measure('serialize_vote',
+                                       lambda vote: datatypes.LDObject.instantiate(vote, datatype='legacy/EncryptedVote').serialize(),
+                                       votes)
+    benchmarks.append(result)
+
+    _, result = measure('deserialize_vote',
+                        lambda serialized: datatypes.LDObject.wrapped_from_dict(utils.from_json(serialized), type_hint='legacy/EncryptedVote'),
+                        serialized_votes)
+    benchmarks.append(result)
+
+    # each run starts a fresh tally, the timed and the traced runs must not add to the same one
+    def add_all_votes(_):
+        tally = election.init_tally()
+        for vote in votes:
+            tally.add_vote(vote, verify_p=False)
+        return tally
+
+    tallies, result = measure('tally_add_vote', add_all_votes, [None])
+    result['ops'] = num_ballots
+    result['ops_per_sec'] = num_ballots / result['seconds'] if result['seconds'] else None
+    benchmarks.append(result)
+    tally = tallies[0]
+
+    factors_and_proofs, result = measure('decryption_factors_and_proofs', tally.decryption_factors_and_proofs, [sk])
+    benchmarks.append(result)
+    decryption_factors = factors_and_proofs[0][0]
+
+    _, result = measure('decrypt_from_factors', lambda factors: tally.decrypt_from_factors([factors], election.public_key),
+                        [decryption_factors])
+    benchmarks.append(result)
+
+    return {
+        'parameters': {
+            'key_bits': params.p.bit_length(),
+            'q_bits': params.q.bit_length(),
+            'num_questions': num_questions,
+            'num_answers': num_answers,
+            'num_ballots': num_ballots,
+        },
+        'python': platform.python_version(),
+        'benchmarks': benchmarks,
+    }
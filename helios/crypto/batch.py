@@ -0,0 +1,155 @@
+"""
+Batch verification of ElGamal encryption proofs for the Helios Voting System
+
+A ballot proof is a set of Chaum-Pedersen equations
+
+  g^response = A * alpha^challenge
+  y^response = B * (beta/m)^challenge
+
+Instead of checking every equation with its own exponentiations, the batch
+verifier raises each equation to a short random exponent and multiplies them
+all together (the small-exponent test of Bellare, Garay and Rabin). The
+bases g and y are then raised only once for the whole batch, and all the
+per-proof bases are combined in a single simultaneous multi-exponentiation.
+
+If any equation in the batch is false, the combined check fails except with
+probability about 2^-security_bits. A failed batch does not say which proof
+is wrong: callers fall back to individual verification for that.
+
+That bound only holds in a group of prime order q: an element outside the
+order-q subgroup, like p - A, carries a small-order factor that vanishes
+whenever its random exponent is a multiple of that order. Every commitment
+and ciphertext component is therefore checked to be in the subgroup
+(x^q = 1 mod p) before it goes into the combined check.
+"""
+
+from Crypto.Util.number import inverse
+
+from helios.crypto.multiexp import multi_pow
+from helios.crypto.utils import random
+
+# size of the random exponents, the chance of a bad batch of subgroup elements verifying is 2^-64
+DEFAULT_SECURITY_BITS = 64
+
+
+class BatchVerifier(object):
+    """
+    Accumulates encryption proofs under one public key and verifies them together.
+
+    The cheap parts of a disjunctive proof (the number of proofs and the
+    overall challenge) are checked as proofs are added, the exponentiations
+    are deferred until verify().
+    """
+
+    def __init__(self, pk, security_bits=DEFAULT_SECURITY_BITS):
+        self.pk = pk
+        self.security_bits = security_bits
+
+        # (alpha, beta, plaintext m, proof) for every deferred proof
+        self.claims = []
+
+        # set as soon as a cheap check fails
+        self.failed = False
+
+        # inverses of the plaintexts, there are only a handful of distinct ones
+        self._inverses = {}
+
+        # elements known to be in the order-q subgroup, alpha and beta come up once per plaintext
+        self._subgroup_members = set()
+
+    def __len__(self):
+        return len(self.claims)
+
+    def extend(self, other):
+        """
+        take over the deferred proofs of another batch verifier for the same public key
+        """
+        self.failed = self.failed or other.failed
+        self.claims.extend(other.claims)
+
+    def _inverse(self, m):
+        if m not in self._inverses:
+            self._inverses[m] = inverse(m, self.pk.p)
+        return self._inverses[m]
+
+    def _in_subgroup(self, x):
+        if x in self._subgroup_members:
+            return True
+
+        if not (0 < x < self.pk.p) or pow(x, self.pk.q, self.pk.p) != 1:
+            return False
+
+        self._subgroup_members.add(x)
+        return True
+
+    def add_encryption_proof(self, ciphertext, plaintext, proof):
+        """
+        defer the check that the ciphertext is an encryption of the plaintext
+        """
+        # the batch only works with non-negative exponents, leave odd proofs to the individual check
+        if proof.challenge < 0 or proof.response < 0:
+            self.failed = True
+            return
+
+        self.claims.append((ciphertext.alpha, ciphertext.beta, plaintext.m, proof))
+
+    def add_disjunctive_encryption_proof(self, ciphertext, plaintexts, proof, challenge_generator):
+        """
+        same as Ciphertext.verify_disjunctive_encryption_proof, except that the
+        individual proofs are only checked when verify() is called.
+
+        returns False if the proof is already known to be bad.
+        """
+        if len(plaintexts) != len(proof.proofs):
+            self.failed = True
+            return False
+
+        # check the overall challenge
+        if challenge_generator([p.commitment for p in proof.proofs]) != (sum([p.challenge for p in proof.proofs]) % self.pk.q):
+            self.failed = True
+            return False
+
+        for plaintext, individual_proof in zip(plaintexts, proof.proofs):
+            self.add_encryption_proof(ciphertext, plaintext, individual_proof)
+
+        return True
+
+    def verify(self):
+        """
+        check all the deferred proofs at once
+
+        every claim i gets two random exponents d_i and e_i, and we check
+          g^(sum d_i s_i) * y^(sum e_i s_i) == prod A_i^d_i alpha_i^(d_i c_i) B_i^e_i (beta_i/m_i)^(e_i c_i)
+        """
+        if self.failed:
+            return False
+
+        if not self.claims:
+            return True
+
+        p, q = self.pk.p, self.pk.q
+
+        g_exponent = 0
+        y_exponent = 0
+        pairs = []
+
+        for alpha, beta, m, proof in self.claims:
+            if not all(self._in_subgroup(x) for x in (alpha, beta, proof.commitment['A'], proof.commitment['B'])):
+                return False
+
+            d = random.getrandbits(self.security_bits)
+            e = random.getrandbits(self.security_bits)
+
+            g_exponent += d * proof.response
+            y_exponent += e * proof.response
+
+            beta_over_m = (beta * self._inverse(m)) % p
+
+            pairs.append((proof.commitment['A'], d))
+            pairs.append((alpha, d * proof.challenge))
+            pairs.append((proof.commitment['B'], e))
+            pairs.append((beta_over_m, e * proof.challenge))
+
+        left_side = (self.pk.g_pow(g_exponent % q) * self.pk.y_pow(y_exponent % q)) % p
+
+        return left_side == multi_pow(pairs, p)
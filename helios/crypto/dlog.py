@@ -0,0 +1,212 @@
+"""
+Discrete logs for the Helios Voting System
+
+Decrypting a homomorphic tally yields g^count, and the count is found by
+looking g^count up in a table of g^0, g^1, ... Instead of rebuilding that
+table on every decryption, a DLogService keeps one table per (g, p) and
+extends it as needed:
+
+- tables store a 64-bit fingerprint of every power, not the 2048-bit
+  value, and a hit is confirmed by recomputing the power;
+- the most recently used tables stay in memory, the others are evicted;
+- with a cache directory, tables are saved to disk as the plain array of
+  fingerprints, 8 bytes per entry, and loaded back instead of recomputed;
+- above max_table_size, the table serves as the baby steps of a
+  baby-step giant-step search, which needs about sqrt(n) multiplications
+  instead of n.
+"""
+
+import collections
+import hashlib
+import math
+import os
+import tempfile
+from array import array
+
+FINGERPRINT_MASK = (1 << 64) - 1
+
+# largest table built for a plain lookup, bigger ranges use baby-step giant-step
+DEFAULT_MAX_TABLE_SIZE = 1 << 16
+
+# tables kept in memory
+DEFAULT_MAX_TABLES = 4
+
+
+def fingerprint(value):
+    return value & FINGERPRINT_MASK
+
+
+class DLogTable(object):
+    """
+    Keeping track of discrete logs of base^0 .. base^counter
+    """
+
+    def __init__(self, base, modulus, fingerprints=None):
+        self.base = base
+        self.modulus = modulus
+
+        # fingerprint of base^i at position i
+        if fingerprints is None:
+            fingerprints = array('Q', [fingerprint(1)])
+        self.fingerprints = fingerprints
+
+        # fingerprint to the first position where it occurs
+        self.dlogs = {}
+        for dlog, value_fingerprint in enumerate(fingerprints):
+            self.dlogs.setdefault(value_fingerprint, dlog)
+
+        self.last_dlog_result = pow(base, self.counter, modulus)
+
+    @property
+    def counter(self):
+        return len(self.fingerprints) - 1
+
+    def increment(self):
+        # new value
+        new_value = (self.last_dlog_result * self.base) % self.modulus
+
+        # record the discrete log
+        new_fingerprint = fingerprint(new_value)
+        self.dlogs.setdefault(new_fingerprint, len(self.fingerprints))
+        self.fingerprints.append(new_fingerprint)
+
+        # record the last value
+        self.last_dlog_result = new_value
+
+    def precompute(self, up_to):
+        while self.counter < up_to:
+            self.increment()
+
+    def lookup(self, value):
+        value = value % self.modulus
+        value_fingerprint = fingerprint(value)
+
+        dlog = self.dlogs.get(value_fingerprint)
+        while dlog is not None:
+            if pow(self.base, dlog, self.modulus) == value:
+                return dlog
+
+            # another power with the same fingerprint, look further along
+            try:
+                dlog = self.fingerprints.index(value_fingerprint, dlog + 1)
+            except ValueError:
+                dlog = None
+
+        return None
+
+    def save(self, path):
+        """
+        write the fingerprints to path, atomically
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.fingerprints.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, base, modulus):
+        fingerprints = array('Q')
+        with open(path, 'rb') as f:
+            fingerprints.frombytes(f.read())
+
+        if not fingerprints or fingerprints[0] != fingerprint(1):
+            raise ValueError("not a discrete log table: %s" % path)
+
+        return cls(base, modulus, fingerprints)
+
+
+def baby_step_giant_step(value, table, up_to):
+    """
+    discrete log of value in [0, up_to], with the table as the baby steps.
+    returns None if there is none.
+    """
+    step = table.counter + 1
+    giant_step = pow(table.base, -step, table.modulus)
+
+    gamma = value % table.modulus
+    for giant_num in range(up_to // step + 1):
+        baby_dlog = table.lookup(gamma)
+        if baby_dlog is not None:
+            dlog = giant_num * step + baby_dlog
+            return dlog if dlog <= up_to else None
+
+        gamma = (gamma * giant_step) % table.modulus
+
+    return None
+
+
+class DLogService(object):
+    """
+    Discrete logs in base g mod p for small exponents, with cached tables
+    """
+
+    _shared = {}
+
+    def __init__(self, cache_dir=None, max_tables=DEFAULT_MAX_TABLES, max_table_size=DEFAULT_MAX_TABLE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_tables = max_tables
+        self.max_table_size = max_table_size
+        self.tables = collections.OrderedDict()
+
+    @classmethod
+    def shared(cls, cache_dir=None):
+        """
+        one service per cache directory for the whole process, so tables survive between calls
+        """
+        if cache_dir not in cls._shared:
+            cls._shared[cache_dir] = cls(cache_dir=cache_dir)
+        return cls._shared[cache_dir]
+
+    def _path(self, base, modulus):
+        key = hashlib.sha256(("%s,%s" % (base, modulus)).encode('ascii')).hexdigest()[:32]
+        return os.path.join(self.cache_dir, "%s.dlog" % key)
+
+    def table(self, base, modulus, up_to):
+        """
+        the table for (base, modulus), extended to at least base^up_to
+        """
+        key = (base, modulus)
+        table = self.tables.pop(key, None)
+
+        if table is None and self.cache_dir:
+            try:
+                table = DLogTable.load(self._path(base, modulus), base, modulus)
+            except (OSError, ValueError):
+                table = None
+
+        if table is None:
+            table = DLogTable(base, modulus)
+
+        if table.counter < up_to:
+            table.precompute(up_to)
+            if self.cache_dir:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                table.save(self._path(base, modulus))
+
+        # most recently used last, evict from the front
+        self.tables[key] = table
+        while len(self.tables) > self.max_tables:
+            self.tables.popitem(last=False)
+
+        return table
+
+    def discrete_log(self, value, base, modulus, up_to):
+        """
+        the x in [0, up_to] with base^x = value mod modulus, or None
+        """
+        if up_to <= self.max_table_size:
+            table = self.table(base, modulus, up_to)
+            dlog = table.lookup(value)
+            return dlog if dlog is not None and dlog <= up_to else None
+
+        # baby steps up to about sqrt(up_to), a bigger table that is already there is used as is
+        baby_steps = min(self.max_table_size, math.isqrt(up_to) + 1)
+        cached_table = self.tables.get((base, modulus))
+        if cached_table is not None:
+            baby_steps = max(baby_steps, cached_table.counter)
+
+        return baby_step_giant_step(value, self.table(base, modulus, baby_steps), up_to)
@@ -8,9 +8,12 @@ import datetime
 import uuid
 import logging
 
+from django.conf import settings
+
 from helios.utils import to_json
 from . import algs
 from . import utils
+from .dlog import DLogService, DLogTable  # DLogTable used to live here
 
 
 class HeliosObject(object):
@@ -593,39 +596,6 @@ class CastVote(HeliosObject):
         return issues
 
 
-class DLogTable(object):
-    """
-    Keeping track of discrete logs
-    """
-
-    def __init__(self, base, modulus):
-        self.dlogs = {1: 0}
-        self.last_dlog_result = 1
-        self.counter = 0
-
-        self.base = base
-        self.modulus = modulus
-
-    def increment(self):
-        self.counter += 1
-
-        # new value
-        new_value = (self.last_dlog_result * self.base) % self.modulus
-
-        # record the discrete log
-        self.dlogs[new_value] = self.counter
-
-        # record the last value
-        self.last_dlog_result = new_value
-
-    def precompute(self, up_to):
-        while self.counter < up_to:
-            self.increment()
-
-    def lookup(self, value):
-        return self.dlogs.get(value, None)
-
-
 class Tally(HeliosObject):
     """
     A running homomorphic tally
@@ -780,9 +750,8 @@ class Tally(HeliosObject):
         Each decryption factor set is a list of lists of decryption factors (questions/answers).
         """
 
-        # pre-compute a dlog table
-        dlog_table = DLogTable(base=public_key.g, modulus=public_key.p)
-        dlog_table.precompute(self.num_tallied)
+        # the discrete log tables are kept between decryptions
+        dlog_service = DLogService.shared(cache_dir=settings.HELIOS_DLOG_CACHE_DIR)
 
         result = []
 
@@ -795,7 +764,7 @@ class Tally(HeliosObject):
                 dec_factor_list = [df[q_num][a_num] for df in decryption_factors]
                 raw_value = self.tally[q_num][a_num].decrypt(dec_factor_list, public_key)
 
-                q_result.append(dlog_table.lookup(raw_value))
+                q_result.append(dlog_service.discrete_log(raw_value, public_key.g, public_key.p, self.num_tallied))
 
             result.append(q_result)
 
@@ -13,6 +13,8 @@ import logging
 from Crypto.Hash import SHA1
 from Crypto.Util.number import inverse
 
+from helios.crypto.fixedbase import fixed_base_pow
+from helios.crypto.multiexp import multi_pow
 from helios.crypto.utils import random
 
 
@@ -74,11 +76,23 @@ class PublicKey:
         else:
           m = plaintext.m
         
-        ciphertext.alpha = pow(self.g, r, self.p)
-        ciphertext.beta = (m * pow(self.y, r, self.p)) % self.p
+        ciphertext.alpha = self.g_pow(r)
+        ciphertext.beta = (m * self.y_pow(r)) % self.p
         
         return ciphertext
 
+    def g_pow(self, exponent):
+        """
+        g^exponent mod p, with a precomputed table for g
+        """
+        return fixed_base_pow(self.g, exponent, self.p, self.q)
+
+    def y_pow(self, exponent):
+        """
+        y^exponent mod p, with a precomputed table for y
+        """
+        return fixed_base_pow(self.y, exponent, self.p, self.q)
+
     def encrypt_return_r(self, plaintext):
         """
         Encrypt a plaintext and return the randomness just generated and used.
@@ -254,8 +268,8 @@ class Ciphertext:
         that's no good when we do plaintext encoding of 1.
         """
         new_c = Ciphertext()
-        new_c.alpha = (self.alpha * pow(self.pk.g, r, self.pk.p)) % self.pk.p
-        new_c.beta = (self.beta * pow(self.pk.y, r, self.pk.p)) % self.pk.p
+        new_c.alpha = (self.alpha * self.pk.g_pow(r)) % self.pk.p
+        new_c.beta = (self.beta * self.pk.y_pow(r)) % self.pk.p
         new_c.pk = self.pk
 
         return new_c
@@ -294,8 +308,8 @@ class Ciphertext:
       proof = ZKProof()
 
       # compute A=g^w, B=y^w
-      proof.commitment['A'] = pow(self.pk.g, w, self.pk.p)
-      proof.commitment['B'] = pow(self.pk.y, w, self.pk.p)
+      proof.commitment['A'] = self.pk.g_pow(w)
+      proof.commitment['B'] = self.pk.y_pow(w)
 
       # generate challenge
       proof.challenge = challenge_generator(proof.commitment);
@@ -320,8 +334,8 @@ class Ciphertext:
       proof.response = random.mpz_lt(self.pk.q);
 
       # now we compute A and B
-      proof.commitment['A'] = (inverse(pow(self.alpha, proof.challenge, self.pk.p), self.pk.p) * pow(self.pk.g, proof.response, self.pk.p)) % self.pk.p
-      proof.commitment['B'] = (inverse(pow(beta_over_plaintext, proof.challenge, self.pk.p), self.pk.p) * pow(self.pk.y, proof.response, self.pk.p)) % self.pk.p
+      proof.commitment['A'] = (inverse(pow(self.alpha, proof.challenge, self.pk.p), self.pk.p) * self.pk.g_pow(proof.response)) % self.pk.p
+      proof.commitment['B'] = (inverse(pow(beta_over_plaintext, proof.challenge, self.pk.p), self.pk.p) * self.pk.y_pow(proof.response)) % self.pk.p
 
       return proof
     
@@ -371,11 +385,11 @@ class Ciphertext:
       """
       
       # check that g^response = A * alpha^challenge
-      first_check = (pow(self.pk.g, proof.response, self.pk.p) == ((pow(self.alpha, proof.challenge, self.pk.p) * proof.commitment['A']) % self.pk.p))
+      first_check = (self.pk.g_pow(proof.response) == ((pow(self.alpha, proof.challenge, self.pk.p) * proof.commitment['A']) % self.pk.p))
       
       # check that y^response = B * (beta/m)^challenge
       beta_over_m = (self.beta * inverse(plaintext.m, self.pk.p)) % self.pk.p
-      second_check = (pow(self.pk.y, proof.response, self.pk.p) == ((pow(beta_over_m, proof.challenge, self.pk.p) * proof.commitment['B']) % self.pk.p))
+      second_check = (self.pk.y_pow(proof.response) == ((pow(beta_over_m, proof.challenge, self.pk.p) * proof.commitment['B']) % self.pk.p))
       
       # print "1,2: %s %s " % (first_check, second_check)
       return (first_check and second_check)
@@ -456,7 +470,7 @@ class ZKProof(object):
       proof = cls()
 
       # compute A = little_g^w, B=little_h^w
-      proof.commitment['A'] = pow(little_g, w, p)
+      proof.commitment['A'] = fixed_base_pow(little_g, w, p, q)
       proof.commitment['B'] = pow(little_h, w, p)
 
       # get challenge
@@ -473,10 +487,15 @@ class ZKProof(object):
     Verify a DH tuple proof
     """
     # check that little_g^response = A * big_g^challenge
-    first_check = (pow(little_g, self.response, p) == ((pow(big_g, self.challenge, p) * self.commitment['A']) % p))
+    # little_g and big_g are the generator and the trustee's public key, so they get precomputed tables
+    first_check = (fixed_base_pow(little_g, self.response, p, q) == ((fixed_base_pow(big_g, self.challenge, p, q) * self.commitment['A']) % p))
     
-    # check that little_h^response = B * big_h^challenge
-    second_check = (pow(little_h, self.response, p) == ((pow(big_h, self.challenge, p) * self.commitment['B']) % p))
+    # check that little_h^response = B * big_h^challenge, i.e. little_h^response * big_h^-challenge = B
+    # both bases change from proof to proof, so they share one multi-exponentiation
+    try:
+      second_check = (multi_pow([(little_h, self.response), (big_h, -self.challenge)], p) == self.commitment['B'] % p)
+    except ValueError:
+      second_check = False
 
     # check the challenge?
     third_check = True
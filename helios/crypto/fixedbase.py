@@ -0,0 +1,78 @@
+"""
+Fixed-base exponentiation for the Helios Voting System
+
+Almost every exponentiation in the ElGamal code raises one of two bases,
+the group generator g or a public key y, to an exponent smaller than q.
+For such a base we precompute base^(j * 2^(window*i)) for every window
+position i and digit j, after which base^e is a product of one table
+entry per window of e: no squarings at all.
+
+Tables are built on first use and kept in a small LRU cache keyed by the
+base and the modulus, so every copy of the same public key, e.g. one per
+request or per task, shares the same table.
+"""
+
+import functools
+
+# bits per window, a 256-bit exponent then takes 43 multiplications
+FIXED_BASE_WINDOW = 6
+
+# each table is about 700KB for a 2048-bit modulus and a 256-bit q
+MAX_CACHED_TABLES = 16
+
+
+class FixedBaseTable(object):
+    """
+    precomputed powers of one base modulo p, for exponents of up to exponent_bits bits
+    """
+
+    def __init__(self, base, p, exponent_bits, window=FIXED_BASE_WINDOW):
+        self.base = base
+        self.p = p
+        self.exponent_bits = exponent_bits
+        self.window = window
+        self.mask = (1 << window) - 1
+
+        # rows[i][j] = base^(j * 2^(window*i))
+        self.rows = []
+        row_base = base % p
+        for _ in range((exponent_bits + window - 1) // window):
+            row = [1, row_base]
+            for _ in range(self.mask - 1):
+                row.append((row[-1] * row_base) % p)
+            self.rows.append(row)
+
+            # base for the next row is row_base^(2^window)
+            row_base = (row[-1] * row_base) % p
+
+    def pow(self, exponent):
+        """
+        base^exponent mod p, exponents the table does not cover go to the builtin pow
+        """
+        if exponent < 0 or exponent.bit_length() > self.exponent_bits:
+            return pow(self.base, exponent, self.p)
+
+        result = 1
+        for row in self.rows:
+            if not exponent:
+                break
+
+            digit = exponent & self.mask
+            if digit:
+                result = (result * row[digit]) % self.p
+            exponent >>= self.window
+
+        return result % self.p
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_TABLES)
+def get_table(base, p, exponent_bits):
+    return FixedBaseTable(base, p, exponent_bits)
+
+
+def fixed_base_pow(base, exponent, p, q):
+    """
+    base^exponent mod p for a base that is raised over and over, like g or y.
+    exponents are expected to be smaller than q.
+    """
+    return get_table(base, p, q.bit_length()).pow(exponent)
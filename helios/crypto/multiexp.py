@@ -0,0 +1,64 @@
+"""
+Multi-exponentiation for the Helios Voting System
+
+Proof checks compare products of powers, like little_h^response against
+B * big_h^challenge. Computing base_1^e_1 * ... * base_n^e_n one power at a
+time costs n full chains of squarings; Straus' method (Shamir's trick for
+two bases) walks all the exponents together, window by window, so the
+squarings are shared and only the table lookups grow with n.
+
+Bases that are raised over and over, like g and y, are better served by
+the precomputed tables in helios.crypto.fixedbase.
+"""
+
+from Crypto.Util.number import inverse
+
+# bits per window, each base gets a table of 2^window entries
+MULTI_POW_WINDOW = 4
+
+
+def multi_pow(pairs, p, window=MULTI_POW_WINDOW):
+    """
+    compute the product of base^exponent mod p for all (base, exponent) pairs,
+    sharing the squarings between all the bases (Straus' method with fixed windows).
+
+    a negative exponent raises the inverse of its base, which has to exist mod p.
+    """
+    terms = []
+    for base, exponent in pairs:
+        if exponent < 0:
+            if base % p == 0:
+                raise ValueError("base has no inverse mod p")
+            base, exponent = inverse(base, p), -exponent
+
+        if exponent:
+            terms.append((base % p, exponent))
+
+    if not terms:
+        return 1 % p
+
+    mask = (1 << window) - 1
+
+    # small table of base^0 .. base^(2^window - 1) for each base
+    tables = []
+    for base, exponent in terms:
+        table = [1, base]
+        for _ in range(mask - 1):
+            table.append((table[-1] * base) % p)
+        tables.append((table, exponent))
+
+    num_windows = (max(exponent.bit_length() for _, exponent in terms) + window - 1) // window
+
+    result = 1
+    for window_num in range(num_windows - 1, -1, -1):
+        if result != 1:
+            for _ in range(window):
+                result = (result * result) % p
+
+        shift = window_num * window
+        for table, exponent in tables:
+            digit = (exponent >> shift) & mask
+            if digit:
+                result = (result * table[digit]) % p
+
+    return result % p
@@ -42,11 +42,17 @@ def recursiveToDict(obj):
     else:
         return obj.toDict()
 
+# datatype string to class, so the module lookup happens once per datatype
+_class_cache = {}
+
 def get_class(datatype):
     # already done?
     if not isinstance(datatype, str):
         return datatype
 
+    if datatype in _class_cache:
+        return _class_cache[datatype]
+
     # parse datatype string "v31/Election" --> from v31 import Election
     parsed_datatype = datatype.split("/")
     
@@ -66,6 +72,7 @@ def get_class(datatype):
         raise Exception ("no module for %s" % datatype)    
 
     dynamic_cls.datatype = datatype
+    _class_cache[datatype] = dynamic_cls
         
     return dynamic_cls
         
@@ -242,6 +249,20 @@ class LDObject(object):
 
     fromJSONDict = fromDict
 
+    @classmethod
+    def wrapped_from_dict(cls, d, type_hint=None):
+        """
+        same as fromDict(d, type_hint).wrapped_obj, for callers that only want the wrapped object.
+        datatypes with a decode_wrapped classmethod build that object directly from the dict,
+        skipping the LDObject for every nested field.
+        """
+        ld_cls = get_class(type_hint)
+        if hasattr(ld_cls, 'decode_wrapped'):
+            return ld_cls.decode_wrapped(d)
+
+        ld_obj = cls.fromDict(d, type_hint=type_hint)
+        return ld_obj.wrapped_obj if ld_obj is not None else None
+
     @property
     def hash(self):
         s = self.serialize()
@@ -7,19 +7,48 @@ and adapted to LDObject
 """
 
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 
 from helios import utils
 from . import LDObject
 
 
+class LDObjectFieldDescriptor(DeferredAttribute):
+    """
+    Rows come back from the database with the raw JSON of the field,
+    which is only parsed the first time the attribute is read. The parsed
+    object then replaces the JSON on the instance.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+
+        value = super(LDObjectFieldDescriptor, self).__get__(instance, cls)
+        if isinstance(value, str):
+            value = self.field.from_json(value)
+            instance.__dict__[self.field.attname] = value
+
+        return value
+
+    def __set__(self, instance, value):
+        # a data descriptor, so that reads go through __get__ and not the instance __dict__
+        instance.__dict__[self.field.attname] = value
+
+
 class LDObjectField(models.TextField):
     """
     LDObject is a generic textfield that neatly serializes/unserializes
     JSON objects seamlessly.
     
     deserialization_params added on 2011-01-09 to provide additional hints at deserialization time
+
+    the JSON is parsed lazily, when the attribute is first read, see LDObjectFieldDescriptor.
+    values() and values_list() give the raw JSON.
     """
 
+    descriptor_class = LDObjectFieldDescriptor
+
     def __init__(self, type_hint=None, **kwargs):
         self.type_hint = type_hint
         super(LDObjectField, self).__init__(**kwargs)
@@ -31,10 +60,9 @@ class LDObjectField(models.TextField):
         if not isinstance(value, str):
             return value
 
-        return self.from_db_value(value)
+        return self.from_json(value)
 
-    # noinspection PyUnusedLocal
-    def from_db_value(self, value, *args, **kwargs):
+    def from_json(self, value):
         # in some cases, we're loading an existing array or dict,
         # from_json takes care of this duality
         parsed_value = utils.from_json(value)
@@ -42,9 +70,18 @@ class LDObjectField(models.TextField):
             return None
 
         # we give the wrapped object back because we're not dealing with serialization types
-        return_val = LDObject.fromDict(parsed_value, type_hint=self.type_hint).wrapped_obj
+        return_val = LDObject.wrapped_from_dict(parsed_value, type_hint=self.type_hint)
         return return_val
 
+    # noinspection PyUnusedLocal
+    def from_db_value(self, value, *args, **kwargs):
+        # parsed by the descriptor when it's used
+        return value
+
+    def pre_save(self, model_instance, add):
+        # JSON that was never parsed goes back as it is
+        return model_instance.__dict__.get(self.attname)
+
     def get_prep_value(self, value):
         """Convert our JSON object to a string before we save"""
         if isinstance(value, str):
@@ -7,6 +7,53 @@ from helios.crypto import elgamal as crypto_elgamal
 from helios.workflows import homomorphic
 from helios import models
 
+##
+## fast decoding: build the workflow and crypto objects of a ballot straight from its
+## parsed JSON, the same objects LDObject.fromDict would wrap, see LDObject.wrapped_from_dict
+##
+
+def _big_int(value):
+    return None if value is None else int(value)
+
+def _array(decode, values):
+    # like arrayOf, a null array stays null but null elements are not allowed
+    return None if values is None else [decode(value) for value in values]
+
+def _decode_ciphertext(d):
+    ciphertext = crypto_elgamal.Ciphertext()
+    ciphertext.alpha = _big_int(d['alpha'])
+    ciphertext.beta = _big_int(d['beta'])
+    return ciphertext
+
+def _decode_proof(d):
+    proof = crypto_elgamal.ZKProof()
+    commitment = d['commitment']
+    proof.commitment = None if commitment is None else {'A': _big_int(commitment['A']), 'B': _big_int(commitment['B'])}
+    proof.challenge = _big_int(d['challenge'])
+    proof.response = _big_int(d['response'])
+    return proof
+
+def _decode_disjunctive_proof(d):
+    # the legacy disjunctive proof is just the array of proofs
+    return crypto_elgamal.ZKDisjunctiveProof(_array(_decode_proof, d))
+
+def _decode_answer(d):
+    answer = homomorphic.EncryptedAnswer()
+    answer.choices = _array(_decode_ciphertext, d['choices'])
+    answer.individual_proofs = _array(_decode_disjunctive_proof, d['individual_proofs'])
+    answer.overall_proof = None if d['overall_proof'] is None else _decode_disjunctive_proof(d['overall_proof'])
+    return answer
+
+def _decode_vote(d):
+    vote = homomorphic.EncryptedVote()
+    vote.answers = _array(_decode_answer, d['answers'])
+    vote.election_hash = d['election_hash']
+    vote.election_uuid = d['election_uuid']
+    return vote
+
+def _null_or(decode):
+    return classmethod(lambda cls, d: None if d is None else decode(d))
+
 ##
 ##
 
@@ -35,6 +82,8 @@ class EncryptedAnswer(LegacyObject):
         'overall_proof' : 'legacy/EGZKDisjunctiveProof'
         }
 
+    decode_wrapped = _null_or(_decode_answer)
+
 class EncryptedAnswerWithRandomness(LegacyObject):
     FIELDS = ['choices', 'individual_proofs', 'overall_proof', 'randomness', 'answer']
     STRUCTURED_FIELDS = {
@@ -54,6 +103,8 @@ class EncryptedVote(LegacyObject):
         'answers' : arrayOf('legacy/EncryptedAnswer')
         }
 
+    decode_wrapped = _null_or(_decode_vote)
+
     def includeRandomness(self):
         return self.instantiate(self.wrapped_obj, datatype='legacy/EncryptedVoteWithRandomness')
 
@@ -137,6 +188,8 @@ class EGCiphertext(LegacyObject):
         'alpha': 'core/BigInteger',
         'beta' : 'core/BigInteger'}
 
+    decode_wrapped = _null_or(_decode_ciphertext)
+
 class EGZKProofCommitment(DictObject, LegacyObject):
     FIELDS = ['A', 'B']
     STRUCTURED_FIELDS = {
@@ -151,6 +204,8 @@ class EGZKProof(LegacyObject):
         'commitment': 'legacy/EGZKProofCommitment',
         'challenge' : 'core/BigInteger',
         'response' : 'core/BigInteger'}
+
+    decode_wrapped = _null_or(_decode_proof)
         
 class EGZKDisjunctiveProof(LegacyObject):
     WRAPPED_OBJ_CLASS = crypto_elgamal.ZKDisjunctiveProof
@@ -158,6 +213,8 @@ class EGZKDisjunctiveProof(LegacyObject):
     STRUCTURED_FIELDS = {
         'proofs': arrayOf('legacy/EGZKProof')}
 
+    decode_wrapped = _null_or(_decode_disjunctive_proof)
+
     def loadDataFromDict(self, d):
         "hijack and make sure we add the proofs name back on"
         return super(EGZKDisjunctiveProof, self).loadDataFromDict({'proofs': d})
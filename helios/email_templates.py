@@ -0,0 +1,36 @@
+"""
+Rendering of voter emails
+
+A mass email renders the same subject and body templates for every voter,
+only the voter changes. EmailTemplates looks the templates up once, keeps
+one template context with the variables shared by all the voters, and
+pushes just the voter's own variables on top of it for each message, so
+no dict of variables is copied and no context is built per voter.
+"""
+
+from django.template import Context, loader
+
+
+class EmailTemplates(object):
+    """
+    a subject and a body template, rendered for one voter after the other
+    """
+
+    def __init__(self, subject_template, body_template, extra_vars=None):
+        # the engine's template, which renders a Context, not the backend wrapper that builds one from a dict
+        self.subject_template = loader.get_template(subject_template).template
+        self.body_template = loader.get_template(body_template).template
+        self.context = Context(dict(extra_vars or {}))
+
+    def render(self, voter):
+        """
+        (subject, body) for the voter
+        """
+        with self.context.push(voter.email_vars()):
+            return self.subject_template.render(self.context), self.body_template.render(self.context)
+
+    def render_many(self, voters):
+        """
+        [(subject, body), ...] for the voters, in order
+        """
+        return [self.render(voter) for voter in voters]
@@ -18,6 +18,7 @@ class ElectionForm(forms.Form):
   #use_advanced_audit_features = forms.BooleanField(required=False, initial=True, help_text='disable this only if you want a simple election with reduced security but a simpler user interface')
   randomize_answer_order = forms.BooleanField(required=False, initial=False, help_text='enable this if you want the answers to questions to appear in random order for each voter')
   private_p = forms.BooleanField(required=False, initial=False, label="Private?", help_text='A private election is only visible to registered voters.')
+  incremental_tally_p = forms.BooleanField(required=False, initial=False, label="Running tally?", help_text='enable this to add each ballot to the encrypted tally as it is cast, so the tally is ready as soon as voting ends')
   help_email = forms.CharField(required=False, initial="", label="Help Email Address", help_text='An email address voters should contact if they need help.')
   
   if settings.ALLOW_ELECTION_INFO_URL:
@@ -0,0 +1,41 @@
+"""
+benchmark the crypto and data paths, results are printed as JSON
+"""
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from helios import benchmark
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'benchmark ballot encryption, verification, tallying and decryption'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--key-bits', type=int, default=benchmark.DEFAULT_KEY_BITS,
+                            help='size of p, 2048 uses the election parameters, other sizes generate a group')
+        parser.add_argument('--questions', type=int, default=benchmark.DEFAULT_NUM_QUESTIONS)
+        parser.add_argument('--answers', type=int, default=benchmark.DEFAULT_NUM_ANSWERS,
+                            help='number of answers per question')
+        parser.add_argument('--ballots', type=int, default=benchmark.DEFAULT_NUM_BALLOTS,
+                            help='number of ballots encrypted, verified and tallied')
+        parser.add_argument('--output', default=None, help='write the JSON to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        from helios.views import ELGAMAL_PARAMS
+
+        params = None
+        if options['key_bits'] == ELGAMAL_PARAMS.p.bit_length():
+            params = ELGAMAL_PARAMS
+
+        results = benchmark.run(key_bits=options['key_bits'], num_questions=options['questions'],
+                                num_answers=options['answers'], num_ballots=options['ballots'], params=params)
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,26 @@
+"""
+count the voters and votes of elections again, in case their counters went wrong,
+e.g. after voters were changed directly in the database
+"""
+
+from django.core.management.base import BaseCommand
+
+from helios.models import Election
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'recompute the voter and vote counters of elections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('election_uuids', nargs='*', help='elections to recount, all of them if none are given')
+
+    def handle(self, *args, **options):
+        elections = Election.objects_with_deleted.all()
+        if options['election_uuids']:
+            elections = elections.filter(uuid__in=options['election_uuids'])
+
+        for election in elections.iterator():
+            election.recount()
+            self.stdout.write("%s: %d voters, %d cast votes, %d pending votes"
+                              % (election.uuid, election.num_voters, election.num_cast_votes, election.num_pending_votes))
@@ -1,36 +1,199 @@
 """
 verify cast votes that have not yet been verified
 
+Ballots are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED, so
+several copies of this command can run side by side without verifying the
+same ballot twice. The proofs of a batch are checked by a pool of worker
+processes, and the results are written back with bulk updates.
+
 Ben Adida
 ben@adida.net
 2010-05-22
 """
 
+import datetime
+import multiprocessing
+import os
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Q
+
+from helios.models import CastVote, Voter
+from helios.workflows.homomorphic import EncryptedVote
+
+# ballots claimed per transaction
+DEFAULT_BATCH_SIZE = 200
+
+# seconds between polls when running with --loop
+DEFAULT_POLL_INTERVAL = 5
+
+
+def verify_votes(args):
+    """
+    runs in a worker process: verify the ballots of one election, returns one boolean per ballot
+    """
+    election, encrypted_votes = args
+    bad_votes = set(id(vote) for vote in EncryptedVote.verify_batch(election, encrypted_votes))
+    return [id(vote) not in bad_votes for vote in encrypted_votes]
+
+
+def claim_cast_votes(batch_size):
+    """
+    lock up to batch_size unverified ballots, skipping the ones another worker holds.
+    must be called inside a transaction.
+    """
+    # quarantined ballots are not verified until they are released
+    not_quarantined = Q(quarantined_p=False) | Q(released_from_quarantine_at__isnull=False)
+
+    return list(CastVote.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('voter__election')
+                .filter(not_quarantined, verified_at=None, invalidated_at=None)
+                .order_by('cast_at')[:batch_size])
+
+
+def split_work(cast_votes, num_chunks):
+    """
+    group the ballots by election and cut every group into about num_chunks pieces
+    """
+    by_election = {}
+    for cast_vote in cast_votes:
+        by_election.setdefault(cast_vote.voter.election_id, []).append(cast_vote)
+
+    work = []
+    for election_cast_votes in by_election.values():
+        election = election_cast_votes[0].voter.election
+        chunk_size = max(1, -(-len(election_cast_votes) // num_chunks))
+        for start in range(0, len(election_cast_votes), chunk_size):
+            chunk = election_cast_votes[start:start + chunk_size]
+            work.append((chunk, (election, [cast_vote.vote for cast_vote in chunk])))
+
+    return work
+
+
+def store_results(cast_votes, results):
+    """
+    write verified_at / invalidated_at for all the ballots, and the latest valid ballot of every voter
+    """
+    now = datetime.datetime.utcnow()
+    verified, invalidated = [], []
+    for cast_vote, result in zip(cast_votes, results):
+        if result:
+            cast_vote.verified_at = now
+            verified.append(cast_vote)
+        else:
+            cast_vote.invalidated_at = now
+            invalidated.append(cast_vote)
 
-from helios.models import CastVote
+    CastVote.objects.bulk_update(verified, ['verified_at'])
+    CastVote.objects.bulk_update(invalidated, ['invalidated_at'])
 
+    # none of them are pending anymore
+    pending_votes_changes = {}
+    for cast_vote in cast_votes:
+        if getattr(cast_vote, '_counted_pending_p', False):
+            election = cast_vote.voter.election
+            pending_votes_changes[election] = pending_votes_changes.get(election, 0) - 1
+            cast_vote._counted_pending_p = False
+    for election, delta in pending_votes_changes.items():
+        election.increment_pending_votes(delta)
+
+    # like Voter.store_vote, a voter keeps the ballot that was cast last. the voters are locked and read again,
+    # a ballot stored since they were claimed must not be overwritten with an older one
+    elections = dict((cast_vote.voter.election_id, cast_vote.voter.election) for cast_vote in verified)
+    voters = dict((voter.id, voter) for voter in Voter.objects.select_for_update()
+                  .filter(id__in=set(cast_vote.voter_id for cast_vote in verified)).order_by('id'))
+    for voter in voters.values():
+        voter.election = elections[voter.election_id]
+
+    stored_voters = {}
+    running_tally_changes = {}
+    cast_votes_changes = {}
+    for cast_vote in sorted(verified, key=lambda cast_vote: cast_vote.cast_at):
+        voter = voters[cast_vote.voter_id]
+        if voter.cast_at and cast_vote.cast_at < voter.cast_at:
+            continue
+
+        if voter.vote is None:
+            cast_votes_changes[voter.election] = cast_votes_changes.get(voter.election, 0) + 1
+
+        if voter.election.incremental_tally_p:
+            added_votes, removed_votes = running_tally_changes.setdefault(voter.election, ([], []))
+            added_votes.append(cast_vote.vote)
+            if voter.vote:
+                removed_votes.append(voter.vote)
+
+        voter.vote = cast_vote.vote
+        voter.vote_hash = cast_vote.vote_hash
+        voter.cast_at = cast_vote.cast_at
+        stored_voters[voter.id] = voter
+
+    Voter.objects.bulk_update(list(stored_voters.values()), ['vote', 'vote_hash', 'cast_at'])
+
+    for election, delta in cast_votes_changes.items():
+        election.increment_cast_votes(delta)
+
+    for election, (added_votes, removed_votes) in running_tally_changes.items():
+        election.update_running_tally(added_votes, removed_votes)
+
+    return len(verified), len(invalidated)
 
-def get_cast_vote_to_verify():
-    # fixme: add "select for update" functionality here
-    votes = CastVote.objects.filter(verified_at=None, invalidated_at=None).order_by('-cast_at')
-    if len(votes) > 0:
-        return votes[0]
-    else:
-        return None
 
 class Command(BaseCommand):
     args = ''
     help = 'verify votes that were cast'
-    
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='number of ballots claimed at a time')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='number of worker processes, 1 verifies in this process')
+        parser.add_argument('--loop', action='store_true',
+                            help='keep polling for new ballots instead of quitting when there are none')
+        parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                            help='seconds to wait between polls with --loop')
+
     def handle(self, *args, **options):
-        while True:
-            cast_vote = get_cast_vote_to_verify()
-            if not cast_vote:
-                break
+        processes = max(1, options['processes'])
+
+        pool = None
+        if processes > 1:
+            # the workers only do arithmetic, they must not share our database connections
+            connections.close_all()
+            pool = multiprocessing.Pool(processes)
+
+        try:
+            while True:
+                num_verified, num_invalidated = self.verify_batch(options['batch_size'], processes, pool)
+                if num_verified or num_invalidated:
+                    self.stdout.write("verified %d, invalidated %d" % (num_verified, num_invalidated))
+                    continue
+
+                # nothing left to verify, quit and wait for next invocation unless we run as a daemon
+                if not options['loop']:
+                    break
+                time.sleep(options['poll_interval'])
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    def verify_batch(self, batch_size, processes, pool):
+        with transaction.atomic():
+            cast_votes = claim_cast_votes(batch_size)
+            if not cast_votes:
+                return 0, 0
+
+            work = split_work(cast_votes, processes)
+            if pool:
+                chunk_results = pool.map(verify_votes, [args for _, args in work])
+            else:
+                chunk_results = [verify_votes(args) for _, args in work]
 
-            cast_vote.verify_and_store()
+            claimed, results = [], []
+            for (chunk, _), chunk_result in zip(work, chunk_results):
+                claimed.extend(chunk)
+                results.extend(chunk_result)
 
-        # once broken out of the while loop, quit and wait for next invocation
-        # this happens when there are no votes left to verify
-            
+            return store_results(claimed, results)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.9 on 2026-10-18 12:36
+
+import helios.datatypes.djangofield
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0010_add_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='incremental_tally_p',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='election',
+            name='running_tally',
+            field=helios.datatypes.djangofield.LDObjectField(null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0011_election_running_tally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voterfile',
+            name='num_rows_processed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='voterfile',
+            name='num_rows_rejected',
+            field=models.IntegerField(default=0),
+        ),
+    ]
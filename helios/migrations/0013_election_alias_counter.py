@@ -0,0 +1,34 @@
+# Generated by Django 5.2.9 on 2026-10-18 15:10
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models.functions import Cast, Substr
+
+
+def backfill_alias_counter(apps, schema_editor):
+    Election = apps.get_model('helios', 'Election')
+    Voter = apps.get_model('helios', 'Voter')
+
+    last_alias_nums = (Voter.objects.filter(alias__regex=r'^V[0-9]+$')
+                       .values('election_id')
+                       .annotate(last_alias_num=Max(Cast(Substr('alias', 2), models.IntegerField())))
+                       .values_list('election_id', 'last_alias_num'))
+
+    for election_id, last_alias_num in last_alias_nums:
+        Election.objects.filter(id=election_id).update(alias_counter=last_alias_num)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0012_voterfile_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='alias_counter',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_alias_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.9 on 2026-10-18 12:49
+
+import django.db.models.deletion
+import helios_auth.jsonfield
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0013_election_alias_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailCampaign',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject_template', models.CharField(max_length=200)),
+                ('body_template', models.CharField(max_length=200)),
+                ('extra_vars', helios_auth.jsonfield.JSONField(null=True)),
+                ('voter_constraints_include', helios_auth.jsonfield.JSONField(null=True)),
+                ('voter_constraints_exclude', helios_auth.jsonfield.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('last_voter_id', models.IntegerField(default=0)),
+                ('num_sent', models.IntegerField(default=0)),
+                ('num_opted_out', models.IntegerField(default=0)),
+                ('num_failed', models.IntegerField(default=0)),
+                ('num_retries', models.IntegerField(default=0)),
+                ('failed_voter_uuids', helios_auth.jsonfield.JSONField(null=True)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='helios.election')),
+            ],
+        ),
+    ]
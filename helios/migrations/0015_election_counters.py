@@ -0,0 +1,52 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    Voter = apps.get_model('helios', 'Voter')
+    CastVote = apps.get_model('helios', 'CastVote')
+    ElectionCounterShard = apps.get_model('helios', 'ElectionCounterShard')
+
+    counts = [
+        ('voters', Voter.objects.all()),
+        ('cast_votes', Voter.objects.exclude(vote=None)),
+    ]
+    pending_votes = (CastVote.objects.filter(verified_at=None, invalidated_at=None, quarantined_p=False)
+                     .values('voter__election_id').annotate(count=Count('id'))
+                     .values_list('voter__election_id', 'count'))
+
+    shards = []
+    for name, queryset in counts:
+        for election_id, count in queryset.values('election_id').annotate(count=Count('id')).values_list('election_id', 'count'):
+            shards.append(ElectionCounterShard(election_id=election_id, name=name, shard=0, count=count))
+    for election_id, count in pending_votes:
+        shards.append(ElectionCounterShard(election_id=election_id, name='pending_votes', shard=0, count=count))
+
+    ElectionCounterShard.objects.bulk_create(shards, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0014_emailcampaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElectionCounterShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('shard', models.SmallIntegerField()),
+                ('count', models.BigIntegerField(default=0)),
+                ('election', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='helios.election')),
+            ],
+            options={
+                'unique_together': {('election', 'name', 'shard')},
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
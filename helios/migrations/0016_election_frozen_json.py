@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0015_election_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='election',
+            name='frozen_hash',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='election',
+            name='frozen_json',
+            field=models.TextField(null=True),
+        ),
+    ]
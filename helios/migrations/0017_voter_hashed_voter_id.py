@@ -0,0 +1,41 @@
+# Generated by Django 5.2.9 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+from helios.crypto.utils import hash_b64
+
+
+def backfill_hashed_voter_ids(apps, schema_editor):
+    Voter = apps.get_model('helios', 'Voter')
+
+    voters = []
+    for voter in Voter.objects.filter(hashed_voter_id=None).select_related('user') \
+            .only('id', 'voter_login_id', 'voter_email', 'user__user_id').iterator(chunk_size=1000):
+        # same as Voter.voter_id_hash, voters without a user go by their email
+        voter_id = voter.voter_login_id or (voter.user.user_id if voter.user else voter.voter_email)
+        if voter_id is None:
+            continue
+        voter.hashed_voter_id = hash_b64(voter_id)
+        voters.append(voter)
+
+        if len(voters) >= 1000:
+            Voter.objects.bulk_update(voters, ['hashed_voter_id'])
+            voters = []
+
+    Voter.objects.bulk_update(voters, ['hashed_voter_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helios', '0016_election_frozen_json'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voter',
+            name='hashed_voter_id',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.RunPython(backfill_hashed_voter_ids, migrations.RunPython.noop),
+    ]
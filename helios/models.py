@@ -9,11 +9,20 @@ Ben Adida
 import copy
 import csv
 import datetime
+import logging
+import multiprocessing
+import random
+import time
 import uuid
 
 import bleach
 from django.conf import settings
-from django.db import models, transaction
+from django.core import mail
+from django.core.cache import cache
+from django.db import connections, models, transaction
+from django.db.models import F, Max, Min, Sum
+from django.db.models.functions import Cast, Substr
+from django.urls import reverse
 from validate_email import validate_email
 
 from helios import datatypes
@@ -24,7 +33,8 @@ from helios_auth.jsonfield import JSONField
 from helios_auth.models import User, AUTH_SYSTEMS
 from .crypto import algs
 from .crypto.elgamal import Cryptosystem
-from .crypto.utils import random, hash_b64
+from .crypto.utils import hash_b64
+from .email_templates import EmailTemplates
 
 
 class HeliosModel(models.Model, datatypes.LDObjectContainer):
@@ -90,12 +100,18 @@ class Election(HeliosModel):
   # voter aliases?
   use_voter_aliases = models.BooleanField(default=False)
 
+  # last alias number handed out, only ever changed by reserve_alias_nums
+  alias_counter = models.IntegerField(default=0)
+
   # auditing is not for everyone
   use_advanced_audit_features = models.BooleanField(default=True, null=False)
 
   # randomize candidate order?
   randomize_answer_order = models.BooleanField(default=False, null=False)
 
+  # keep a running encrypted tally as votes are stored, so computing the tally is instant
+  incremental_tally_p = models.BooleanField(default=False, null=False)
+
   # where votes should be cast
   cast_url = models.CharField(max_length = 500)
 
@@ -138,11 +154,19 @@ class Election(HeliosModel):
   # the hash of all voters (stored for large numbers)
   voters_hash = models.CharField(max_length=100, null=True)
 
+  # the JSON of the election and its hash, fixed once the election is frozen
+  frozen_json = models.TextField(null=True)
+  frozen_hash = models.CharField(max_length=100, null=True)
+
   # encrypted tally, each a JSON string
   # used only for homomorphic tallies
   encrypted_tally = LDObjectField(type_hint = 'legacy/Tally',
                                   null=True)
 
+  # running product of the stored votes, only with incremental_tally_p
+  running_tally = LDObjectField(type_hint = 'legacy/Tally',
+                                null=True)
+
   # results of the election
   result = LDObjectField(type_hint = 'legacy/Result',
                          null=True)
@@ -161,9 +185,68 @@ class Election(HeliosModel):
   objects = ElectionManager()  # default manager excludes deleted elections
   objects_with_deleted = models.Manager()  # includes all elections
 
+  # heavy columns left out of cached elections, they are loaded from the database when a view uses them
+  CACHE_DEFERRED_FIELDS = ('public_key', 'private_key', 'questions', 'eligibility',
+                           'encrypted_tally', 'running_tally', 'result', 'result_proof', 'frozen_json')
+
   class Meta:
     app_label = 'helios'
 
+  def save(self, *args, **kwargs):
+    # the alias counter moves on in the database as voters are added,
+    # saving this copy of the election must not put an old value back, nor fields that were never loaded
+    if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+      deferred_fields = self.get_deferred_fields()
+      kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                 if not field.primary_key and field.name != 'alias_counter'
+                                 and field.attname not in deferred_fields]
+    super(Election, self).save(*args, **kwargs)
+
+    self.invalidate_cache()
+    # again once committed, in case another request cached the old row in the meantime
+    transaction.on_commit(self.invalidate_cache)
+
+  def delete(self, *args, **kwargs):
+    result = super(Election, self).delete(*args, **kwargs)
+    self.invalidate_cache()
+    return result
+
+  @staticmethod
+  def _new_cache_version():
+    # when it was made, then random, so entries stored under an evicted version are never used again
+    return '%d-%s' % (time.time(), uuid.uuid4().hex)
+
+  @classmethod
+  def _cache_version(cls, election_uuid):
+    shared_cache = utils.shared_cache()
+    version_key = 'helios:election-version:%s' % election_uuid
+    version = shared_cache.get(version_key)
+    if version is None:
+      shared_cache.add(version_key, cls._new_cache_version(), timeout=None)
+      version = shared_cache.get(version_key)
+    return version
+
+  def invalidate_cache(self):
+    utils.shared_cache().set('helios:election-version:%s' % self.uuid, self._new_cache_version(), timeout=None)
+    self._cached_version = None
+
+  @property
+  def cache_version(self):
+    """
+    changes whenever the election, its trustees or its result change, read once per election object.
+    cached pages and fragments of the election are keyed on it.
+    """
+    if getattr(self, '_cached_version', None) is None:
+      self._cached_version = Election._cache_version(self.uuid)
+    return self._cached_version
+
+  @property
+  def cache_version_time(self):
+    """
+    the unix time at which the cache version was made
+    """
+    return int(self.cache_version.split('-', 1)[0])
+
   # metadata for the election
   @property
   def metadata(self):
@@ -180,7 +263,7 @@ class Election(HeliosModel):
 
   @property
   def num_cast_votes(self):
-    return self.voter_set.exclude(vote=None).count()
+    return self.get_counters()['cast_votes']
 
   @property
   def num_pending_votes(self):
@@ -189,16 +272,52 @@ class Election(HeliosModel):
     These are votes still waiting in the queue to be processed.
     Excludes quarantined votes which are intentionally held.
     """
-    return CastVote.objects.filter(
-      voter__election=self,
-      verified_at=None,
-      invalidated_at=None,
-      quarantined_p=False
-    ).count()
+    return self.get_counters()['pending_votes']
 
   @property
   def num_voters(self):
-    return self.voter_set.count()
+    return self.get_counters()['voters']
+
+  def get_counters(self):
+    """
+    the voters, cast_votes and pending_votes counters, read once per election object
+    """
+    if getattr(self, '_counters', None) is None:
+      self._counters = ElectionCounterShard.get_counts([self.id])[self.id]
+    return self._counters
+
+  @classmethod
+  def load_counters(cls, elections):
+    """
+    read the counters of all the elections in one query, returns the elections as a list
+    """
+    elections = list(elections)
+    counts = ElectionCounterShard.get_counts([election.id for election in elections])
+    for election in elections:
+      election._counters = counts[election.id]
+    return elections
+
+  def increment_counter(self, name, delta=1):
+    if delta:
+      ElectionCounterShard.increment(self.id, name, delta)
+    self._counters = None
+
+  def recount(self):
+    """
+    count voters and votes again from their tables, in case the counters were bypassed
+    """
+    with transaction.atomic():
+      utils.lock_row(Election, self.id)
+      counts = {
+        'voters': self.voter_set.count(),
+        'cast_votes': self.voter_set.exclude(vote=None).count(),
+        'pending_votes': CastVote.objects.filter(voter__election=self, verified_at=None, invalidated_at=None,
+                                                 quarantined_p=False).count(),
+      }
+      ElectionCounterShard.objects.filter(election=self).delete()
+      ElectionCounterShard.objects.bulk_create([ElectionCounterShard(election=self, name=name, shard=0, count=count)
+                                                for name, count in counts.items()])
+    self._counters = counts
 
   @property
   def num_trustees(self):
@@ -206,14 +325,21 @@ class Election(HeliosModel):
 
   @property
   def last_alias_num(self):
-    """
-    FIXME: we should be tracking alias number, not the V* alias which then
-    makes things a lot harder
-    """
     if not self.use_voter_aliases:
       return None
 
-    return utils.one_val_raw_sql("select max(cast(substr(alias, 2) as integer)) from " + Voter._meta.db_table + " where election_id = %s", [self.id]) or 0
+    return Election.objects_with_deleted.filter(id=self.id).values_list('alias_counter', flat=True).get()
+
+  def reserve_alias_nums(self, count=1):
+    """
+    hand out the next count alias numbers, returned as a range.
+    the counter is bumped in place, so the election row stays locked until the surrounding transaction ends.
+    """
+    with transaction.atomic():
+      Election.objects_with_deleted.filter(id=self.id).update(alias_counter=F('alias_counter') + count)
+      self.alias_counter = Election.objects_with_deleted.filter(id=self.id).values_list('alias_counter', flat=True).get()
+
+    return range(self.alias_counter - count + 1, self.alias_counter + 1)
 
   @property
   def encrypted_tally_hash(self):
@@ -282,6 +408,28 @@ class Election(HeliosModel):
     except cls.DoesNotExist:
       return None
 
+  @classmethod
+  def get_cached_by_uuid(cls, election_uuid):
+    """
+    like get_by_uuid, from the election cache when HELIOS_ELECTION_CACHE_SECONDS is set.
+    the heavy fields in CACHE_DEFERRED_FIELDS are only loaded if they are used.
+    """
+    if not settings.HELIOS_ELECTION_CACHE_SECONDS:
+      return cls.get_by_uuid(election_uuid)
+
+    version = cls._cache_version(election_uuid)
+    key = 'helios:election:%s:%s' % (election_uuid, version)
+    election = cache.get(key)
+    if election is None:
+      try:
+        election = cls.objects.select_related().defer(*cls.CACHE_DEFERRED_FIELDS).get(uuid=election_uuid)
+      except cls.DoesNotExist:
+        return None
+      cache.set(key, election, settings.HELIOS_ELECTION_CACHE_SECONDS)
+
+    election._cached_version = version
+    return election
+
   @classmethod
   def get_by_short_name(cls, short_name, include_deleted=False):
     try:
@@ -483,17 +631,98 @@ class Election(HeliosModel):
   def ready_for_tallying(self):
     return datetime.datetime.utcnow() >= self.tallying_starts_at
 
-  def compute_tally(self):
+  # votes read per query when computing the tally
+  TALLY_CHUNK_SIZE = 1000
+
+  def compute_tally(self, processes=1):
     """
     tally the election, assuming votes already verified
+
+    with an up to date running tally, that tally is simply taken over.
+
+    with processes > 1 the voters are split into that many id ranges, whose
+    partial products are computed in a pool of worker processes and then
+    multiplied together. The product does not depend on the order, so the
+    tally is the same as the one computed serially. A daemonic process, like
+    a prefork Celery worker child, cannot start a pool and tallies serially.
     """
+    if self.running_tally is not None and self.running_tally.num_tallied == self.num_cast_votes:
+      self.encrypted_tally = self.running_tally
+      self.save()
+      return
+
     tally = self.init_tally()
-    for voter in self.voter_set.exclude(vote=None):
-      tally.add_vote(voter.vote, verify_p=False)
+
+    # the workers open their own database connections, which would not see an uncommitted transaction
+    if processes > 1 and not multiprocessing.current_process().daemon and \
+        not transaction.get_connection().in_atomic_block:
+      shards = [(self.id, min_id, max_id) for min_id, max_id in self.tally_shards(processes)]
+
+      # the forked workers must not share our database connections
+      connections.close_all()
+      with multiprocessing.Pool(min(processes, len(shards) or 1)) as pool:
+        for products in pool.imap_unordered(compute_tally_shard, shards):
+          tally.add_products(*products)
+    else:
+      tally.add_raw_votes(self.iter_raw_votes())
 
     self.encrypted_tally = tally
     self.save()
 
+  def update_running_tally(self, added_votes=(), removed_votes=()):
+    """
+    multiply newly stored votes into the running tally, and take out the votes they replace.
+    the election row is locked, so concurrent updates are applied one after the other.
+    """
+    with transaction.atomic():
+      election = Election.objects_with_deleted.select_for_update().get(id=self.id)
+      running_tally = election.running_tally
+      if running_tally is None:
+        return
+
+      running_tally.init_election(election)
+      running_tally.add_products(*running_tally.vote_products(added_votes))
+      running_tally.remove_products(*running_tally.vote_products(removed_votes))
+
+      Election.objects_with_deleted.filter(id=self.id).update(running_tally=running_tally)
+      self.running_tally = running_tally
+
+  def tally_shards(self, num_shards):
+    """
+    split the ids of the voters who voted into num_shards contiguous (min_id, max_id) ranges
+    """
+    id_range = self.voter_set.exclude(vote=None).aggregate(min_id=Min('id'), max_id=Max('id'))
+    if id_range['min_id'] is None:
+      return []
+
+    min_id, max_id = id_range['min_id'], id_range['max_id']
+    shard_size = -(-(max_id - min_id + 1) // num_shards)
+    return [(start, min(start + shard_size - 1, max_id)) for start in range(min_id, max_id + 1, shard_size)]
+
+  def iter_raw_votes(self, chunk_size=None, min_id=None, max_id=None):
+    """
+    the JSON of every voter's last cast vote, unparsed, read in keyset-paginated chunks
+    so that only one chunk is ever in memory. min_id and max_id restrict the voter ids.
+    """
+    chunk_size = chunk_size or self.TALLY_CHUNK_SIZE
+
+    # cast to text so the vote is not deserialized by the LDObjectField
+    votes = self.voter_set.exclude(vote=None).order_by('id').values_list('id', Cast('vote', models.TextField()))
+    if max_id is not None:
+      votes = votes.filter(id__lte=max_id)
+
+    last_id = None if min_id is None else min_id - 1
+    while True:
+      chunk = votes if last_id is None else votes.filter(id__gt=last_id)
+
+      num_rows = 0
+      for last_id, raw_vote in chunk[:chunk_size].iterator(chunk_size=chunk_size):
+        num_rows += 1
+        yield raw_vote
+
+      if num_rows < chunk_size:
+        break
+
   def ready_for_decryption(self):
     return self.encrypted_tally is not None
 
@@ -546,13 +775,14 @@ class Election(HeliosModel):
       voters_json = utils.to_json([v.toJSONDict() for v in voters])
       self.voters_hash = hash_b64(voters_json)
 
-  def increment_voters(self):
-    ## FIXME
-    return 0
+  def increment_voters(self, delta=1):
+    self.increment_counter('voters', delta)
+
+  def increment_cast_votes(self, delta=1):
+    self.increment_counter('cast_votes', delta)
 
-  def increment_cast_votes(self):
-    ## FIXME
-    return 0
+  def increment_pending_votes(self, delta=1):
+    self.increment_counter('pending_votes', delta)
 
   def set_eligibility(self):
     """
@@ -617,11 +847,46 @@ class Election(HeliosModel):
 
     self.public_key = combined_pk
 
+    # votes can only be cast from now on, so the running tally starts out empty
+    if self.incremental_tally_p:
+      self.running_tally = self.init_tally()
+      self.running_tally.reset()
+
+    # nothing in the election JSON changes from now on
+    self.set_frozen_json()
+
     # log it
     self.append_log(ElectionLog.FROZEN)
 
     self.save()
 
+  def set_frozen_json(self):
+    # a new LD object, the one on self.ld_object may predate the public key
+    self.frozen_json = datatypes.LDObject.instantiate(self).serialize()
+    self.frozen_hash = hash_b64(self.frozen_json)
+
+  def toJSON(self):
+    if self.frozen_json:
+      return self.frozen_json
+    return super(Election, self).toJSON()
+
+  @property
+  def hash(self):
+    """
+    ballots are checked against it, once frozen it is kept instead of serializing the election every time
+    """
+    if self.frozen_hash:
+      return self.frozen_hash
+
+    if not self.frozen_at:
+      return super(Election, self).hash
+
+    # frozen before the JSON was kept
+    self.set_frozen_json()
+    if self.id:
+      Election.objects_with_deleted.filter(id=self.id).update(frozen_json=self.frozen_json, frozen_hash=self.frozen_hash)
+    return self.frozen_hash
+
   def soft_delete(self):
     """
     Soft delete the election by setting deleted_at timestamp.
@@ -771,6 +1036,58 @@ class Election(HeliosModel):
     return prettified_result
 
 
+def compute_tally_shard(args):
+  """
+  runs in a worker process: the partial tally products of the voters with ids in [min_id, max_id]
+  """
+  election_id, min_id, max_id = args
+  election = Election.objects.get(id=election_id)
+  return election.init_tally().vote_products(election.iter_raw_votes(min_id=min_id, max_id=max_id))
+
+
+class ElectionCounterShard(models.Model):
+  """
+  a slice of one of the counters of an election.
+  every increment goes to a random shard, so concurrent transactions rarely wait on the same row,
+  and the value of a counter is the sum of its shards.
+  """
+  COUNTER_NAMES = ('voters', 'cast_votes', 'pending_votes')
+  NUM_SHARDS = 8
+
+  election = models.ForeignKey(Election, on_delete=models.CASCADE)
+  name = models.CharField(max_length=50)
+  shard = models.SmallIntegerField()
+  count = models.BigIntegerField(default=0)
+
+  class Meta:
+    app_label = 'helios'
+    unique_together = (('election', 'name', 'shard'),)
+
+  @classmethod
+  def increment(cls, election_id, name, delta=1):
+    """
+    add delta to the counter, as part of the current transaction
+    """
+    from django.db import connection
+    cursor = connection.cursor()
+
+    table = cls._meta.db_table
+    cursor.execute("insert into " + table + " (election_id, name, shard, count) values (%s, %s, %s, %s) "
+                   "on conflict (election_id, name, shard) do update set count = " + table + ".count + excluded.count",
+                   [election_id, name, random.randrange(cls.NUM_SHARDS), delta])
+
+  @classmethod
+  def get_counts(cls, election_ids):
+    """
+    {election_id: {counter name: value}} for all the given elections
+    """
+    counts = dict((election_id, dict((name, 0) for name in cls.COUNTER_NAMES)) for election_id in election_ids)
+    rows = cls.objects.filter(election_id__in=list(counts)).values_list('election_id', 'name').annotate(total=Sum('count'))
+    for election_id, name, total in rows:
+      counts[election_id][name] = total
+    return counts
+
+
 class ElectionLog(models.Model):
   """
   a log of events for an election
@@ -811,11 +1128,38 @@ class VoterFile(models.Model):
   processing_finished_at = models.DateTimeField(auto_now_add=False, null=True)
   num_voters = models.IntegerField(null=True)
 
+  # progress of the processing
+  num_rows_processed = models.IntegerField(default=0)
+  num_rows_rejected = models.IntegerField(default=0)
+
   class Meta:
     app_label = 'helios'
 
-  def itervoters(self):
-    if self.voter_file_content:
+  # characters read at a time from the stored content or the uploaded file
+  CONTENT_CHUNK_SIZE = 1 << 20
+
+  # rows per batch when processing a voter file, each batch is written in one transaction
+  BULK_BATCH_SIZE = 500
+
+  def itercontent(self):
+    """
+    the content of the voter file, a chunk at a time
+    """
+    if 'voter_file_content' in self.get_deferred_fields():
+      # the content was not loaded with the row, read it from the database a slice at a time
+      position = 1
+      while True:
+        chunk = (VoterFile.objects.filter(id=self.id)
+                 .annotate(chunk=Substr('voter_file_content', position, self.CONTENT_CHUNK_SIZE))
+                 .values_list('chunk', flat=True).get())
+        if not chunk:
+          break
+        yield chunk
+        position += len(chunk)
+
+      if position > 1:
+        return
+    elif self.voter_file_content:
       if isinstance(self.voter_file_content, str):
         content = self.voter_file_content
       elif isinstance(self.voter_file_content, bytes):
@@ -824,19 +1168,40 @@ class VoterFile(models.Model):
         raise TypeError("voter_file_content is of type {0} instead of str or bytes"
                         .format(str(type(self.voter_file_content))))
 
-      # now we have to handle non-universal-newline stuff
-      # we do this in a simple way: replace all \r with \n
-      # then, replace all double \n with single \n
-      # this should leave us with only \n
-      # We then split the contents by line
-      content = content.replace('\r', '\n').replace('\n\n', '\n').split('\n')
-    else:
-      content = open(self.voter_file.path, encoding='utf-8', newline='')
+      for start in range(0, len(content), self.CONTENT_CHUNK_SIZE):
+        yield content[start:start + self.CONTENT_CHUNK_SIZE]
+      return
+
+    with open(self.voter_file.path, encoding='utf-8', newline='') as f:
+      for chunk in iter(lambda: f.read(self.CONTENT_CHUNK_SIZE), ''):
+        yield chunk
 
-    reader = csv.reader(content, delimiter=',')
+  def iterlines(self):
+    """
+    the lines of the voter file, without line endings.
+    \\r\\n, \\r and \\n all end a line, blank lines are dropped.
+    """
+    rest = ''
+    for chunk in self.itercontent():
+      lines = (rest + chunk.replace('\r', '\n')).split('\n')
+      # the last line may continue in the next chunk
+      rest = lines.pop()
+      for line in lines:
+        if line:
+          yield line
+
+    if rest:
+      yield rest
+
+  def iterrows(self):
+    """
+    (voter, None) for every valid row, (None, error message) for every invalid one.
+    lines with fewer than two fields are skipped.
+    """
+    reader = csv.reader(self.iterlines(), delimiter=',')
 
     for voter_fields in reader:
-      # bad line
+      # bad line, skipped like a blank one
       if len(voter_fields) < 2:
         continue
 
@@ -844,7 +1209,8 @@ class VoterFile(models.Model):
       voter_id = voter_fields[1].strip()
 
       if not voter_type in AUTH_SYSTEMS:
-        raise Exception("invalid voter type '%s' for voter id '%s', available voter types are %s" % (voter_type, voter_id, ",".join(AUTH_SYSTEMS.keys())))
+        yield None, "invalid voter type '%s' for voter id '%s', available voter types are %s" % (voter_type, voter_id, ",".join(AUTH_SYSTEMS.keys()))
+        continue
 
       # default to having email be the same as voter_id
       voter_email = voter_id
@@ -852,7 +1218,8 @@ class VoterFile(models.Model):
         # but if it's supplied, it will be the 3rd field.
         voter_email = voter_fields[2].strip()
       if voter_type == "password" and not validate_email(voter_email):
-        raise Exception("invalid voter email '%s' for voter id '%s'" % (voter_email, voter_id))
+        yield None, "invalid voter email '%s' for voter id '%s'" % (voter_email, voter_id)
+        continue
 
       # same thing for voter display name.
       voter_name = voter_email
@@ -865,23 +1232,88 @@ class VoterFile(models.Model):
         'voter_id': voter_id,
         'email': voter_email,
         'name': voter_name,
-      }
+      }, None
+
+  def itervoters(self):
+    for voter, error in self.iterrows():
+      if error:
+        raise Exception(error)
+      yield voter
 
   def process(self):
+    """
+    import the voters of the file, one batch at a time, recording the progress on the way.
+    invalid rows are counted and skipped.
+    """
     self.processing_started_at = datetime.datetime.utcnow()
+    self.num_rows_processed = 0
+    self.num_rows_rejected = 0
     self.save()
 
-    voters = list(self.itervoters())
-    self.num_voters = len(voters)
-    random.shuffle(voters)
+    # every row that can become a voter gets its alias number out of one range reserved for the whole file,
+    # in a random order that has nothing to do with the order of the file. rows that don't become voters,
+    # like duplicates or opted-out voters, leave gaps in the range.
+    self._alias_nums = None
+    if self.election.use_voter_aliases:
+      num_valid_rows = sum(1 for _, error in self.iterrows() if not error)
+      alias_nums = self.election.reserve_alias_nums(num_valid_rows)
+      permutation = utils.random_permutation(num_valid_rows)
+      self._alias_nums = (alias_nums[permutation(row_num)] for row_num in range(num_valid_rows))
 
     opted_out_voters = []
     successful_voters = 0
+    num_voters = 0
+
+    batch = []
+    for voter, error in self.iterrows():
+      self.num_rows_processed += 1
+      if error:
+        self.num_rows_rejected += 1
+      else:
+        batch.append(voter)
+        num_voters += 1
+
+      if len(batch) >= self.BULK_BATCH_SIZE:
+        successful_voters += self._import_batch(batch, opted_out_voters)
+        batch = []
+
+    successful_voters += self._import_batch(batch, opted_out_voters)
+
+    # Notify admin if there were opted-out voters
+    if opted_out_voters:
+        from . import tasks
+        tasks.notify_admin_opted_out_voters.delay(self.election.id, opted_out_voters)
+
+    self.num_voters = num_voters
+    self.processing_finished_at = datetime.datetime.utcnow()
+    self.save()
+
+    return successful_voters
 
+  def _import_batch(self, voters, opted_out_voters):
+    """
+    create the voters of one batch that are not in the election yet, and save the progress along with them.
+    voters that have opted out are appended to opted_out_voters.
+    """
+    election = self.election
+
+    # one opt-out lookup for the whole batch; users are registered under their user id,
+    # so that is checked too, as register_user_in_election does
+    opted_out_emails = EmailOptOut.filter_opted_out(
+      [voter['email'] for voter in voters] +
+      [voter['voter_id'] for voter in voters if voter['voter_type'] != 'password'])
+
+    # voters of this batch that are already in the election, the new ones are added as we go,
+    # so duplicates within the batch are skipped too
+    existing_login_ids = set(election.voter_set.filter(voter_login_id__in=[voter['voter_id'] for voter in voters])
+                             .values_list('voter_login_id', flat=True))
+
+    accepted_voters = []
     for voter in voters:
       # Check if email is opted out before processing
       voter_email = voter['email']
-      if voter_email and EmailOptOut.is_opted_out(voter_email):
+      if (voter_email and voter_email in opted_out_emails) or \
+          (voter['voter_type'] != 'password' and voter['voter_id'] in opted_out_emails):
           opted_out_voters.append({
               'email': voter_email,
               'name': voter['name'],
@@ -890,43 +1322,66 @@ class VoterFile(models.Model):
           })
           continue
 
+      if voter['voter_id'] in existing_login_ids:
+          continue
+      existing_login_ids.add(voter['voter_id'])
+      accepted_voters.append(voter)
+
+    users = self._get_or_create_users([voter for voter in accepted_voters if voter['voter_type'] != 'password'])
+    existing_user_ids = set(election.voter_set.filter(user__in=[user.id for user in users.values()])
+                            .values_list('user_id', flat=True))
+
+    new_voters = []
+    for voter in accepted_voters:
       if voter['voter_type'] == 'password':
-          # does voter for this user already exist
-          existing_voter = Voter.get_by_election_and_voter_id(self.election, voter['voter_id'])
-          if existing_voter:
-              continue
-          # create the voter
-          voter_uuid = str(uuid.uuid4())
-          new_voter = Voter(uuid=voter_uuid, user = None, voter_login_id = voter['voter_id'],
-              voter_name = voter['name'], voter_email = voter['email'], election = self.election)
+          new_voter = Voter(uuid=str(uuid.uuid4()), user = None, voter_login_id = voter['voter_id'],
+              voter_name = voter['name'], voter_email = voter['email'], election = election)
           new_voter.generate_password()
-          election=self.election
-          if election.use_voter_aliases:
-              # Use transaction to ensure alias assignment is atomic
-              with transaction.atomic():
-                  utils.lock_row(Election, election.id)
-                  alias_num = election.last_alias_num + 1
-                  new_voter.alias = "V%s" % alias_num
-                  new_voter.save()
-          else:
-              new_voter.save()
-          successful_voters += 1
       else:
-          user, _ = User.objects.get_or_create(user_type=voter['voter_type'], user_id=voter['voter_id'], defaults = {'name': voter['voter_id'], 'info': {}, 'token': None})
-          existing_voter = Voter.get_by_election_and_user(self.election, user)
-          if not existing_voter:
-              Voter.register_user_in_election(user, self.election)
-              successful_voters += 1
+          user = users[(voter['voter_type'], voter['voter_id'])]
+          if user.id in existing_user_ids:
+              continue
+          existing_user_ids.add(user.id)
+          # same fields as register_user_in_election
+          new_voter = Voter(uuid=str(uuid.uuid4()), user = user, election = election,
+              voter_login_id = user.user_id, voter_email = user.info.get('email') or user.user_id)
+      new_voter.set_voter_id_hash()
+      new_voters.append(new_voter)
+
+    with transaction.atomic():
+      # the voters get their aliases along with them, see process
+      if election.use_voter_aliases:
+        for new_voter in new_voters:
+          new_voter.alias = "V%s" % next(self._alias_nums)
+
+      Voter.objects.bulk_create(new_voters)
+      election.increment_voters(len(new_voters))
+      VoterFile.objects.filter(id=self.id).update(num_rows_processed=self.num_rows_processed,
+                                                  num_rows_rejected=self.num_rows_rejected)
+
+    return len(new_voters)
+
+  def _get_or_create_users(self, voters):
+    """
+    the users for (voter_type, voter_id) of the given voters, created if they don't exist yet
+    """
+    user_ids_by_type = {}
+    for voter in voters:
+      user_ids_by_type.setdefault(voter['voter_type'], set()).add(voter['voter_id'])
 
-    # Notify admin if there were opted-out voters
-    if opted_out_voters:
-        from . import tasks
-        tasks.notify_admin_opted_out_voters.delay(self.election.id, opted_out_voters)
+    users = {}
+    for user_type, user_ids in user_ids_by_type.items():
+      for user in User.objects.filter(user_type=user_type, user_id__in=user_ids):
+        users[(user_type, user.user_id)] = user
 
-    self.processing_finished_at = datetime.datetime.utcnow()
-    self.save()
+    new_users = [User(user_type=user_type, user_id=user_id, name=user_id, info={}, token=None)
+                 for user_type, user_ids in user_ids_by_type.items()
+                 for user_id in user_ids if (user_type, user_id) not in users]
+    User.objects.bulk_create(new_users)
+    for user in new_users:
+      users[(user.user_type, user.user_id)] = user
 
-    return successful_voters
+    return users
 
 class Voter(HeliosModel):
   election = models.ForeignKey(Election, on_delete=models.CASCADE)
@@ -957,13 +1412,68 @@ class Voter(HeliosModel):
   vote_hash = models.CharField(max_length = 100, null=True)
   cast_at = models.DateTimeField(auto_now_add=False, null=True)
 
+  # voter_id_hash, computed when the voter is saved
+  hashed_voter_id = models.CharField(max_length = 100, null=True)
+
   class Meta:
     unique_together = (('election', 'voter_login_id'))
     app_label = 'helios'
 
+  # what the public voter and ballot lists read, see iter_by_election
+  PUBLIC_LIST_FIELDS = ('election', 'uuid', 'alias', 'voter_login_id', 'voter_name', 'voter_email', 'vote_hash', 'cast_at',
+                        'hashed_voter_id', 'user__user_type', 'user__user_id', 'user__name')
+
   def __init__(self, *args, **kwargs):
     super(Voter, self).__init__(*args, **kwargs)
 
+  # the fields voter_id_hash is computed from
+  VOTER_ID_FIELDS = ('user', 'voter_login_id', 'voter_email')
+
+  def save(self, *args, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is None:
+      self.set_voter_id_hash()
+    elif set(update_fields) & set(self.VOTER_ID_FIELDS):
+      self.set_voter_id_hash()
+      kwargs['update_fields'] = list(update_fields) + ['hashed_voter_id']
+
+    with transaction.atomic():
+      adding = self._state.adding
+      super(Voter, self).save(*args, **kwargs)
+      if adding:
+        self.election.increment_voters(1)
+        if self.vote is not None:
+          self.election.increment_cast_votes(1)
+
+  def delete(self, *args, **kwargs):
+    with transaction.atomic():
+      # lock the row first, so a ballot stored concurrently is either counted here or not stored at all
+      list(Voter.objects.select_for_update().filter(id=self.id).values_list('id'))
+      has_vote = Voter.objects.filter(id=self.id).exclude(vote=None).exists()
+      num_pending_votes = CastVote.objects.filter(voter=self, verified_at=None, invalidated_at=None, quarantined_p=False).count()
+      result = super(Voter, self).delete(*args, **kwargs)
+      self.election.increment_voters(-1)
+      self.election.increment_cast_votes(-1 if has_vote else 0)
+      self.election.increment_pending_votes(-num_pending_votes)
+    return result
+
+  @classmethod
+  def delete_by_election(cls, election):
+    """
+    remove all the voters of the election, returns how many there were
+    """
+    with transaction.atomic():
+      voters = cls.objects.filter(election=election)
+      num_cast_votes = voters.exclude(vote=None).count()
+      num_pending_votes = CastVote.objects.filter(voter__election=election, verified_at=None, invalidated_at=None,
+                                                  quarantined_p=False).count()
+      _, num_deleted = voters.delete()
+      num_voters = num_deleted.get(cls._meta.label, 0)
+      election.increment_voters(-num_voters)
+      election.increment_cast_votes(-num_cast_votes)
+      election.increment_pending_votes(-num_pending_votes)
+    return num_voters
+
   def get_user(self):
     # stub the user so code is not full of IF statements
     return self.user or User(user_type='password', user_id=self.voter_email, name=self.voter_name, info={})
@@ -986,9 +1496,7 @@ class Voter(HeliosModel):
 
     # do we need to generate an alias?
     if election.use_voter_aliases:
-      utils.lock_row(Election, election.id)
-      alias_num = election.last_alias_num + 1
-      voter.alias = "V%s" % alias_num
+      voter.alias = "V%s" % election.reserve_alias_nums(1)[0]
 
     voter.save()
     return voter
@@ -998,7 +1506,7 @@ class Voter(HeliosModel):
     """
     FIXME: review this for non-GAE?
     """
-    query = cls.objects.filter(election = election)
+    query = cls.objects.filter(election = election).select_related('user')
 
     # the boolean check is not stupid, this is ternary logic
     # none means don't care if it's cast or not
@@ -1026,6 +1534,37 @@ class Voter(HeliosModel):
 
     return query
 
+  @classmethod
+  def iter_by_election(cls, election, cast=None, after=None, after_uuid=None, limit=None, chunk_size=500):
+    """
+    the voters of the election for the public voter and ballot lists, streamed from the database
+    with only the columns those lists need.
+
+    keyset order: voters who cast a ballot by (cast_at, uuid), starting after the (after, after_uuid) cursor,
+    all the others by uuid, starting after after_uuid.
+    """
+    query = cls.objects.filter(election=election).select_related('user').only(*cls.PUBLIC_LIST_FIELDS)
+
+    if cast is True:
+      query = query.exclude(cast_at=None).order_by('cast_at', 'uuid')
+      if after and after_uuid:
+        query = query.filter(models.Q(cast_at__gt=after) | models.Q(cast_at=after, uuid__gt=after_uuid))
+      elif after:
+        query = query.filter(cast_at__gt=after)
+    else:
+      if cast is False:
+        query = query.filter(cast_at=None)
+      query = query.order_by('uuid')
+      if after_uuid:
+        query = query.filter(uuid__gt=after_uuid)
+
+    if limit:
+      query = query[:limit]
+
+    for voter in query.iterator(chunk_size=chunk_size):
+      voter.election = election
+      yield voter
+
   @classmethod
   def get_all_by_election_in_chunks(cls, election, cast=None, chunk=100):
     return cls.get_by_election(election)
@@ -1069,7 +1608,21 @@ class Voter(HeliosModel):
     if not self.vote_hash:
       return None
 
-    return CastVote.objects.get(vote_hash = self.vote_hash).vote_tinyhash
+    if not hasattr(self, '_vote_tinyhash'):
+      self._vote_tinyhash = CastVote.objects.get(vote_hash = self.vote_hash).vote_tinyhash
+    return self._vote_tinyhash
+
+  @classmethod
+  def prefetch_vote_tinyhashes(cls, voters):
+    """
+    load the tinyhashes of the latest castvotes of all the voters in one query
+    """
+    vote_hashes = [voter.vote_hash for voter in voters if voter.vote_hash]
+    tinyhashes = dict(CastVote.objects.filter(vote_hash__in=vote_hashes).values_list('vote_hash', 'vote_tinyhash')) \
+      if vote_hashes else {}
+    for voter in voters:
+      if voter.vote_hash:
+        voter._vote_tinyhash = tinyhashes.get(voter.vote_hash)
 
   @property
   def election_uuid(self):
@@ -1085,6 +1638,13 @@ class Voter(HeliosModel):
 
   @property
   def voter_id_hash(self):
+    # voters saved before the hash was stored compute it on the fly
+    return self.hashed_voter_id or self.compute_voter_id_hash()
+
+  def set_voter_id_hash(self):
+    self.hashed_voter_id = self.compute_voter_id_hash()
+
+  def compute_voter_id_hash(self):
     if self.voter_login_id:
       # for backwards compatibility with v3.0, and since it doesn't matter
       # too much if we hash the email or the unique login ID here.
@@ -1111,6 +1671,33 @@ class Voter(HeliosModel):
   def send_message(self, subject, body):
     self.get_user().send_message(subject, body)
 
+  def email_message(self, subject, body):
+    return self.get_user().email_message(subject, body)
+
+  @property
+  def email_address(self):
+    """
+    the address opt-outs and unsubscribe links refer to
+    """
+    return self.voter_email or (self.user and self.user.user_id)
+
+  def email_vars(self):
+    """
+    the template variables of an email to this voter, with an unsubscribe link
+    """
+    the_vars = {'election': self.election, 'voter': self}
+
+    voter_email = self.email_address
+    if voter_email:
+      unsubscribe_code = utils.generate_email_confirmation_code(voter_email, 'optout')
+      unsubscribe_path = reverse('optout_confirm', kwargs={'email': voter_email, 'code': unsubscribe_code})
+      the_vars.update({
+        'unsubscribe_url': f"{settings.URL_HOST}{unsubscribe_path}",
+        'unsubscribe_code': unsubscribe_code
+      })
+
+    return the_vars
+
   def can_update_status(self):
     return self.get_user().can_update_status()
 
@@ -1121,18 +1708,37 @@ class Voter(HeliosModel):
     self.voter_password = utils.random_string(length, alphabet='abcdefghjkmnopqrstuvwxyzABCDEFGHJKLMNPQRSTUVWXYZ23456789')
 
   def store_vote(self, cast_vote):
-    # only store the vote if it's cast later than the current one
-    if self.cast_at and cast_vote.cast_at < self.cast_at:
-      return
+    with transaction.atomic():
+      # read the current vote again under a lock, so concurrent ballots of this voter are stored one after the other
+      stored = Voter.objects.select_for_update().only('vote', 'vote_hash', 'cast_at').get(id=self.id)
 
-    self.vote = cast_vote.vote
-    self.vote_hash = cast_vote.vote_hash
-    self.cast_at = cast_vote.cast_at
-    self.save()
+      # only store the vote if it's cast later than the current one
+      if stored.cast_at and cast_vote.cast_at < stored.cast_at:
+        self.vote, self.vote_hash, self.cast_at = stored.vote, stored.vote_hash, stored.cast_at
+        return
+
+      superseded_vote = stored.vote
+
+      self.vote = cast_vote.vote
+      self.vote_hash = cast_vote.vote_hash
+      self.cast_at = cast_vote.cast_at
+      self.save(update_fields=['vote', 'vote_hash', 'cast_at'])
+      if superseded_vote is None:
+        self.election.increment_cast_votes(1)
+
+      if self.election.incremental_tally_p:
+        self.election.update_running_tally([cast_vote.vote], [superseded_vote] if superseded_vote else [])
 
   def last_cast_vote(self):
     return CastVote(vote = self.vote, vote_hash = self.vote_hash, cast_at = self.cast_at, voter=self)
 
+  def last_short_cast_vote_dict(self):
+    """
+    same as last_cast_vote().ld_object.short.toDict(), without building the cast vote
+    """
+    return {'cast_at': str(self.cast_at) if self.cast_at else None, 'voter_uuid': self.uuid,
+            'voter_hash': self.hash, 'vote_hash': self.vote_hash}
+
 
 class CastVote(HeliosModel):
   # the reference to the voter provides the voter_uuid
@@ -1182,6 +1788,20 @@ class CastVote(HeliosModel):
   def is_quarantined(self):
     return self.quarantined_p and not self.released_from_quarantine_at
 
+  @property
+  def is_pending(self):
+    """
+    waiting to be verified, as counted by Election.num_pending_votes
+    """
+    return not self.quarantined_p and self.verified_at is None and self.invalidated_at is None
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    cast_vote = super(CastVote, cls).from_db(db, field_names, values)
+    # what the pending_votes counter knows of this ballot
+    cast_vote._counted_pending_p = cast_vote.is_pending
+    return cast_vote
+
   def set_tinyhash(self):
     """
     find a tiny version of the hash for a URL slug.
@@ -1207,7 +1827,14 @@ class CastVote(HeliosModel):
     if not self.vote_tinyhash:
       self.set_tinyhash()
 
-    super(CastVote, self).save(*args, **kwargs)
+    with transaction.atomic():
+      super(CastVote, self).save(*args, **kwargs)
+
+      # keep the pending_votes counter of the election in step
+      counted_pending_p = getattr(self, '_counted_pending_p', False)
+      if self.is_pending != counted_pending_p:
+        self.voter.election.increment_pending_votes(-1 if counted_pending_p else 1)
+        self._counted_pending_p = self.is_pending
 
   @classmethod
   def get_by_voter(cls, voter):
@@ -1323,6 +1950,15 @@ class Trustee(HeliosModel):
 
     super(Trustee, self).save(*args, **kwargs)
 
+    # the trustees are part of the cached election pages
+    self.election.invalidate_cache()
+    transaction.on_commit(self.election.invalidate_cache)
+
+  def delete(self, *args, **kwargs):
+    result = super(Trustee, self).delete(*args, **kwargs)
+    self.election.invalidate_cache()
+    return result
+
   @classmethod
   def get_by_election(cls, election):
     return cls.objects.filter(election = election)
@@ -1362,9 +1998,44 @@ class EmailOptOut(models.Model):
   
   class Meta:
     app_label = 'helios'
+
+  # hashes per IN query in filter_opted_out, when the hashes are not cached
+  LOOKUP_BATCH_SIZE = 500
+
+  # bumped in the shared cache whenever the opt-outs change, so every process knows to reload its copy
+  VERSION_CACHE_KEY = 'helios:email_optout_version'
+
+  # (version, expiry, frozenset of all the opted-out hashes) of this process
+  _cached_hashes = None
     
   def __str__(self):
     return f"EmailOptOut {self.email_hash[:8]}... at {self.opted_out_at}"
+
+  @classmethod
+  def opted_out_hashes(cls):
+    """
+    all the opted-out hashes, kept in memory for HELIOS_EMAIL_OPTOUT_CACHE_SECONDS
+    or until an opt-out is added or removed. None if caching is off.
+    """
+    if not settings.HELIOS_EMAIL_OPTOUT_CACHE_SECONDS:
+      return None
+
+    version = utils.shared_cache().get_or_set(cls.VERSION_CACHE_KEY, 0, timeout=None)
+    cached = cls._cached_hashes
+    if cached is None or cached[0] != version or cached[1] < time.monotonic():
+      cached = (version, time.monotonic() + settings.HELIOS_EMAIL_OPTOUT_CACHE_SECONDS,
+                frozenset(cls.objects.values_list('email_hash', flat=True)))
+      cls._cached_hashes = cached
+
+    return cached[2]
+
+  @classmethod
+  def invalidate_cache(cls):
+    cls._cached_hashes = None
+    try:
+      utils.shared_cache().incr(cls.VERSION_CACHE_KEY)
+    except ValueError:
+      utils.shared_cache().set(cls.VERSION_CACHE_KEY, 1, timeout=None)
     
   @classmethod
   def is_opted_out(cls, email):
@@ -1374,9 +2045,38 @@ class EmailOptOut(models.Model):
     email_hash = utils.hash_email(email)
     if not email_hash:
       return False
+
+    hashes = cls.opted_out_hashes()
+    if hashes is not None:
+      return email_hash in hashes
       
     return cls.objects.filter(email_hash=email_hash).exists()
     
+  @classmethod
+  def filter_opted_out(cls, emails):
+    """
+    the set of the given emails that have opted out, from the cached hashes,
+    or with one query per LOOKUP_BATCH_SIZE emails
+    """
+    emails_by_hash = {}
+    for email in emails:
+      email_hash = utils.hash_email(email)
+      if email_hash:
+        emails_by_hash.setdefault(email_hash, []).append(email)
+
+    hashes = cls.opted_out_hashes()
+    if hashes is not None:
+      return set(email for email_hash, hash_emails in emails_by_hash.items() if email_hash in hashes
+                 for email in hash_emails)
+
+    email_hashes = list(emails_by_hash.keys())
+    opted_out = set()
+    for start in range(0, len(email_hashes), cls.LOOKUP_BATCH_SIZE):
+      for email_hash in cls.objects.filter(email_hash__in=email_hashes[start:start + cls.LOOKUP_BATCH_SIZE]).values_list('email_hash', flat=True):
+        opted_out.update(emails_by_hash[email_hash])
+
+    return opted_out
+
   @classmethod  
   def add_opt_out(cls, email, user_agent=None, ip_address=None):
     if not email:
@@ -1393,6 +2093,9 @@ class EmailOptOut(models.Model):
         'ip_address': ip_address
       }
     )
+
+    if created:
+      cls.invalidate_cache()
     
     return opt_out
     
@@ -1406,4 +2109,124 @@ class EmailOptOut(models.Model):
       return False
       
     deleted_count, _ = cls.objects.filter(email_hash=email_hash).delete()
+    if deleted_count:
+      cls.invalidate_cache()
     return deleted_count > 0
+
+
+class EmailCampaign(models.Model):
+  """
+  An email to many voters of an election, sent a chunk of voters at a time,
+  with its progress and failures
+  """
+  election = models.ForeignKey(Election, on_delete=models.CASCADE)
+
+  subject_template = models.CharField(max_length=200)
+  body_template = models.CharField(max_length=200)
+  extra_vars = JSONField(null=True)
+  voter_constraints_include = JSONField(null=True)
+  voter_constraints_exclude = JSONField(null=True)
+
+  created_at = models.DateTimeField(auto_now_add=True)
+  finished_at = models.DateTimeField(null=True)
+
+  # voters are emailed in id order, everyone up to this id is done
+  last_voter_id = models.IntegerField(default=0)
+
+  num_sent = models.IntegerField(default=0)
+  num_opted_out = models.IntegerField(default=0)
+  num_failed = models.IntegerField(default=0)
+  num_retries = models.IntegerField(default=0)
+
+  # voters whose message could not be sent even after retrying
+  failed_voter_uuids = JSONField(null=True)
+
+  class Meta:
+    app_label = 'helios'
+
+  def get_voters(self):
+    voters = self.election.voter_set.all()
+    if self.voter_constraints_include:
+      voters = voters.filter(**self.voter_constraints_include)
+    if self.voter_constraints_exclude:
+      voters = voters.exclude(**self.voter_constraints_exclude)
+    return voters.order_by('id')
+
+  def send_chunk(self, chunk_size, rate_limit=0, max_retries=0):
+    """
+    email the next chunk_size voters over one mail connection, at most rate_limit messages per second.
+    returns the number of voters done, 0 once the campaign is finished.
+    """
+    voters = list(self.get_voters().filter(id__gt=self.last_voter_id).select_related('user')[:chunk_size])
+    for voter in voters:
+      # all the voters share the one election object, and everything it caches
+      voter.election = self.election
+
+    if not voters:
+      self.finished_at = datetime.datetime.utcnow()
+      self.save()
+      return 0
+
+    opted_out_emails = EmailOptOut.filter_opted_out([voter.email_address for voter in voters])
+
+    templates = EmailTemplates(self.subject_template, self.body_template, self.extra_vars)
+
+    interval = 1.0 / rate_limit if rate_limit else 0
+    next_send_at = time.monotonic()
+
+    num_sent, num_opted_out, num_retries, failed_voter_uuids = 0, 0, 0, []
+    connection = mail.get_connection()
+    try:
+      for voter in voters:
+        if voter.email_address and voter.email_address in opted_out_emails:
+          num_opted_out += 1
+          continue
+
+        # a voter whose message can't be built fails like one whose message can't be sent
+        try:
+          subject, body = templates.render(voter)
+          message = voter.email_message(subject, body)
+        except Exception as e:
+          logging.warning("building the email to voter %s failed: %s" % (voter.uuid, e))
+          failed_voter_uuids.append(voter.uuid)
+          continue
+
+        # throttle
+        now = time.monotonic()
+        if next_send_at > now:
+          time.sleep(next_send_at - now)
+        next_send_at = max(next_send_at, now) + interval
+
+        for attempt in range(max_retries + 1):
+          try:
+            if message is None:
+              # auth systems that don't send plain emails send their own way
+              voter.send_message(subject, body)
+            else:
+              # a no-op while the connection is open, the backend keeps it open between messages
+              connection.open()
+              connection.send_messages([message])
+            num_sent += 1
+            break
+          except Exception as e:
+            logging.warning("sending email to voter %s failed: %s" % (voter.uuid, e))
+            # the connection may be what's broken, start over with a fresh one
+            connection.close()
+            if attempt < max_retries:
+              num_retries += 1
+            else:
+              failed_voter_uuids.append(voter.uuid)
+    finally:
+      connection.close()
+
+    # the chunks of a campaign are sent one after the other, nothing else writes these
+    self.last_voter_id = voters[-1].id
+    self.num_sent += num_sent
+    self.num_opted_out += num_opted_out
+    self.num_retries += num_retries
+    self.num_failed += len(failed_voter_uuids)
+    if failed_voter_uuids:
+      self.failed_voter_uuids = (self.failed_voter_uuids or []) + failed_voter_uuids
+    self.save()
+
+    return len(voters)
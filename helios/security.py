@@ -98,7 +98,7 @@ def get_election_by_uuid(uuid):
   if not uuid:
     raise Exception("no election ID")
       
-  return Election.get_by_uuid(uuid)
+  return Election.get_cached_by_uuid(uuid)
   
 # decorator for views that pertain to an election
 # takes parameters:
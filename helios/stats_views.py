@@ -51,7 +51,7 @@ def elections(request):
 
   total_elections = elections_paginator.count
 
-  return render_template(request, "stats_elections", {'elections' : elections_page.object_list, 'elections_page': elections_page,
+  return render_template(request, "stats_elections", {'elections' : Election.load_counters(elections_page.object_list), 'elections_page': elections_page,
                                                       'limit' : limit, 'total_elections': total_elections, 'q': q})
     
 def recent_votes(request):
@@ -75,7 +75,7 @@ def recent_problem_elections(request):
   # elections left unfrozen older than 1 day old (and younger than 10 days old, so we don't go back too far)
   elections_with_problems = Election.objects.filter(frozen_at = None, created_at__gt = datetime.datetime.utcnow() - datetime.timedelta(days=10), created_at__lt = datetime.datetime.utcnow() - datetime.timedelta(days=1) )
 
-  return render_template(request, "stats_problem_elections", {'elections' : elections_with_problems})
+  return render_template(request, "stats_problem_elections", {'elections' : Election.load_counters(elections_with_problems)})
 
 def user_search(request):
   user = require_admin(request)
@@ -95,15 +95,15 @@ def user_search(request):
   users_with_elections = []
   for found_user in found_users:
     # Get elections where user is admin (creator or additional admin)
-    elections_as_admin = Election.get_by_user_as_admin(found_user)
+    elections_as_admin = Election.load_counters(Election.get_by_user_as_admin(found_user))
 
     # Get elections where user is a voter
-    elections_as_voter = Election.get_by_user_as_voter(found_user)
+    elections_as_voter = Election.load_counters(Election.get_by_user_as_voter(found_user))
 
     # Get elections where user is a trustee (by email matching user_id)
-    elections_as_trustee = Election.objects.filter(
+    elections_as_trustee = Election.load_counters(Election.objects.filter(
       trustee__email__iexact=found_user.user_id
-    ).distinct()
+    ).distinct())
 
     users_with_elections.append({
       'user': found_user,
@@ -136,7 +136,7 @@ def deleted_elections(request):
   total_elections = elections_paginator.count
 
   return render_template(request, "stats_deleted_elections", {
-    'elections': elections_page.object_list,
+    'elections': Election.load_counters(elections_page.object_list),
     'elections_page': elections_page,
     'limit': limit,
     'total_elections': total_elections,
@@ -12,8 +12,8 @@ from django.urls import reverse
 from urllib.parse import urlparse
 
 from . import signals
-from . import utils
-from .models import CastVote, Election, Voter, VoterFile, EmailOptOut
+from .email_templates import EmailTemplates
+from .models import CastVote, Election, EmailCampaign, Voter, VoterFile, EmailOptOut
 from .view_utils import render_template_raw
 
 
@@ -44,17 +44,24 @@ def voters_email(election_id, subject_template, body_template, extra_vars={},
     voter_constraints_include are conditions on including voters
     voter_constraints_exclude are conditions on excluding voters
     """
-    election = Election.objects.get(id=election_id)
+    campaign = EmailCampaign.objects.create(election_id=election_id,
+                                            subject_template=subject_template, body_template=body_template,
+                                            extra_vars=extra_vars,
+                                            voter_constraints_include=voter_constraints_include,
+                                            voter_constraints_exclude=voter_constraints_exclude)
+
+    email_campaign_send.delay(campaign.id)
 
-    # select the right list of voters
-    voters = election.voter_set.all()
-    if voter_constraints_include:
-        voters = voters.filter(**voter_constraints_include)
-    if voter_constraints_exclude:
-        voters = voters.exclude(**voter_constraints_exclude)
 
-    for voter in voters:
-        single_voter_email.delay(voter.uuid, subject_template, body_template, extra_vars)
+@shared_task
+def email_campaign_send(campaign_id):
+    """
+    send one chunk of the campaign, then queue the next one
+    """
+    campaign = EmailCampaign.objects.get(id=campaign_id)
+    if campaign.send_chunk(settings.HELIOS_EMAIL_CHUNK_SIZE, rate_limit=settings.HELIOS_EMAIL_RATE_LIMIT,
+                           max_retries=settings.HELIOS_EMAIL_MAX_RETRIES):
+        email_campaign_send.delay(campaign_id)
 
 
 @shared_task
@@ -69,30 +76,13 @@ def single_voter_email(voter_uuid, subject_template, body_template, extra_vars={
     voter = Voter.objects.get(uuid=voter_uuid)
     
     # Check if voter email is opted out
-    voter_email = voter.voter_email or (voter.user and voter.user.user_id)
+    voter_email = voter.email_address
     if voter_email and EmailOptOut.is_opted_out(voter_email):
         logger = get_logger(single_voter_email.__name__)
         logger.info(f"Skipping email to opted-out voter {voter.uuid}")
         return
 
-    the_vars = copy.copy(extra_vars)
-    the_vars.update({'election': voter.election})
-    the_vars.update({'voter': voter})
-    
-    # Add unsubscribe link to email context
-    if voter_email:
-        unsubscribe_code = utils.generate_email_confirmation_code(voter_email, 'optout')
-        unsubscribe_path = reverse('optout_confirm', kwargs={'email': voter_email, 'code': unsubscribe_code})
-        unsubscribe_url = f"{settings.URL_HOST}{unsubscribe_path}"
-        #unsubscribe_url = hf"https://hfmdk-wahlen.de/{unsubscribe_pat}"
-        
-        the_vars.update({
-            'unsubscribe_url': unsubscribe_url,
-            'unsubscribe_code': unsubscribe_code
-        })
-
-    subject = render_template_raw(None, subject_template, the_vars)
-    body = render_template_raw(None, body_template, the_vars)
+    subject, body = EmailTemplates(subject_template, body_template, extra_vars).render(voter)
 
     voter.send_message(subject, body)
 
@@ -112,7 +102,7 @@ def single_voter_notify(voter_uuid, notification_template, extra_vars={}):
 @shared_task
 def election_compute_tally(election_id):
     election = Election.objects.get(id=election_id)
-    election.compute_tally()
+    election.compute_tally(processes=settings.HELIOS_TALLY_PROCESSES)
 
     election_notify_admin.delay(election_id=election_id,
                                 subject="encrypted tally computed",
@@ -144,7 +134,8 @@ Helios
 
 @shared_task
 def voter_file_process(voter_file_id):
-    voter_file = VoterFile.objects.get(id=voter_file_id)
+    # the content is read in chunks while processing, not loaded with the row
+    voter_file = VoterFile.objects.defer('voter_file_content').get(id=voter_file_id)
     voter_file.process()
     election_notify_admin.delay(election_id=voter_file.election.id,
                                 subject='voter file processed',
@@ -3,6 +3,7 @@ Unit Tests for Helios
 """
 
 import datetime
+import json
 import logging
 import re
 import uuid
@@ -544,8 +545,9 @@ class DataFormatBlackboxTests(object):
         self.election = models.Election.objects.all()[0]
 
     def assertEqualsToFile(self, response, file_path):
+        content = b''.join(response.streaming_content) if response.streaming else response.content
         with open(file_path) as expected:
-            self.assertEqual(response.content, expected.read().encode('utf-8'))
+            self.assertEqual(content, expected.read().encode('utf-8'))
 
     def test_election(self):
         response = self.client.get("/helios/elections/%s" % self.election.uuid, follow=False)
@@ -710,7 +712,7 @@ class ElectionBlackboxTests(WebTest):
 
     def test_get_election_voters_raw(self):
         response = self.client.get("/helios/elections/%s/voters/" % self.election.uuid, follow=False)
-        self.assertEqual(len(response.json()), self.election.num_voters)
+        self.assertEqual(len(json.loads(b''.join(response.streaming_content))), self.election.num_voters)
         
     def test_election_creation_not_logged_in(self):
         response = self.client.post("/helios/elections/new", {
@@ -1678,7 +1680,7 @@ class VotersCSVDownloadTests(TestCase):
         self.assertIn('attachment; filename="voters_test-csv_', response['Content-Disposition'])
         
         # Check CSV content
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         lines = content.strip().splitlines()
         headers = lines[0].split(',')
         
@@ -1695,7 +1697,7 @@ class VotersCSVDownloadTests(TestCase):
         self.assertEqual(response['Content-Type'], 'text/csv')
         
         # Check CSV content
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         lines = content.strip().splitlines()
         headers = lines[0].split(',')
         
@@ -1715,7 +1717,7 @@ class VotersCSVDownloadTests(TestCase):
         
         response = self.client.get(f'/helios/elections/{self.election.uuid}/voters/download-csv')
         
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         lines = content.strip().split('\n')
         headers = [h.strip() for h in lines[0].split(',')]
         
@@ -1734,11 +1736,43 @@ class VotersCSVDownloadTests(TestCase):
         
         response = self.client.get(f'/helios/elections/{self.election.uuid}/voters/download-csv?q=One')
 
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         lines = content.strip().splitlines()
         # Should only have header + 1 voter
         self.assertEqual(len(lines), 2)
 
+    def test_csv_download_streamed_without_per_voter_queries(self):
+        """Test CSV rows come from one joined query, however many voters there are"""
+        import csv
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        session = self.client.session
+        session['user'] = {'type': self.admin.user_type, 'user_id': self.admin.user_id}
+        session.save()
+        url = f'/helios/elections/{self.election.uuid}/voters/download-csv'
+
+        def download():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                self.assertTrue(response.streaming)
+                rows = list(csv.reader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+            return rows, len(queries)
+
+        download()
+        rows, num_queries = download()
+        rows_by_login = dict((row[0], row) for row in rows[1:])
+        self.assertEqual(rows_by_login['voter1'][2:4], ['Voter One', 'password'])
+        self.assertEqual(rows_by_login['voter2'][2:4], [self.voter2.user.name, 'google'])
+        self.assertEqual(rows_by_login['voter2'][4], 'test-hash-123')
+
+        for voter_num in range(5):
+            models.Voter(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='more%s' % voter_num,
+                         user=auth_models.User.objects.filter(user_type='google')[0]).save()
+        rows, more_num_queries = download()
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(more_num_queries, num_queries)
+
 
 class ElectionLogCSVDownloadTests(TestCase):
     """Test election log CSV download functionality"""
@@ -1778,7 +1812,7 @@ class ElectionLogCSVDownloadTests(TestCase):
         self.assertIn('attachment; filename="election_log_test-log-csv_', response['Content-Disposition'])
 
         # Check CSV content
-        content = response.content.decode('utf-8')
+        content = b''.join(response.streaming_content).decode('utf-8')
         lines = content.strip().splitlines()
         headers = lines[0].split(',')
 
@@ -3042,3 +3076,1278 @@ class VoterDeleteRestrictionTests(WebTest):
         # Check that the delete link is not present
         self.assertNotContains(response, '>x</a>]')
 
+
+
+class BatchVerificationTests(TestCase):
+    """Tests for verifying the proofs of many ballots together"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+    def _encrypt_votes(self, answers_list):
+        from helios.workflows import homomorphic
+        return [homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers) for answers in answers_list]
+
+    def _tamper(self, encrypted_vote):
+        proof = encrypted_vote.encrypted_answers[0].individual_proofs[1].proofs[0]
+        proof.response = (proof.response + 1) % self.election.public_key.q
+
+    def test_valid_batch_verifies(self):
+        from helios.workflows import homomorphic
+        votes = self._encrypt_votes([[[0]], [[1]], [[2]], [[]]])
+        self.assertEqual(homomorphic.EncryptedVote.verify_batch(self.election, votes), [])
+
+    def test_bad_ballot_is_named(self):
+        from helios.workflows import homomorphic
+        votes = self._encrypt_votes([[[0]], [[1]], [[2]]])
+        self._tamper(votes[1])
+
+        self.assertFalse(votes[1].verify(self.election))
+        self.assertEqual(homomorphic.EncryptedVote.verify_batch(self.election, votes), [votes[1]])
+
+        # a bad ballot in a batch of its own is found too
+        self.assertEqual(homomorphic.EncryptedVote.verify_batch(self.election, votes, batch_size=1), [votes[1]])
+
+    def test_wrong_election_hash_is_named(self):
+        from helios.workflows import homomorphic
+        votes = self._encrypt_votes([[[0]], [[1]]])
+        votes[0].election_hash = 'not-the-election-hash'
+        self.assertEqual(homomorphic.EncryptedVote.verify_batch(self.election, votes), [votes[0]])
+
+    def test_add_vote_batch_matches_add_vote(self):
+        votes = self._encrypt_votes([[[0]], [[1]], [[1]]])
+
+        batch_tally = self.election.init_tally()
+        batch_tally.add_vote_batch(votes)
+
+        single_tally = self.election.init_tally()
+        for vote in votes:
+            single_tally.add_vote(vote, verify_p=False)
+
+        self.assertEqual(batch_tally.num_tallied, 3)
+        self.assertEqual(batch_tally.toJSONDict(), single_tally.toJSONDict())
+
+    def test_add_vote_batch_rejects_bad_vote(self):
+        votes = self._encrypt_votes([[[0]], [[1]]])
+        self._tamper(votes[0])
+
+        tally = self.election.init_tally()
+        self.assertRaises(Exception, tally.add_vote_batch, votes)
+        self.assertEqual(tally.num_tallied, 0)
+
+    def test_commitment_outside_subgroup_rejected(self):
+        from unittest.mock import patch
+        from helios.crypto import algs
+        from helios.crypto.batch import BatchVerifier
+
+        pk = self.election.public_key
+        plaintext = algs.EGPlaintext(pow(pk.g, 1, pk.p), pk)
+        ciphertext, randomness = pk.encrypt_return_r(plaintext)
+        proof = ciphertext.generate_encryption_proof(plaintext, randomness, algs.EG_fiatshamir_challenge_generator)
+
+        # p - A has an extra factor of order 2, which an even random exponent cancels
+        proof.commitment['A'] = pk.p - proof.commitment['A']
+        self.assertFalse(ciphertext.verify_encryption_proof(plaintext, proof))
+
+        batch = BatchVerifier(pk)
+        batch.add_encryption_proof(ciphertext, plaintext, proof)
+        with patch('helios.crypto.batch.random.getrandbits', return_value=2):
+            self.assertFalse(batch.verify())
+
+
+class FixedBaseTableTests(TestCase):
+    """Tests for the precomputed tables used to raise g and y"""
+
+    def setUp(self):
+        self.p = views.ELGAMAL_PARAMS.p
+        self.q = views.ELGAMAL_PARAMS.q
+        self.g = views.ELGAMAL_PARAMS.g
+
+    def test_matches_builtin_pow(self):
+        from helios.crypto.fixedbase import FixedBaseTable
+        from helios.crypto.utils import random
+
+        table = FixedBaseTable(self.g, self.p, self.q.bit_length())
+        exponents = [0, 1, 2, 63, 64, self.q - 1] + [random.mpz_lt(self.q) for _ in range(10)]
+        for exponent in exponents:
+            self.assertEqual(table.pow(exponent), pow(self.g, exponent, self.p))
+
+    def test_uncovered_exponents_fall_back(self):
+        from helios.crypto.fixedbase import FixedBaseTable
+
+        table = FixedBaseTable(self.g, self.p, self.q.bit_length())
+        self.assertEqual(table.pow(self.q * 5 + 3), pow(self.g, self.q * 5 + 3, self.p))
+        self.assertEqual(table.pow(-3), pow(self.g, -3, self.p))
+
+    def test_public_key_shares_tables(self):
+        from helios.crypto import fixedbase
+
+        keypair = views.ELGAMAL_PARAMS.generate_keypair()
+        self.assertEqual(keypair.pk.y_pow(12345), pow(keypair.pk.y, 12345, self.p))
+
+        # a second copy of the same key uses the same table
+        copy_pk = datatypes.LDObject.fromDict(datatypes.LDObject.instantiate(keypair.pk, datatype='legacy/EGPublicKey').toDict(), type_hint='legacy/EGPublicKey').wrapped_obj
+        self.assertIs(fixedbase.get_table(copy_pk.y, copy_pk.p, copy_pk.q.bit_length()),
+                      fixedbase.get_table(keypair.pk.y, keypair.pk.p, keypair.pk.q.bit_length()))
+
+
+class MultiPowTests(TestCase):
+    """Tests for the simultaneous multi-exponentiation used by proof checks"""
+
+    def setUp(self):
+        self.p = views.ELGAMAL_PARAMS.p
+        self.q = views.ELGAMAL_PARAMS.q
+        self.g = views.ELGAMAL_PARAMS.g
+
+    def test_matches_product_of_powers(self):
+        from helios.crypto.multiexp import multi_pow
+        from helios.crypto.utils import random
+
+        bases = [pow(self.g, random.mpz_lt(self.q), self.p) for _ in range(4)]
+        exponents = [random.mpz_lt(self.q), 0, 1, random.getrandbits(64)]
+
+        expected = 1
+        for base, exponent in zip(bases, exponents):
+            expected = (expected * pow(base, exponent, self.p)) % self.p
+
+        self.assertEqual(multi_pow(list(zip(bases, exponents)), self.p), expected)
+        self.assertEqual(multi_pow([], self.p), 1)
+
+    def test_negative_exponents_invert_the_base(self):
+        from helios.crypto.multiexp import multi_pow
+
+        h = pow(self.g, 12345, self.p)
+        self.assertEqual(multi_pow([(self.g, 7), (h, -3)], self.p), (pow(self.g, 7, self.p) * pow(h, -3, self.p)) % self.p)
+        self.assertRaises(ValueError, multi_pow, [(self.p, -1)], self.p)
+
+    def test_decryption_proof(self):
+        from helios.crypto import algs, elgamal
+
+        keypair = views.ELGAMAL_PARAMS.generate_keypair()
+        ciphertext = keypair.pk.encrypt(elgamal.Plaintext(pow(self.g, 3, self.p), keypair.pk))
+        factor, proof = keypair.sk.decryption_factor_and_proof(ciphertext, algs.EG_fiatshamir_challenge_generator)
+
+        self.assertTrue(proof.verify(keypair.pk.g, ciphertext.alpha, keypair.pk.y, factor, self.p, self.q, algs.EG_fiatshamir_challenge_generator))
+        self.assertFalse(proof.verify(keypair.pk.g, ciphertext.alpha, keypair.pk.y, (factor * self.g) % self.p, self.p, self.q, algs.EG_fiatshamir_challenge_generator))
+
+
+class VerifyCastVotesCommandTests(TestCase):
+    """Tests for the verify_cast_votes management command"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        self.voter = models.Voter.objects.create(
+            uuid=str(uuid.uuid4()),
+            election=self.election,
+            voter_email='voter@example.com',
+            voter_name='Test Voter',
+            voter_login_id='testvoter'
+        )
+
+    def _cast_vote(self, answers, tamper=False, quarantined=False):
+        from helios.workflows import homomorphic
+        encrypted_vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers)
+        if tamper:
+            proof = encrypted_vote.encrypted_answers[0].individual_proofs[0].proofs[0]
+            proof.response = (proof.response + 1) % self.election.public_key.q
+
+        cast_vote = models.CastVote(voter=self.voter, vote=encrypted_vote, vote_hash='fakehash' + str(uuid.uuid4())[:8],
+                                    quarantined_p=quarantined)
+        cast_vote.save()
+        return cast_vote
+
+    def test_verifies_and_invalidates_in_bulk(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        good_vote = self._cast_vote([[0]])
+        bad_vote = self._cast_vote([[1]], tamper=True)
+        quarantined_vote = self._cast_vote([[1]], quarantined=True)
+
+        call_command('verify_cast_votes', processes=1, batch_size=1, stdout=StringIO())
+
+        good_vote.refresh_from_db()
+        bad_vote.refresh_from_db()
+        quarantined_vote.refresh_from_db()
+
+        self.assertIsNotNone(good_vote.verified_at)
+        self.assertIsNone(good_vote.invalidated_at)
+        self.assertIsNotNone(bad_vote.invalidated_at)
+        self.assertIsNone(bad_vote.verified_at)
+        self.assertIsNone(quarantined_vote.verified_at)
+        self.assertIsNone(quarantined_vote.invalidated_at)
+
+        # the valid ballot became the voter's vote
+        self.voter.refresh_from_db()
+        self.assertEqual(self.voter.vote_hash, good_vote.vote_hash)
+
+    def test_newer_ballot_stored_meanwhile_is_kept(self):
+        from django.db import transaction
+        from helios.management.commands.verify_cast_votes import claim_cast_votes, store_results
+
+        old_vote = self._cast_vote([[0]])
+        with transaction.atomic():
+            claimed = [cast_vote for cast_vote in claim_cast_votes(10) if cast_vote.id == old_vote.id]
+
+            # a newer ballot is stored while the old one is being verified
+            new_vote = self._cast_vote([[1]])
+            models.Voter.objects.get(id=self.voter.id).store_vote(new_vote)
+
+            store_results(claimed, [True])
+
+        self.voter.refresh_from_db()
+        self.assertEqual(self.voter.vote_hash, new_vote.vote_hash)
+        self.assertEqual(models.Election.objects.get(id=self.election.id).num_cast_votes, 1)
+
+
+class StreamingTallyTests(TestCase):
+    """Tests for computing the tally from the stored vote JSON in chunks"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        from helios.workflows import homomorphic
+
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        self.votes = []
+        for voter_num, answers in enumerate([[[0]], [[1]], [[1]], [[]], [[2]]]):
+            encrypted_vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers)
+            models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='voter%s' % voter_num,
+                                        voter_name='Voter %s' % voter_num, vote=encrypted_vote, vote_hash='hash%s' % voter_num)
+            self.votes.append(encrypted_vote)
+
+        # a voter who has not voted
+        models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='novote', voter_name='No Vote')
+
+    def test_matches_add_vote(self):
+        expected = self.election.init_tally()
+        for vote in self.votes:
+            expected.add_vote(vote, verify_p=False)
+
+        # small chunks so the keyset pagination is exercised
+        self.election.TALLY_CHUNK_SIZE = 2
+        self.election.compute_tally()
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.encrypted_tally.num_tallied, 5)
+        self.assertEqual(election.encrypted_tally.toJSONDict(), expected.toJSONDict())
+
+    def test_raw_votes_are_unparsed(self):
+        raw_votes = list(self.election.iter_raw_votes(chunk_size=2))
+        self.assertEqual(len(raw_votes), 5)
+        self.assertTrue(all(isinstance(raw_vote, str) for raw_vote in raw_votes))
+
+    def test_sharded_products_match_serial_tally(self):
+        expected = self.election.init_tally()
+        expected.add_raw_votes(self.election.iter_raw_votes())
+
+        shards = self.election.tally_shards(3)
+        self.assertEqual(len(shards), 3)
+
+        # merge the shards in reverse order, the product must not depend on it
+        tally = self.election.init_tally()
+        for min_id, max_id in reversed(shards):
+            tally.add_products(*models.compute_tally_shard((self.election.id, min_id, max_id)))
+
+        self.assertEqual(tally.num_tallied, 5)
+        self.assertEqual(tally.toJSONDict(), expected.toJSONDict())
+
+    def test_no_votes_no_shards(self):
+        models.Voter.objects.filter(election=self.election).update(vote=None)
+        self.assertEqual(self.election.tally_shards(4), [])
+
+    def test_serial_in_daemonic_process(self):
+        from unittest.mock import Mock, patch
+
+        # a prefork Celery worker child is daemonic and may not start a pool
+        with patch('helios.models.multiprocessing.current_process', return_value=Mock(daemon=True)), \
+                patch('helios.models.transaction.get_connection', return_value=Mock(in_atomic_block=False)), \
+                patch('helios.models.multiprocessing.Pool', side_effect=AssertionError("pool started")), \
+                patch('helios.models.connections.close_all', side_effect=AssertionError("connections closed")):
+            self.election.compute_tally(processes=4)
+
+        self.assertEqual(models.Election.objects.get(id=self.election.id).encrypted_tally.num_tallied, 5)
+
+
+class IncrementalTallyTests(TestCase):
+    """Tests for the running tally kept up to date as votes are stored"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.incremental_tally_p = True
+        self.election.freeze()
+
+        self.voters = [models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='voter%s' % voter_num,
+                                                   voter_name='Voter %s' % voter_num)
+                       for voter_num in range(2)]
+
+    def _cast_vote(self, voter, answers):
+        from helios.workflows import homomorphic
+        encrypted_vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers)
+        cast_vote = models.CastVote(voter=voter, vote=encrypted_vote, vote_hash='fakehash' + str(uuid.uuid4())[:8])
+        cast_vote.save()
+        return cast_vote
+
+    def _full_tally(self):
+        election = models.Election.objects.get(id=self.election.id)
+        tally = election.init_tally()
+        tally.add_raw_votes(election.iter_raw_votes())
+        return tally
+
+    def test_running_tally_follows_votes_and_revotes(self):
+        self.assertTrue(self._cast_vote(self.voters[0], [[0]]).verify_and_store())
+        self.assertTrue(self._cast_vote(self.voters[1], [[1]]).verify_and_store())
+
+        # the second ballot of a voter replaces the first one
+        self.assertTrue(self._cast_vote(self.voters[0], [[2]]).verify_and_store())
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.running_tally.num_tallied, 2)
+        self.assertEqual(election.running_tally.toJSONDict(), self._full_tally().toJSONDict())
+
+        # computing the tally just takes over the running tally
+        election.compute_tally()
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.encrypted_tally.toJSONDict(), self._full_tally().toJSONDict())
+
+    def test_bulk_verification_updates_running_tally(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self._cast_vote(self.voters[0], [[0]])
+        self._cast_vote(self.voters[1], [[1]])
+        call_command('verify_cast_votes', processes=1, stdout=StringIO())
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.running_tally.num_tallied, 2)
+        self.assertEqual(election.running_tally.toJSONDict(), self._full_tally().toJSONDict())
+
+    def test_revote_through_stale_voter(self):
+        # loaded before the first ballot was stored, as a concurrent request would have
+        stale_voter = models.Voter.objects.get(id=self.voters[0].id)
+
+        self.assertTrue(self._cast_vote(self.voters[0], [[0]]).verify_and_store())
+        stale_voter.store_vote(self._cast_vote(stale_voter, [[1]]))
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.running_tally.num_tallied, 1)
+        self.assertEqual(election.running_tally.toJSONDict(), self._full_tally().toJSONDict())
+
+
+class DLogServiceTests(TestCase):
+    """Tests for the cached discrete log tables used to decrypt tallies"""
+
+    def setUp(self):
+        self.p = views.ELGAMAL_PARAMS.p
+        self.g = views.ELGAMAL_PARAMS.g
+
+    def test_table_lookup(self):
+        from helios.crypto.dlog import DLogService
+
+        service = DLogService()
+        self.assertEqual(service.discrete_log(1, self.g, self.p, 10), 0)
+        self.assertEqual(service.discrete_log(pow(self.g, 7, self.p), self.g, self.p, 10), 7)
+
+        # out of range
+        self.assertIsNone(service.discrete_log(pow(self.g, 11, self.p), self.g, self.p, 10))
+
+        # the table is kept and extended
+        table = service.tables[(self.g, self.p)]
+        self.assertEqual(service.discrete_log(pow(self.g, 15, self.p), self.g, self.p, 20), 15)
+        self.assertIs(service.tables[(self.g, self.p)], table)
+
+    def test_baby_step_giant_step(self):
+        from helios.crypto.dlog import DLogService
+
+        service = DLogService(max_table_size=16)
+        for dlog in [0, 15, 16, 17, 250, 399, 400]:
+            self.assertEqual(service.discrete_log(pow(self.g, dlog, self.p), self.g, self.p, 400), dlog)
+        self.assertIsNone(service.discrete_log(pow(self.g, 401, self.p), self.g, self.p, 400))
+        self.assertLessEqual(service.tables[(self.g, self.p)].counter, 21)
+
+    def test_tables_persist_and_evict(self):
+        import tempfile
+        from helios.crypto.dlog import DLogService
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            DLogService(cache_dir=cache_dir).discrete_log(pow(self.g, 30, self.p), self.g, self.p, 50)
+
+            service = DLogService(cache_dir=cache_dir, max_tables=1)
+            table = service.table(self.g, self.p, 0)
+            self.assertEqual(table.counter, 50)
+            self.assertEqual(table.lookup(pow(self.g, 42, self.p)), 42)
+
+            # a second base pushes the first table out of memory
+            service.discrete_log(pow(3, 2, self.p), 3, self.p, 5)
+            self.assertEqual(list(service.tables.keys()), [(3, self.p)])
+
+    def test_trustee_decryption_uses_cache_dir(self):
+        from unittest.mock import patch
+        from django.test import override_settings
+        from helios.crypto import electionalgs
+
+        tally = electionalgs.Tally()
+        tally.tally = []
+        with override_settings(HELIOS_DLOG_CACHE_DIR='/tmp/helios-dlog'), \
+                patch('helios.crypto.electionalgs.DLogService.shared') as shared:
+            self.assertEqual(tally.decrypt_from_factors([], None), [])
+        shared.assert_called_once_with(cache_dir='/tmp/helios-dlog')
+
+
+class BenchmarkTests(TestCase):
+    """Smoke test for the benchmark suite, at a tiny size"""
+
+    def test_run_reports_every_benchmark(self):
+        import json
+        from helios import benchmark
+
+        results = benchmark.run(key_bits=512, num_questions=2, num_answers=2, num_ballots=2)
+        json.dumps(results)
+
+        self.assertEqual(results['parameters']['key_bits'], 512)
+        self.assertEqual([b['name'] for b in results['benchmarks']],
+                         ['encrypt_vote', 'verify_vote', 'serialize_vote', 'deserialize_vote', 'tally_add_vote',
+                          'decryption_factors_and_proofs', 'decrypt_from_factors'])
+        for result in results['benchmarks']:
+            self.assertGreater(result['ops'], 0)
+            self.assertGreater(result['peak_memory_bytes'], 0)
+
+
+class FastDecoderTests(TestCase):
+    """The fast ballot decoders must build the same objects as LDObject.fromDict"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+    def _decode_both(self, d, type_hint):
+        slow = datatypes.LDObject.fromDict(d, type_hint=type_hint).wrapped_obj
+        fast = datatypes.LDObject.wrapped_from_dict(d, type_hint=type_hint)
+        return slow, fast
+
+    def test_encrypted_vote(self):
+        from helios.workflows import homomorphic
+        vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[1]])
+        vote_dict = utils.from_json(datatypes.LDObject.instantiate(vote, datatype='legacy/EncryptedVote').serialize())
+
+        slow, fast = self._decode_both(vote_dict, 'legacy/EncryptedVote')
+        self.assertIs(type(fast), type(slow))
+        self.assertIs(type(fast.encrypted_answers[0].choices[0]), type(slow.encrypted_answers[0].choices[0]))
+        self.assertIs(type(fast.encrypted_answers[0].overall_proof.proofs[0]), type(slow.encrypted_answers[0].overall_proof.proofs[0]))
+        self.assertEqual(fast.encrypted_answers[0].individual_proofs[0].proofs[1].commitment,
+                         slow.encrypted_answers[0].individual_proofs[0].proofs[1].commitment)
+        self.assertEqual(datatypes.LDObject.instantiate(fast, datatype='legacy/EncryptedVote').serialize(),
+                         datatypes.LDObject.instantiate(slow, datatype='legacy/EncryptedVote').serialize())
+        self.assertTrue(fast.verify(self.election))
+
+    def test_nulls_and_bad_input(self):
+        answer = {'choices': [{'alpha': '2', 'beta': '3'}], 'individual_proofs': None, 'overall_proof': None}
+        slow, fast = self._decode_both(answer, 'legacy/EncryptedAnswer')
+        self.assertIsNone(fast.overall_proof)
+        self.assertIsNone(fast.individual_proofs)
+        self.assertEqual((fast.choices[0].alpha, fast.choices[0].beta), (slow.choices[0].alpha, slow.choices[0].beta))
+
+        self.assertIsNone(datatypes.LDObject.wrapped_from_dict(None, type_hint='legacy/EGCiphertext'))
+        self.assertRaises(KeyError, datatypes.LDObject.wrapped_from_dict, {'alpha': '2'}, type_hint='legacy/EGCiphertext')
+
+
+class VoterFileImportTests(TestCase):
+    """Voter files are imported with a fixed number of queries, whatever their size"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.use_voter_aliases = True
+        self.election.save()
+
+    def _process(self, content):
+        voter_file = models.VoterFile.objects.create(election=self.election, voter_file_content=content)
+        return voter_file.process()
+
+    def test_duplicates_opt_outs_and_aliases(self):
+        models.EmailOptOut.add_opt_out('optedout@example.com')
+        self.assertEqual(self._process("password,existing,existing@example.com,Existing\n"), 1)
+
+        content = "\n".join([
+            "password,voter1,voter1@example.com,Voter 1",
+            "password,voter2,voter2@example.com,Voter 2",
+            "password,voter1,voter1-again@example.com,Voter 1 Again",
+            "password,existing,existing@example.com,Existing",
+            "password,optout,OptedOut@example.com,Opted Out",
+            "github,someone",
+            "github,someone",
+        ])
+        self.assertEqual(self._process(content), 3)
+
+        voters = self.election.voter_set.all()
+        self.assertEqual(sorted(v.voter_login_id for v in voters), ['existing', 'someone', 'voter1', 'voter2'])
+        # the seven valid rows of the second file got V2-V8, the three new voters some of them
+        self.assertEqual(voters.get(voter_login_id='existing').alias, 'V1')
+        alias_nums = set(int(v.alias[1:]) for v in voters.exclude(voter_login_id='existing'))
+        self.assertEqual(len(alias_nums), 3)
+        self.assertTrue(alias_nums <= set(range(2, 9)))
+        self.assertEqual(voters.get(voter_login_id='voter1').voter_email, 'voter1@example.com')
+        self.assertTrue(all(v.voter_password for v in voters if v.voter_type == 'password'))
+
+        github_voter = voters.get(voter_login_id='someone')
+        self.assertEqual(github_voter.user.user_type, 'github')
+        self.assertEqual(github_voter.voter_email, 'someone')
+
+    def test_query_count_does_not_grow_with_the_file(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def count_queries(prefix, num_voters):
+            content = "\n".join("password,%s%d,%s%d@example.com" % (prefix, i, prefix, i) for i in range(num_voters))
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self._process(content), num_voters)
+            return len(queries)
+
+        self.assertEqual(count_queries('small', 5), count_queries('large', 100))
+
+    def test_streaming_in_chunks_and_batches(self):
+        content = "\r\n".join(["password,voter%d,voter%d@example.com,Voter %d" % (i, i, i) for i in range(7)] +
+                                ["password,bademail,not-an-email", "nosuchtype,someone", "lonely", "", "  "]) + "\r\n"
+        voter_file = models.VoterFile.objects.create(election=self.election, voter_file_content=content)
+
+        # read the content back from the database in tiny slices, so line endings are split between chunks
+        voter_file = models.VoterFile.objects.defer('voter_file_content').get(id=voter_file.id)
+        voter_file.CONTENT_CHUNK_SIZE = 5
+        voter_file.BULK_BATCH_SIZE = 3
+
+        lines = list(voter_file.iterlines())
+        self.assertEqual(lines, [line for line in content.split("\r\n") if line])
+
+        self.assertEqual(voter_file.process(), 7)
+
+        voter_file = models.VoterFile.objects.get(id=voter_file.id)
+        self.assertEqual(voter_file.num_voters, 7)
+        self.assertEqual(voter_file.num_rows_processed, 9)
+        self.assertEqual(voter_file.num_rows_rejected, 2)
+        self.assertIsNotNone(voter_file.processing_finished_at)
+
+        voters = self.election.voter_set.all()
+        self.assertEqual(voters.get(voter_login_id='voter3').voter_name, 'Voter 3')
+        self.assertEqual(sorted(int(v.alias[1:]) for v in voters), list(range(1, 8)))
+
+    def test_aliases_given_with_each_batch(self):
+        from unittest.mock import patch
+
+        # a voter added without an alias is not the import's business
+        unrelated_voter = models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='unrelated')
+
+        content = "\n".join("password,voter%d,voter%d@example.com" % (i, i) for i in range(5))
+        voter_file = models.VoterFile.objects.create(election=self.election, voter_file_content=content)
+        voter_file.BULK_BATCH_SIZE = 2
+
+        # the second batch fails, the first one keeps its aliases
+        with patch.object(models.EmailOptOut, 'filter_opted_out', side_effect=[set(), RuntimeError("import failed")]):
+            self.assertRaises(RuntimeError, voter_file.process)
+
+        voters = self.election.voter_set.exclude(id=unrelated_voter.id)
+        first_alias_nums = set(int(v.alias[1:]) for v in voters)
+        self.assertEqual(len(first_alias_nums), 2)
+        self.assertTrue(first_alias_nums <= set(range(1, 6)))
+        self.assertIsNone(models.Voter.objects.get(id=unrelated_voter.id).alias)
+
+        # the second import has a range of its own
+        self.assertEqual(self._process(content), 3)
+        alias_nums = set(int(v.alias[1:]) for v in voters.all())
+        self.assertEqual(len(alias_nums), 5)
+        self.assertTrue(alias_nums - first_alias_nums <= set(range(6, 11)))
+        self.assertIsNone(models.Voter.objects.get(id=unrelated_voter.id).alias)
+
+    def test_aliases_not_grouped_by_batch(self):
+        content = "\n".join("password,voter%02d,voter%02d@example.com" % (i, i) for i in range(40))
+        voter_file = models.VoterFile.objects.create(election=self.election, voter_file_content=content)
+        voter_file.BULK_BATCH_SIZE = 10
+        self.assertEqual(voter_file.process(), 40)
+
+        voters = self.election.voter_set.all()
+        self.assertEqual(sorted(int(v.alias[1:]) for v in voters), list(range(1, 41)))
+
+        # the first batch of the file does not get the first aliases, which would happen
+        # by chance once in C(40, 10), about 8.5 * 10^8, imports
+        first_batch_alias_nums = set(int(v.alias[1:]) for v in voters if v.voter_login_id < 'voter10')
+        self.assertEqual(len(first_batch_alias_nums), 10)
+        self.assertNotEqual(first_batch_alias_nums, set(range(1, 11)))
+
+    def test_random_permutation(self):
+        for n in [0, 1, 2, 5, 17, 64, 1000]:
+            permutation = utils.random_permutation(n)
+            self.assertEqual(sorted(permutation(i) for i in range(n)), list(range(n)))
+        self.assertRaises(ValueError, utils.random_permutation(5), 5)
+
+    def test_itervoters_skips_short_rows(self):
+        # a stray one-field line or trailer doesn't reject the whole file
+        voter_file = models.VoterFile(election=self.election, voter_file_content="password,voter1,voter1@example.com\nlonely\n  \n")
+        self.assertEqual([voter['voter_id'] for voter in voter_file.itervoters()], ['voter1'])
+
+    def test_itervoters_raises_on_invalid_rows(self):
+        voter_file = models.VoterFile(election=self.election, voter_file_content="password,voter1,voter1@example.com\nnosuchtype,someone\n")
+        self.assertRaises(Exception, list, voter_file.itervoters())
+
+
+class AliasCounterTests(TestCase):
+    """Alias numbers come from a counter on the election, not from a scan of the voters"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.use_voter_aliases = True
+        self.election.save()
+        self.user = auth_models.User.objects.get(user_id='ben@adida.net', user_type='google')
+
+    def test_reserve_ranges(self):
+        self.assertEqual(list(self.election.reserve_alias_nums(3)), [1, 2, 3])
+        self.assertEqual(list(self.election.reserve_alias_nums()), [4])
+        self.assertEqual(self.election.last_alias_num, 4)
+
+        voter = models.Voter.register_user_in_election(self.user, self.election)
+        self.assertEqual(voter.alias, 'V5')
+
+    def test_save_keeps_the_counter(self):
+        stale_election = models.Election.objects.get(id=self.election.id)
+        self.election.reserve_alias_nums(10)
+
+        stale_election.name = 'renamed'
+        stale_election.save()
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.name, 'renamed')
+        self.assertEqual(election.alias_counter, 10)
+
+    def test_backfill_migration(self):
+        import importlib
+        from django.apps import apps
+        migration = importlib.import_module('helios.migrations.0013_election_alias_counter')
+
+        for alias in ['V3', 'V12', 'bogus', None]:
+            models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id=str(uuid.uuid4()),
+                                        voter_email='x@example.com', alias=alias)
+
+        migration.backfill_alias_counter(apps, None)
+        self.assertEqual(self.election.last_alias_num, 12)
+
+
+class EmailCampaignTests(TestCase):
+    """Mass emails go out a chunk at a time over one connection, with their progress recorded"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.voters = [models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election,
+                                                   voter_login_id='voter%d' % i, voter_name='Voter %d' % i,
+                                                   voter_email='voter%d@example.com' % i)
+                       for i in range(5)]
+        models.EmailOptOut.add_opt_out('voter2@example.com')
+
+    def _campaign(self):
+        return models.EmailCampaign.objects.create(election=self.election, subject_template='email/simple_subject.txt',
+                                                   body_template='email/simple_body.txt',
+                                                   extra_vars={'custom_subject': 'Hello', 'custom_message': 'Vote!'})
+
+    def test_campaign_task(self):
+        from django.test.utils import override_settings
+        from unittest.mock import patch
+
+        with override_settings(HELIOS_EMAIL_CHUNK_SIZE=2), \
+                patch('django.core.mail.get_connection', wraps=mail.get_connection) as get_connection:
+            tasks.voters_email.apply(args=[self.election.id, 'email/simple_subject.txt', 'email/simple_body.txt',
+                                           {'custom_subject': 'Hello', 'custom_message': 'Vote!'}])
+
+        # three chunks of voters, one connection each
+        self.assertEqual(get_connection.call_count, 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['"Voter %d" <voter%d@example.com>' % (i, i) for i in [0, 1, 3, 4]])
+        self.assertIn('Hello', mail.outbox[0].subject)
+        self.assertIn('Vote!', mail.outbox[0].body)
+
+        campaign = models.EmailCampaign.objects.get(election=self.election)
+        self.assertEqual((campaign.num_sent, campaign.num_opted_out, campaign.num_failed), (4, 1, 0))
+        self.assertEqual(campaign.last_voter_id, self.voters[-1].id)
+        self.assertIsNotNone(campaign.finished_at)
+
+    def test_retries_and_failures(self):
+        from unittest.mock import patch
+        from django.core.mail.backends.locmem import EmailBackend
+
+        campaign = self._campaign()
+        send_messages = EmailBackend.send_messages
+        attempts = []
+
+        def flaky_send_messages(backend, messages):
+            attempts.append(messages[0].to[0])
+            # voter0 fails once, voter1 always
+            if 'voter1@' in messages[0].to[0] or attempts.count(messages[0].to[0]) == 1 and 'voter0@' in messages[0].to[0]:
+                raise IOError("connection lost")
+            return send_messages(backend, messages)
+
+        with patch.object(EmailBackend, 'send_messages', flaky_send_messages):
+            self.assertEqual(campaign.send_chunk(10, max_retries=2), 5)
+            self.assertEqual(campaign.send_chunk(10, max_retries=2), 0)
+
+        campaign = models.EmailCampaign.objects.get(id=campaign.id)
+        self.assertEqual((campaign.num_sent, campaign.num_opted_out, campaign.num_failed, campaign.num_retries), (3, 1, 1, 3))
+        self.assertEqual(campaign.failed_voter_uuids, [self.voters[1].uuid])
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_message_that_cannot_be_built_fails(self):
+        from unittest.mock import patch
+        from helios.email_templates import EmailTemplates
+
+        campaign = self._campaign()
+        render = EmailTemplates.render
+
+        def broken_render(templates, voter):
+            if voter.voter_login_id == 'voter1':
+                raise ValueError("bad template variable")
+            return render(templates, voter)
+
+        with patch.object(EmailTemplates, 'render', broken_render):
+            self.assertEqual(campaign.send_chunk(10), 5)
+
+        campaign = models.EmailCampaign.objects.get(id=campaign.id)
+        self.assertEqual((campaign.num_sent, campaign.num_opted_out, campaign.num_failed), (3, 1, 1))
+        self.assertEqual(campaign.failed_voter_uuids, [self.voters[1].uuid])
+        self.assertEqual(campaign.last_voter_id, self.voters[-1].id)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_rate_limit(self):
+        from unittest.mock import patch
+
+        with patch('helios.models.time.sleep') as sleep:
+            self._campaign().send_chunk(10, rate_limit=2)
+
+        # four messages at two per second, the first one goes out right away.
+        # sleep does not really wait here, so every message waits for all the ones before it
+        self.assertEqual(sleep.call_count, 3)
+        for waited, expected in zip([call.args[0] for call in sleep.call_args_list], [0.5, 1.0, 1.5]):
+            self.assertAlmostEqual(waited, expected, delta=0.1)
+
+
+class EmailTemplatesTests(TestCase):
+    """Precompiled email templates render exactly what render_template_raw does"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def test_same_as_render_template_raw(self):
+        from helios.email_templates import EmailTemplates
+        from helios.view_utils import render_template_raw
+
+        election = models.Election.objects.get(short_name='test')
+        election.use_voter_aliases = True
+        voters = [models.Voter(uuid=str(uuid.uuid4()), election=election, voter_login_id='voter%d' % i,
+                               voter_name='Voter <%d>' % i, voter_email='voter%d@example.com' % i,
+                               voter_password='secret%d' % i, alias='V%d' % i)
+                  for i in range(3)]
+        extra_vars = {'custom_subject': 'Vote & win', 'custom_message': '<b>now</b>',
+                      'election_vote_url': 'https://example.com/vote?a=1&b=2'}
+
+        templates = EmailTemplates('email/vote_subject.txt', 'email/vote_body.txt', extra_vars)
+        rendered = templates.render_many(voters)
+
+        self.assertEqual(len(rendered), 3)
+        for voter, (subject, body) in zip(voters, rendered):
+            the_vars = dict(extra_vars, **voter.email_vars())
+            self.assertEqual(subject, render_template_raw(None, 'email/vote_subject.txt', the_vars))
+            self.assertEqual(body, render_template_raw(None, 'email/vote_body.txt', the_vars))
+            self.assertIn('secret%s' % voter.voter_login_id[-1], body)
+
+        # nothing of one voter is left behind for the next one
+        self.assertEqual(templates.context.flatten(), dict(extra_vars, **{'True': True, 'False': False, 'None': None}))
+
+
+class EmailOptOutCacheTests(TestCase):
+    """Opt-out lookups come from an in-memory set of hashes that is reloaded when opt-outs change"""
+    allow_database_queries = True
+
+    def setUp(self):
+        from django.test.utils import override_settings
+        self.settings_override = override_settings(HELIOS_EMAIL_OPTOUT_CACHE_SECONDS=60)
+        self.settings_override.enable()
+        models.EmailOptOut._cached_hashes = None
+
+    def tearDown(self):
+        models.EmailOptOut._cached_hashes = None
+        self.settings_override.disable()
+
+    def test_cached_lookups(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        models.EmailOptOut.add_opt_out('out@example.com')
+        emails = ['out@example.com', ' OUT@example.com', 'in@example.com', None]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(models.EmailOptOut.filter_opted_out(emails), {'out@example.com', ' OUT@example.com'})
+        self.assertEqual(len(queries), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(models.EmailOptOut.filter_opted_out(emails), {'out@example.com', ' OUT@example.com'})
+            self.assertTrue(models.EmailOptOut.is_opted_out('out@example.com'))
+            self.assertFalse(models.EmailOptOut.is_opted_out('in@example.com'))
+        self.assertEqual(len(queries), 0)
+
+        # the hooks drop the cached hashes
+        models.EmailOptOut.remove_opt_out('out@example.com')
+        self.assertFalse(models.EmailOptOut.is_opted_out('out@example.com'))
+        models.EmailOptOut.add_opt_out('in@example.com')
+        self.assertTrue(models.EmailOptOut.is_opted_out('in@example.com'))
+
+    def test_version_from_another_process(self):
+        from django.core.cache import cache
+
+        self.assertFalse(models.EmailOptOut.is_opted_out('out@example.com'))
+
+        # another process adds an opt-out and bumps the version, this one still has the old hashes
+        models.EmailOptOut.objects.create(email_hash=utils.hash_email('out@example.com'))
+        self.assertFalse(models.EmailOptOut.is_opted_out('out@example.com'))
+
+        cache.incr(models.EmailOptOut.VERSION_CACHE_KEY)
+        self.assertTrue(models.EmailOptOut.is_opted_out('out@example.com'))
+
+    def test_no_caching(self):
+        from django.test.utils import override_settings
+
+        with override_settings(HELIOS_EMAIL_OPTOUT_CACHE_SECONDS=0):
+            self.assertIsNone(models.EmailOptOut.opted_out_hashes())
+            models.EmailOptOut.objects.create(email_hash=utils.hash_email('out@example.com'))
+            self.assertTrue(models.EmailOptOut.is_opted_out('out@example.com'))
+            self.assertEqual(models.EmailOptOut.filter_opted_out(['out@example.com', 'in@example.com']), {'out@example.com'})
+
+
+class ElectionCacheTests(TestCase):
+    """The election views get their election from a versioned cache"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test.utils import override_settings
+        cache.clear()
+        self.settings_override = override_settings(HELIOS_ELECTION_CACHE_SECONDS=300)
+        self.settings_override.enable()
+        self.election = models.Election.objects.get(short_name='test')
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def test_cached_and_lazy(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        models.Election.get_cached_by_uuid(self.election.uuid)
+        admin = self.election.admin
+
+        with CaptureQueriesContext(connection) as queries:
+            election = models.Election.get_cached_by_uuid(self.election.uuid)
+            self.assertEqual(election.name, self.election.name)
+            self.assertEqual(election.admin.user_id, admin.user_id)
+        self.assertEqual(len(queries), 0)
+
+        # heavy fields are only loaded when used
+        self.assertIn('questions', election.get_deferred_fields())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(election.questions, self.election.questions)
+        self.assertEqual(len(queries), 1)
+
+        self.assertIsNone(models.Election.get_cached_by_uuid('no-such-election'))
+
+    def test_invalidated_on_save_and_delete(self):
+        models.Election.get_cached_by_uuid(self.election.uuid)
+
+        self.election.name = 'renamed'
+        self.election.save()
+        self.assertEqual(models.Election.get_cached_by_uuid(self.election.uuid).name, 'renamed')
+
+        self.election.soft_delete()
+        self.assertIsNone(models.Election.get_cached_by_uuid(self.election.uuid))
+
+    def test_save_of_cached_election_keeps_unloaded_fields(self):
+        election = models.Election.get_cached_by_uuid(self.election.uuid)
+
+        self.election.questions = [{'question': 'changed elsewhere', 'answers': ['a', 'b']}]
+        self.election.save()
+
+        election.name = 'renamed'
+        election.save()
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.name, 'renamed')
+        self.assertEqual(election.questions[0]['question'], 'changed elsewhere')
+
+
+class LazyLDObjectFieldTests(TestCase):
+    """LDObjectField columns are parsed on first access"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def test_parsed_once_on_access(self):
+        election = models.Election.objects.get(short_name='test')
+        self.assertIsInstance(election.__dict__['questions'], str)
+
+        questions = election.questions
+        self.assertEqual(questions[0]['short_name'], 'q1')
+        self.assertIs(election.questions, questions)
+        self.assertNotIsInstance(election.__dict__['questions'], str)
+
+    def test_unparsed_json_saved_as_is(self):
+        raw_questions = models.Election.objects.filter(short_name='test').values_list('questions', flat=True)[0]
+
+        election = models.Election.objects.get(short_name='test')
+        election.name = 'renamed'
+        election.save()
+
+        self.assertEqual(models.Election.objects.filter(short_name='test').values_list('questions', flat=True)[0], raw_questions)
+
+    def test_changes_saved(self):
+        election = models.Election.objects.get(short_name='test')
+        election.eligibility = [{'auth_system': 'password'}]
+        election.save()
+
+        election = models.Election.objects.get(short_name='test')
+        self.assertEqual(election.eligibility, [{'auth_system': 'password'}])
+
+
+class ElectionCounterTests(TestCase):
+    """The voter and vote counts of an election come from sharded counters"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+        self.voters = [models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='voter%s' % voter_num,
+                                                   voter_name='Voter %s' % voter_num)
+                       for voter_num in range(3)]
+
+    def _cast_vote(self, voter, answers):
+        from helios.workflows import homomorphic
+        encrypted_vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, answers)
+        cast_vote = models.CastVote(voter=voter, vote=encrypted_vote, vote_hash='fakehash' + str(uuid.uuid4())[:8])
+        cast_vote.save()
+        return cast_vote
+
+    def _counters(self):
+        election = models.Election.objects.get(id=self.election.id)
+        return election.num_voters, election.num_cast_votes, election.num_pending_votes
+
+    def test_votes_counted(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.assertEqual(self._counters(), (3, 0, 0))
+
+        self._cast_vote(self.voters[0], [[0]]).verify_and_store()
+        self._cast_vote(self.voters[1], [[1]])
+        self._cast_vote(self.voters[1], [[2]])
+        self.assertEqual(self._counters(), (3, 1, 2))
+
+        # a second ballot of the same voter is no new cast vote
+        self._cast_vote(self.voters[0], [[1]]).verify_and_store()
+        call_command('verify_cast_votes', processes=1, stdout=StringIO())
+        self.assertEqual(self._counters(), (3, 2, 0))
+
+        self.voters[1].delete()
+        self.assertEqual(self._counters(), (2, 1, 0))
+
+    def test_first_ballots_of_stale_voters_counted_once(self):
+        # two requests that both loaded the voter before either ballot was stored
+        voters = [models.Voter.objects.get(id=self.voters[0].id) for _ in range(2)]
+        for voter, answers in zip(voters, [[[0]], [[1]]]):
+            cast_vote = self._cast_vote(voter, answers)
+            cast_vote.verified_at = datetime.datetime.utcnow()
+            cast_vote.save()
+            voter.store_vote(cast_vote)
+
+        self.assertEqual(self._counters(), (3, 1, 0))
+
+        # a voter deleted through an instance loaded before the vote was stored
+        voters[0].delete()
+        self.assertEqual(self._counters(), (2, 0, 0))
+
+    def test_voters_counted(self):
+        models.Voter.register_user_in_election(models.User.objects.get(user_id='ben@adida.net'), self.election)
+        self.assertEqual(self._counters(), (4, 0, 0))
+
+        self.assertEqual(models.Voter.delete_by_election(self.election), 4)
+        self.assertEqual(self._counters(), (0, 0, 0))
+
+    def test_counters_read_in_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        elections = list(models.Election.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            elections = models.Election.load_counters(elections)
+            self.assertEqual([election.num_voters for election in elections], [3])
+        self.assertEqual(len(queries), 1)
+
+    def test_recount(self):
+        models.Voter.objects.filter(id=self.voters[0].id).delete()
+        self.assertEqual(self._counters(), (3, 0, 0))
+
+        self.election.recount()
+        self.assertEqual(self._counters(), (2, 0, 0))
+
+
+class BallotListStreamingTests(TestCase):
+    """The public voter and ballot lists are streamed with keyset cursors"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        cast_at = datetime.datetime(2024, 1, 1, 12, 0, 0, 500000)
+        user = models.User.objects.get(user_id='ben@adida.net')
+        models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, user=user, voter_login_id=user.user_id,
+                                    vote_hash='hash-user', cast_at=cast_at)
+        for voter_num in range(4):
+            # all cast in the same instant, only the uuid tells them apart
+            models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='voter%s' % voter_num,
+                                        voter_name='Voter %s' % voter_num, vote_hash='hash%s' % voter_num, cast_at=cast_at)
+        models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='not-voted')
+
+    def _get_json(self, url):
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_ballots_same_as_cast_votes(self):
+        ballots = self._get_json("/helios/elections/%s/ballots/" % self.election.uuid)
+
+        voters = models.Voter.objects.filter(election=self.election).exclude(cast_at=None)
+        expected = dict((voter.uuid, voter.last_cast_vote().ld_object.short.toDict(complete=True)) for voter in voters)
+        self.assertEqual(len(ballots), 5)
+        self.assertEqual(dict((ballot['voter_uuid'], ballot) for ballot in ballots), expected)
+
+    def test_ballots_keyset_pages(self):
+        url = "/helios/elections/%s/ballots/" % self.election.uuid
+        ballots = self._get_json(url + "?limit=2")
+        while True:
+            page = self._get_json(url + "?" + urlencode({'limit': 2, 'after': ballots[-1]['cast_at'], 'after_uuid': ballots[-1]['voter_uuid']}))
+            if not page:
+                break
+            ballots.extend(page)
+
+        self.assertEqual(ballots, self._get_json(url))
+
+    def test_voters_streamed_in_fixed_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        url = "/helios/elections/%s/voters/" % self.election.uuid
+        self._get_json(url)
+        with CaptureQueriesContext(connection) as queries:
+            voters = self._get_json(url)
+        self.assertEqual(len(voters), 6)
+        self.assertEqual([voter['uuid'] for voter in voters], sorted(voter['uuid'] for voter in voters))
+
+        for voter_num in range(10):
+            models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='more%s' % voter_num)
+        with CaptureQueriesContext(connection) as more_queries:
+            self.assertEqual(len(self._get_json(url)), 16)
+        self.assertEqual(len(more_queries), len(queries))
+
+
+class ElectionPageCacheTests(TestCase):
+    """Public election pages are cached under the election cache version"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test.utils import override_settings
+        cache.clear()
+        self.settings_override = override_settings(HELIOS_ELECTION_CACHE_SECONDS=300)
+        self.settings_override.enable()
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def test_json_conditional_get(self):
+        url = "/helios/elections/%s" % self.election.uuid
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.election.name = 'renamed'
+        self.election.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_trustees_bump_version(self):
+        url = "/helios/elections/%s/trustees/" % self.election.uuid
+        response = self.client.get(url)
+        self.assertEqual(len(response.json()), 1)
+
+        models.Trustee(uuid=str(uuid.uuid4()), election=self.election, name='Another', email='another@example.com').save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+    def test_fragments_follow_version(self):
+        url = "/helios/elections/%s/view" % self.election.uuid
+        models.Election.objects.filter(id=self.election.id).update(description='first description')
+        self.election.invalidate_cache()
+        self.assertContains(self.client.get(url), 'first description')
+
+        # changed behind the cache's back, the cached fragment is still shown
+        models.Election.objects.filter(id=self.election.id).update(description='second description')
+        self.assertContains(self.client.get(url), 'first description')
+
+        self.election.invalidate_cache()
+        self.assertContains(self.client.get(url), 'second description')
+
+
+class FrozenElectionJSONTests(TestCase):
+    """The election JSON and hash are kept from freeze on"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+
+    def test_kept_at_freeze(self):
+        from unittest.mock import patch
+        from helios.crypto.utils import hash_b64
+
+        election = models.Election.objects.get(id=self.election.id)
+        serialized = datatypes.LDObject.instantiate(election).serialize()
+        self.assertEqual(election.frozen_json, serialized)
+        self.assertEqual(election.frozen_hash, hash_b64(serialized))
+
+        with patch.object(datatypes.LDObject, 'serialize', side_effect=AssertionError("serialized again")):
+            self.assertEqual(election.hash, hash_b64(serialized))
+            response = self.client.get("/helios/elections/%s" % election.uuid)
+        self.assertEqual(response.content.decode('utf-8'), serialized)
+
+    def test_filled_in_for_older_elections(self):
+        models.Election.objects.filter(id=self.election.id).update(frozen_json=None, frozen_hash=None)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertEqual(election.hash, self.election.frozen_hash)
+        self.assertEqual(models.Election.objects.get(id=self.election.id).frozen_hash, self.election.frozen_hash)
+
+    def test_eligibility_fixed_once_frozen(self):
+        self.client.get("/")
+        session = self.client.session
+        session['user'] = {'type': 'google', 'user_id': 'ben@adida.net'}
+        session.save()
+
+        response = self.client.post("/helios/elections/%s/voters/eligibility" % self.election.uuid, {
+                "csrf_token": self.client.session['csrf_token'],
+                "eligibility": "closedreg"})
+        self.assertEqual(response.status_code, 403)
+
+        election = models.Election.objects.get(id=self.election.id)
+        self.assertTrue(election.openreg)
+        self.assertEqual(election.frozen_json, self.election.frozen_json)
+
+
+class VoterListQueryTests(TestCase):
+    """The voter list and the bulletin board load their voters in a fixed number of queries"""
+    fixtures = ['users.json', 'election.json']
+    allow_database_queries = True
+
+    def setUp(self):
+        self.election = models.Election.objects.get(short_name='test')
+        self.election.generate_trustee(views.ELGAMAL_PARAMS)
+        self.election.openreg = True
+        self.election.freeze()
+        self._add_voters(0, 3)
+
+    def _add_voters(self, start, end):
+        from helios.workflows import homomorphic
+
+        for voter_num in range(start, end):
+            user = models.User.objects.create(user_type='google', user_id='user%s@example.com' % voter_num,
+                                              name='User %s' % voter_num, info={})
+            models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, user=user, voter_login_id=user.user_id)
+            voter = models.Voter.objects.create(uuid=str(uuid.uuid4()), election=self.election, voter_login_id='voter%s' % voter_num,
+                                                voter_name='Voter %s' % voter_num, voter_email='voter%s@example.com' % voter_num)
+
+            encrypted_vote = homomorphic.EncryptedVote.fromElectionAndAnswers(self.election, [[0]])
+            cast_vote = models.CastVote(voter=voter, vote=encrypted_vote, vote_hash='fakehash' + str(uuid.uuid4())[:8],
+                                        cast_at=datetime.datetime.utcnow())
+            cast_vote.save()
+            models.Voter.objects.filter(id=voter.id).update(vote_hash=cast_vote.vote_hash, cast_at=cast_vote.cast_at)
+
+    def test_voter_id_hash_stored(self):
+        from helios.crypto.utils import hash_b64
+
+        voter = models.Voter.objects.get(election=self.election, voter_login_id='voter0')
+        self.assertEqual(voter.hashed_voter_id, hash_b64('voter0'))
+        self.assertEqual(voter.voter_id_hash, voter.compute_voter_id_hash())
+
+        voter.voter_login_id = 'voter0-renamed'
+        voter.save(update_fields=['voter_login_id'])
+        self.assertEqual(models.Voter.objects.get(id=voter.id).hashed_voter_id, hash_b64('voter0-renamed'))
+
+        # voters stored before the hash was kept still have one
+        models.Voter.objects.filter(id=voter.id).update(hashed_voter_id=None)
+        self.assertEqual(models.Voter.objects.get(id=voter.id).voter_id_hash, hash_b64('voter0-renamed'))
+
+    def test_tinyhashes_prefetched(self):
+        voters = list(models.Voter.objects.filter(election=self.election).exclude(vote_hash=None))
+        with self.assertNumQueries(1):
+            models.Voter.prefetch_vote_tinyhashes(voters)
+        with self.assertNumQueries(0):
+            tinyhashes = [voter.vote_tinyhash for voter in voters]
+        self.assertEqual(tinyhashes, [models.CastVote.objects.get(vote_hash=voter.vote_hash).vote_tinyhash for voter in voters])
+
+    def test_pages_in_fixed_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        url = "/helios/elections/%s/voters/list" % self.election.uuid
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'User 2')
+
+        self._add_voters(3, 10)
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'User 9')
+        self.assertEqual(len(more_queries), len(queries))
@@ -120,6 +120,33 @@ def random_string(length=20, alphabet=None):
 
     return r_string
 
+def random_permutation(n, rounds=4):
+  """
+  a random bijection of range(n) onto itself, as a function, without holding n numbers in memory:
+  a Feistel network keyed with fresh random bytes, over the smallest power of 4 that holds n,
+  walking the cycle of a value until it falls below n.
+  """
+  key = random.getrandbits(128).to_bytes(16, 'big')
+  half_bits = (max(n - 1, 1).bit_length() + 1) // 2
+  mask = (1 << half_bits) - 1
+
+  def feistel(x):
+    left, right = x >> half_bits, x & mask
+    for round_num in range(rounds):
+      digest = hmac.new(key, ("%d:%d" % (round_num, right)).encode('ascii'), hashlib.sha256).digest()
+      left, right = right, left ^ (int.from_bytes(digest[:8], 'big') & mask)
+    return (left << half_bits) | right
+
+  def permutation(i):
+    if not 0 <= i < n:
+      raise ValueError("%d is not in range(%d)" % (i, n))
+    i = feistel(i)
+    while i >= n:
+      i = feistel(i)
+    return i
+
+  return permutation
+
 def get_host():
   return settings.SERVER_HOST
   
@@ -164,6 +191,13 @@ def one_val_raw_sql(raw_sql, values=[]):
   cursor.execute(raw_sql, values)
   return cursor.fetchone()[0]
 
+def shared_cache():
+  """
+  the cache all the processes see, the 'shared' one if it is configured, else the local default
+  """
+  from django.core.cache import caches
+  return caches['shared'] if 'shared' in settings.CACHES else caches['default']
+
 def lock_row(model, pk):
   """
   you almost certainly want to use lock_row inside a commit_on_success function
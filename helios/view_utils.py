@@ -4,10 +4,15 @@ Utilities for all views
 Ben Adida (12-30-2008)
 """
 
+import csv
+
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.template import loader
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 # nicely update the wrapper function
 from functools import update_wrapper
 
@@ -70,6 +75,44 @@ def render_json(json_txt):
   return HttpResponse(utils.to_json(json_txt), content_type="application/json")
 
 
+def render_json_list_stream(items, items_per_chunk=100):
+  """
+  a JSON array of the items, serialized as the response is sent,
+  with the same bytes as render_json(list(items))
+  """
+  def chunks():
+    yield '['
+    separator = ''
+    buffer = []
+    for item in items:
+      buffer.append(separator + utils.to_json(item))
+      separator = ', '
+      if len(buffer) >= items_per_chunk:
+        yield ''.join(buffer)
+        buffer = []
+    yield ''.join(buffer) + ']'
+
+  return StreamingHttpResponse(chunks(), content_type="application/json")
+
+
+class _Echo(object):
+  """
+  a file for csv.writer that hands back what is written
+  """
+  def write(self, value):
+    return value
+
+
+def render_csv_stream(rows, filename):
+  """
+  a CSV download of the rows, written as the response is sent
+  """
+  writer = csv.writer(_Echo())
+  response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+  response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+  return response
+
+
 # decorator
 def return_json(func):
     """
@@ -86,3 +129,37 @@ def return_json(func):
         raise e
 
     return update_wrapper(convert_to_json,func)
+
+
+def election_response_cache(func):
+    """
+    A decorator for the views of an election whose response only changes
+    with the election, like its JSON: the response is cached under the
+    election cache version, which also serves as ETag and Last-Modified,
+    so clients that have it already get a 304.
+    """
+    def election_response_cache_wrapper(request, election, *args, **kwargs):
+      if not settings.HELIOS_ELECTION_CACHE_SECONDS or request.method not in ('GET', 'HEAD'):
+        return func(request, election, *args, **kwargs)
+
+      version = election.cache_version
+      etag = quote_etag('%s-%s' % (func.__name__, version))
+      not_modified = get_conditional_response(request, etag=etag, last_modified=election.cache_version_time)
+      if not_modified is not None:
+        return not_modified
+
+      cache_key = 'helios:election-response:%s:%s:%s' % (election.uuid, func.__name__, version)
+      cached = cache.get(cache_key)
+      if cached is None:
+        response = func(request, election, *args, **kwargs)
+        if response.status_code != 200:
+          return response
+        cached = (response.content, response['Content-Type'])
+        cache.set(cache_key, cached, settings.HELIOS_ELECTION_CACHE_SECONDS)
+
+      response = HttpResponse(cached[0], content_type=cached[1])
+      response['ETag'] = etag
+      response['Last-Modified'] = http_date(election.cache_version_time)
+      return response
+
+    return update_wrapper(election_response_cache_wrapper, func)
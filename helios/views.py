@@ -12,11 +12,15 @@ import os
 import uuid
 from urllib.parse import urlencode
 
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
 from django.db import transaction, IntegrityError
+from django.db.models.functions import Length
 from django.http import HttpResponse, Http404, HttpResponseRedirect, HttpResponseForbidden, HttpResponseBadRequest
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django.views.decorators.http import require_http_methods
 
 import helios_auth.url_names as helios_auth_urls
@@ -35,7 +39,8 @@ from .security import (election_view, election_admin,
                        trustee_check, set_logged_in_trustee,
                        can_create_election, user_can_see_election, get_voter,
                        user_can_admin_election, user_can_feature_election)
-from .view_utils import SUCCESS, FAILURE, return_json, render_template, render_template_raw
+from .view_utils import SUCCESS, FAILURE, return_json, render_template, render_template_raw, render_json_list_stream, \
+  render_csv_stream, election_response_cache
 from .workflows import homomorphic
 
 # Parameters for everything
@@ -171,7 +176,7 @@ def elections_administered(request):
     return HttpResponseForbidden('only an administrator has elections to administer')
   
   user = get_user(request)
-  elections = Election.get_by_user_as_admin(user)
+  elections = Election.load_counters(Election.get_by_user_as_admin(user))
   
   return render_template(request, "elections_administered", {'elections': elections})
 
@@ -228,7 +233,7 @@ def election_new(request):
 def one_election_edit(request, election):
 
   error = None
-  RELEVANT_FIELDS = ['short_name', 'name', 'description', 'use_voter_aliases', 'election_type', 'private_p', 'help_email', 'randomize_answer_order', 'voting_starts_at', 'voting_ends_at']
+  RELEVANT_FIELDS = ['short_name', 'name', 'description', 'use_voter_aliases', 'election_type', 'private_p', 'help_email', 'randomize_answer_order', 'incremental_tally_p', 'voting_starts_at', 'voting_ends_at']
   # RELEVANT_FIELDS += ['use_advanced_audit_features']
 
   if settings.ALLOW_ELECTION_INFO_URL:
@@ -277,13 +282,15 @@ def one_election_extend(request, election):
   return render_template(request, "election_extend", {'election_form' : election_form, 'election' : election})
 
 @election_view()
-@return_json
+@election_response_cache
 def one_election(request, election):
   if not election:
     raise Http404
-  return election.toJSONDict(complete=True)
+  # the same JSON as toJSONDict, kept as it is once the election is frozen
+  return HttpResponse(election.toJSON(), content_type="application/json")
 
 @election_view()
+@election_response_cache
 @return_json
 def one_election_meta(request, election):
   if not election:
@@ -292,11 +299,22 @@ def one_election_meta(request, election):
 
 @election_view()
 def election_badge(request, election):
+  # embedded in other sites, it only changes with the election and its number of cast votes
+  etag = None
+  if settings.HELIOS_ELECTION_CACHE_SECONDS:
+    etag = quote_etag('badge-%s-%s' % (election.cache_version, election.num_cast_votes))
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+      return not_modified
+
   election_url = get_election_url(election)
   params = {'election': election, 'election_url': election_url}
   for option_name in ['show_title', 'show_vote_link']:
     params[option_name] = (request.GET.get(option_name, '1') == '1')
-  return render_template(request, "election_badge", params)
+  response = render_template(request, "election_badge", params)
+  if etag:
+    response['ETag'] = etag
+  return response
 
 @election_view()
 def one_election_view(request, election):
@@ -382,6 +400,7 @@ def nocookies(request):
 ## As of July 2009, there are always trustees for a Helios election: one trustee is acceptable, for simple elections.
 ##
 @election_view()
+@election_response_cache
 @return_json
 def list_trustees(request, election):
   trustees = Trustee.get_by_election(election)
@@ -835,7 +854,7 @@ def one_election_cast_confirm(request, election):
 
   # if this user is a voter, prepare some stuff
   if voter:
-    vote = datatypes.LDObject.fromDict(utils.from_json(encrypted_vote), type_hint='legacy/EncryptedVote').wrapped_obj
+    vote = datatypes.LDObject.wrapped_from_dict(utils.from_json(encrypted_vote), type_hint='legacy/EncryptedVote')
 
     if 'HTTP_X_FORWARDED_FOR' in request.META:
       # HTTP_X_FORWARDED_FOR sometimes have a comma delimited list of IP addresses
@@ -1013,7 +1032,7 @@ def one_election_bboard(request, election):
   if limit not in ALLOWED_LIMITS:
     limit = 50
   
-  order_by = 'voter_id'
+  order_by = 'voter_login_id'
   
   # unless it's by alias, in which case we better go by UUID
   if election.use_voter_aliases:
@@ -1025,7 +1044,7 @@ def one_election_bboard(request, election):
     voters = []
   else:
     # load a bunch of voters
-    voters = Voter.get_by_election(election, after=after, limit=limit+1, order_by=order_by)
+    voters = list(Voter.get_by_election(election, after=after, limit=limit+1, order_by=order_by).defer('vote'))
     
   more_p = len(voters) > limit
   if more_p:
@@ -1033,6 +1052,8 @@ def one_election_bboard(request, election):
     next_after = getattr(voters[limit-1], order_by)
   else:
     next_after = None
+
+  Voter.prefetch_vote_tinyhashes(voters)
     
   return render_template(request, 'election_bboard', {'election': election, 'voters': voters, 'next_after': next_after,
                 'offset': offset, 'limit': limit, 'offset_plus_one': offset+1, 'offset_plus_limit': offset+limit,
@@ -1098,6 +1119,10 @@ Helios
       # log it
       election.append_log("Voter %s/%s and their vote were removed after election was frozen" % (voter.voter_type,voter.voter_id))
 
+      # the vote no longer counts
+      if election.incremental_tally_p and voter.vote:
+        election.update_running_tally(removed_votes=[voter.vote])
+
     elif election.frozen_at:
       # log it
       election.append_log("Voter %s/%s removed after election was frozen" % (voter.voter_type,voter.voter_id))
@@ -1115,12 +1140,10 @@ def voters_clear(request, election):
   """
   check_csrf(request)
 
-  num_voters = election.num_voters
+  # Delete all voters for this election
+  num_voters = Voter.delete_by_election(election)
 
   if num_voters > 0:
-    # Delete all voters for this election
-    Voter.objects.filter(election=election).delete()
-
     # Log the action
     election.append_log("All voters cleared (%d voters removed)" % num_voters)
 
@@ -1212,6 +1235,7 @@ def one_election_copy(request, election):
     use_voter_aliases = election.use_voter_aliases,
     use_advanced_audit_features = election.use_advanced_audit_features,
     randomize_answer_order = election.randomize_answer_order,
+    incremental_tally_p = election.incremental_tally_p,
     registration_starts_at = election.registration_starts_at,
     voting_starts_at = election.voting_starts_at,
     voting_ends_at = election.voting_ends_at,
@@ -1227,7 +1251,9 @@ def one_election_copy(request, election):
 # built into the page
 @election_view()
 def one_election_questions(request, election):
-  questions_json = utils.to_json(election.questions)
+  # the same until the election changes
+  questions_json = cache.get_or_set('helios:election-questions-json:%s:%s' % (election.uuid, election.cache_version),
+                                    lambda: utils.to_json(election.questions), settings.HELIOS_ELECTION_CACHE_SECONDS)
   user = get_user(request)
   admin_p = user_can_admin_election(user, election)
 
@@ -1353,7 +1379,7 @@ def trustee_upload_decryption(request, election, trustee_uuid):
   trustee.decryption_factors = [[datatypes.LDObject.fromDict(factor, type_hint='core/BigInteger').wrapped_obj for factor in one_q_factors] for one_q_factors in factors_and_proofs['decryption_factors']]
 
   # each proof needs to be deserialized
-  trustee.decryption_proofs = [[datatypes.LDObject.fromDict(proof, type_hint='legacy/EGZKProof').wrapped_obj for proof in one_q_proofs] for one_q_proofs in factors_and_proofs['decryption_proofs']]
+  trustee.decryption_proofs = [[datatypes.LDObject.wrapped_from_dict(proof, type_hint='legacy/EGZKProof') for proof in one_q_proofs] for one_q_proofs in factors_and_proofs['decryption_proofs']]
 
   if trustee.verify_decryption_proofs():
     trustee.save()
@@ -1457,12 +1483,13 @@ def voters_list_pretty(request, election):
   except AuthenticationExpired:
     return user_reauth(request, user)
   
-  # files being processed
-  voter_files = election.voterfile_set.all().order_by('-uploaded_at')
+  # files being processed, without loading their content
+  voter_files = election.voterfile_set.defer('voter_file_content').annotate(
+    voter_file_content_length=Length('voter_file_content')).order_by('-uploaded_at')
 
   # load a bunch of voters
   # voters = Voter.get_by_election(election, order_by=order_by)
-  voters = Voter.objects.filter(election = election).order_by(order_by).defer('vote')
+  voters = Voter.objects.filter(election = election).select_related('user').order_by(order_by).defer('vote')
 
   if q != '':
     from django.db.models import Q
@@ -1481,6 +1508,10 @@ def voters_list_pretty(request, election):
   voter_paginator = Paginator(voters, limit)
   voters_page = voter_paginator.page(page)
 
+  # the users come along in the page query, the tinyhashes in one more
+  voters_page.object_list = list(voters_page.object_list)
+  Voter.prefetch_vote_tinyhashes(voters_page.object_list)
+
   total_voters = voter_paginator.count
 
   # Check if voter emails can be sent
@@ -1509,15 +1540,12 @@ def voters_download_csv(request, election):
   """
   Download the list of voters as CSV, showing only the fields visible to the current user
   """
-  import csv
-  from django.http import HttpResponse
-  
   user = get_user(request)
   admin_p = user_can_admin_election(user, election)
   
   # Get all voters (no pagination for CSV export)
   order_by = 'alias' if election.use_voter_aliases else 'user__user_id'
-  voters = Voter.objects.filter(election=election).order_by(order_by).defer('vote')
+  voters = Voter.objects.filter(election=election).order_by(order_by)
   
   # Apply search filter if provided
   q = request.GET.get('q', '')
@@ -1535,12 +1563,6 @@ def voters_download_csv(request, election):
     else:
       voters = voters.filter(voter_name__icontains=q)
   
-  # Create the HttpResponse object with CSV header
-  response = HttpResponse(content_type='text/csv')
-  response['Content-Disposition'] = f'attachment; filename="voters_{election.short_name}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-  
-  writer = csv.writer(response)
-  
   # Write headers based on what's visible to the user
   headers = []
   if admin_p:
@@ -1556,64 +1578,59 @@ def voters_download_csv(request, election):
   headers.append('Smart Ballot Tracker')
   headers.append('Vote Cast At')
   
-  writer.writerow(headers)
-  
-  # Write voter data
-  for voter in voters:
-    row = []
-    
-    if admin_p:
-      row.append(voter.voter_login_id)
-      row.append(voter.voter_email)
-    
-    if admin_p or not election.use_voter_aliases:
-      row.append(voter.name)
-      row.append(voter.voter_type)
-    
-    if election.use_voter_aliases:
-      row.append(voter.alias)
-    
-    row.append(voter.vote_hash if voter.vote_hash else '')
-    row.append(voter.cast_at.strftime('%Y-%m-%d %H:%M:%S') if voter.cast_at else '')
-    
-    writer.writerow(row)
+  def rows():
+    yield headers
+
+    # only the columns of the CSV, with the user joined in, read through a server-side cursor as the response is sent
+    voter_rows = voters.values_list('voter_login_id', 'voter_email', 'voter_name', 'alias', 'vote_hash', 'cast_at',
+                                    'user__name', 'user__user_type')
+    for voter_login_id, voter_email, voter_name, alias, vote_hash, cast_at, user_name, user_type in voter_rows.iterator(chunk_size=2000):
+      row = []
+      
+      if admin_p:
+        row.append(voter_login_id)
+        row.append(voter_email)
+      
+      if admin_p or not election.use_voter_aliases:
+        # same as voter.name and voter.voter_type, voters without a user are password voters
+        row.append(user_name if user_type else voter_name)
+        row.append(user_type or 'password')
+      
+      if election.use_voter_aliases:
+        row.append(alias)
+      
+      row.append(vote_hash if vote_hash else '')
+      row.append(cast_at.strftime('%Y-%m-%d %H:%M:%S') if cast_at else '')
+      
+      yield row
   
-  return response
+  return render_csv_stream(rows(), f'voters_{election.short_name}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
 
 @election_admin()
 def election_log_download_csv(request, election):
   """
   Download the election log as CSV (admin only)
   """
-  import csv
-  from django.http import HttpResponse
   from .models import ElectionLog
 
   # Get all log entries ordered by timestamp (oldest first for chronological reading)
-  logs = ElectionLog.objects.filter(election=election).order_by('at')
+  logs = ElectionLog.objects.filter(election=election).order_by('at', 'id').values_list('at', 'log')
 
-  # Create the HttpResponse object with CSV header
-  response = HttpResponse(content_type='text/csv')
-  response['Content-Disposition'] = f'attachment; filename="election_log_{election.short_name}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
+  def rows():
+    # Write header row
+    yield ['Timestamp', 'Event']
 
-  writer = csv.writer(response)
+    # Write log entries
+    for at, log in logs.iterator(chunk_size=2000):
+      yield [at.strftime('%Y-%m-%d %H:%M:%S') if at else '', log]
 
-  # Write header row
-  writer.writerow(['Timestamp', 'Event'])
+  return render_csv_stream(rows(), f'election_log_{election.short_name}_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.csv')
 
-  # Write log entries
-  for log in logs:
-    writer.writerow([
-      log.at.strftime('%Y-%m-%d %H:%M:%S') if log.at else '',
-      log.log
-    ])
-
-  return response
-
-@election_admin()
+@election_admin(frozen=False)
 def voters_eligibility(request, election):
   """
-  set eligibility for voters
+  set eligibility for voters.
+  openreg is part of the election JSON, which is fixed once the election is frozen.
   """
   user = get_user(request)
 
@@ -1680,7 +1697,11 @@ def voters_upload(request, election):
 
         # import the first few lines to check
         try:
-          voters = [v for v in voter_file_obj.itervoters()][:5]
+          # the whole file is checked, only the first few voters are kept
+          voters = []
+          for voter in voter_file_obj.itervoters():
+            if len(voters) < 5:
+              voters.append(voter)
           if len(voters) == 0:
             raise Exception("no valid lines found in voter file")
         except Exception as e:
@@ -1803,14 +1824,13 @@ def voters_email(request, election):
 
 # Individual Voters
 @election_view()
-@return_json
 def voter_list(request, election):
   # normalize limit
   limit = int(request.GET.get('limit', 500))
   if limit > 500: limit = 500
     
-  voters = Voter.get_by_election(election, order_by='uuid', after=request.GET.get('after',None), limit= limit)
-  return [v.ld_object.toDict() for v in voters]
+  voters = Voter.iter_by_election(election, after_uuid=request.GET.get('after',None), limit= limit)
+  return render_json_list_stream(v.ld_object.toDict() for v in voters)
   
 @election_view()
 @return_json
@@ -1847,22 +1867,23 @@ def voter_last_vote(request, election, voter_uuid):
 ##
 
 @election_view()
-@return_json
 def ballot_list(request, election):
   """
-  this will order the ballots from most recent to oldest.
-  and optionally take a after parameter.
+  this will order the ballots from oldest to most recent, streamed as they are read.
+  and optionally take a after parameter, the cast_at of the last ballot already seen,
+  with after_uuid the voter_uuid of that ballot, so ballots cast at the same time are not skipped.
   """
   limit = after = None
   if 'limit' in request.GET:
     limit = int(request.GET['limit'])
   if 'after' in request.GET:
-    after = datetime.datetime.strptime(request.GET['after'], '%Y-%m-%d %H:%M:%S')
+    after_format = '%Y-%m-%d %H:%M:%S.%f' if '.' in request.GET['after'] else '%Y-%m-%d %H:%M:%S'
+    after = datetime.datetime.strptime(request.GET['after'], after_format)
     
-  voters = Voter.get_by_election(election, cast=True, order_by='cast_at', limit=limit, after=after)
+  voters = Voter.iter_by_election(election, cast=True, after=after, after_uuid=request.GET.get('after_uuid', None), limit=limit)
 
   # we explicitly cast this to a short cast vote
-  return [v.last_cast_vote().ld_object.short.toDict(complete=True) for v in voters]
+  return render_json_list_stream(v.last_short_cast_vote_dict() for v in voters)
 
 
 ##
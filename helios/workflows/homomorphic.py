@@ -7,9 +7,20 @@ reworked 2011-01-09
 """
 
 import logging
+
+from Crypto.Util.number import inverse
+from django.conf import settings
+
+from helios import utils
 from helios.crypto import algs
+from helios.crypto.batch import BatchVerifier
+from helios.crypto.dlog import DLogService, DLogTable  # DLogTable used to live here
+from helios.crypto.elgamal import Ciphertext
 from . import WorkflowObject
 
+# how many ballots are verified together in one proof batch
+VERIFY_BATCH_SIZE = 50
+
 class EncryptedAnswer(WorkflowObject):
   """
   An encrypted answer to a single election question
@@ -81,6 +92,31 @@ class EncryptedAnswer(WorkflowObject):
     else:
       # approval voting, no need for overall proof verification
       return True
+
+  def add_to_batch(self, batch, pk, min=0, max=1):
+    """
+    same checks as verify(), but the proofs are only recorded in the batch verifier.
+    returns False if the answer is already known to be bad.
+    """
+    possible_plaintexts = self.generate_plaintexts(pk)
+    homomorphic_sum = 0
+
+    for choice_num in range(len(self.choices)):
+      choice = self.choices[choice_num]
+      choice.pk = pk
+      individual_proof = self.individual_proofs[choice_num]
+
+      if not batch.add_disjunctive_encryption_proof(choice, possible_plaintexts, individual_proof, algs.EG_disjunctive_challenge_generator):
+        return False
+
+      if max is not None:
+        homomorphic_sum = choice * homomorphic_sum
+
+    if max is not None:
+      sum_possible_plaintexts = self.generate_plaintexts(pk, min=min, max=max)
+      return batch.add_disjunctive_encryption_proof(homomorphic_sum, sum_possible_plaintexts, self.overall_proof, algs.EG_disjunctive_challenge_generator)
+    else:
+      return True
         
   @classmethod
   def fromElectionAndAnswer(cls, election, question_num, answer_indexes):
@@ -176,7 +212,10 @@ class EncryptedVote(WorkflowObject):
 
   answers = property(_answers_get, _answers_set)
 
-  def verify(self, election):
+  def verify_election_binding(self, election, election_hash):
+    """
+    check that the ballot is for this election: number of answers, election hash and uuid
+    """
     # correct number of answers
     # noinspection PyUnresolvedReferences
     n_answers = len(self.encrypted_answers) if self.encrypted_answers is not None else 0
@@ -188,7 +227,7 @@ class EncryptedVote(WorkflowObject):
     # check hash
     # noinspection PyUnresolvedReferences
     our_election_hash = self.election_hash if isinstance(self.election_hash, str) else self.election_hash.decode()
-    actual_election_hash = election.hash if isinstance(election.hash, str) else election.hash.decode()
+    actual_election_hash = election_hash if isinstance(election_hash, str) else election_hash.decode()
     if our_election_hash != actual_election_hash:
       logging.error(f"Incorrect election_hash {our_election_hash} vs {actual_election_hash} ")
       return False
@@ -201,6 +240,12 @@ class EncryptedVote(WorkflowObject):
       logging.error(f"Incorrect election_uuid {our_election_uuid} vs {actual_election_uuid} ")
       return False
 
+    return True
+
+  def verify(self, election):
+    if not self.verify_election_binding(election, election.hash):
+      return False
+
     # check proofs on all of answers
     for question_num in range(len(election.questions)):
       ea = self.encrypted_answers[question_num]
@@ -214,6 +259,57 @@ class EncryptedVote(WorkflowObject):
         return False
         
     return True
+
+  def add_to_batch(self, batch, election, election_hash):
+    """
+    same checks as verify(), but the proofs are only recorded in the batch verifier.
+    returns False if the ballot is already known to be bad.
+    """
+    if not self.verify_election_binding(election, election_hash):
+      return False
+
+    for question_num in range(len(election.questions)):
+      question = election.questions[question_num]
+      min_answers = 0
+      if 'min' in question:
+        min_answers = question['min']
+
+      if not self.encrypted_answers[question_num].add_to_batch(batch, election.public_key, min=min_answers, max=question['max']):
+        return False
+
+    return True
+
+  @classmethod
+  def verify_batch(cls, election, encrypted_votes, batch_size=VERIFY_BATCH_SIZE):
+    """
+    Verify many ballots, returns the list of ballots that do not verify.
+
+    The proofs of batch_size ballots at a time are checked together by a BatchVerifier.
+    When a batch fails, its ballots are verified one by one to find the bad ones.
+    """
+    election_hash = election.hash
+    pk = election.public_key
+    bad_votes = set()
+
+    for start in range(0, len(encrypted_votes), batch_size):
+      batch = BatchVerifier(pk)
+      batched_votes = []
+
+      for vote_num in range(start, min(start + batch_size, len(encrypted_votes))):
+        # a ballot that fails the cheap checks stays out of the batch
+        vote_batch = BatchVerifier(pk)
+        if encrypted_votes[vote_num].add_to_batch(vote_batch, election, election_hash) and not vote_batch.failed:
+          batch.extend(vote_batch)
+          batched_votes.append(vote_num)
+        else:
+          bad_votes.add(vote_num)
+
+      if not batch.verify():
+        for vote_num in batched_votes:
+          if not encrypted_votes[vote_num].verify(election):
+            bad_votes.add(vote_num)
+
+    return [encrypted_votes[vote_num] for vote_num in sorted(bad_votes)]
     
   @classmethod
   def fromElectionAndAnswers(cls, election, answers):
@@ -229,40 +325,6 @@ class EncryptedVote(WorkflowObject):
     return return_val
     
 
-class DLogTable(object):
-  """
-  Keeping track of discrete logs
-  """
-  
-  def __init__(self, base, modulus):
-    self.dlogs = {}
-    self.dlogs[1] = 0
-    self.last_dlog_result = 1
-    self.counter = 0
-    
-    self.base = base
-    self.modulus = modulus
-    
-  def increment(self):
-    self.counter += 1
-    
-    # new value
-    new_value = (self.last_dlog_result * self.base) % self.modulus
-    
-    # record the discrete log
-    self.dlogs[new_value] = self.counter
-    
-    # record the last value
-    self.last_dlog_result = new_value
-    
-  def precompute(self, up_to):
-    while self.counter < up_to:
-      self.increment()
-  
-  def lookup(self, value):
-    return self.dlogs.get(value, None)
-      
-    
 class Tally(WorkflowObject):
   """
   A running homomorphic tally
@@ -297,12 +359,121 @@ class Tally(WorkflowObject):
     
   def add_vote_batch(self, encrypted_votes, verify_p=True):
     """
-    Add a batch of votes. Eventually, this will be optimized to do an aggregate proof verification
-    rather than a whole proof verif for each vote.
+    Add a batch of votes. The proofs of all the votes are verified together
+    (see EncryptedVote.verify_batch) and no vote is added if one of them is bad.
     """
+    encrypted_votes = list(encrypted_votes)
+
+    if verify_p:
+      bad_votes = EncryptedVote.verify_batch(self.election, encrypted_votes)
+      if bad_votes:
+        raise Exception('Bad Vote %s' % bad_votes[0].hash)
+
     for vote in encrypted_votes:
-      self.add_vote(vote, verify_p)
-    
+      self.add_vote(vote, verify_p=False)
+
+  def add_raw_votes(self, raw_votes):
+    """
+    Add votes given as their stored JSON (strings or already parsed dicts), without verifying them.
+
+    Only the alpha and beta of every choice are read from a vote, the proofs are
+    never turned into objects. The running products are kept in two flat lists
+    of integers, so memory does not grow with the number of votes.
+    """
+    self.add_products(*self.vote_products(raw_votes))
+
+  def _choice_offsets(self):
+    # position of each question's first answer in the flat lists
+    offsets = []
+    num_choices = 0
+    for question in self.questions:
+      offsets.append(num_choices)
+      num_choices += len(question['answers'])
+
+    return offsets, num_choices
+
+  def vote_products(self, votes):
+    """
+    Multiply the choices of the given votes, without touching this tally.
+    Votes can be EncryptedVote objects or their stored JSON (strings or parsed dicts).
+
+    Returns flat lists of the alpha and beta products, one entry per answer
+    of every question, and the number of votes. The homomorphic product does
+    not depend on the order of the votes, so the votes can be split into
+    shards whose products are computed apart and merged with add_products.
+    """
+    p = self.public_key.p
+    offsets, num_choices = self._choice_offsets()
+
+    alphas = [1] * num_choices
+    betas = [1] * num_choices
+    num_votes = 0
+    for vote in votes:
+      if isinstance(vote, EncryptedVote):
+        answers = [[(choice.alpha, choice.beta) for choice in answer.choices] for answer in vote.encrypted_answers]
+      else:
+        if isinstance(vote, str):
+          vote = utils.from_json(vote)
+        answers = [[(choice['alpha'], choice['beta']) for choice in answer['choices']] for answer in vote['answers']]
+
+      for question_num, offset in enumerate(offsets):
+        choices = answers[question_num]
+        for answer_num in range(len(self.questions[question_num]['answers'])):
+          alpha, beta = choices[answer_num]
+          alphas[offset + answer_num] = (alphas[offset + answer_num] * int(alpha)) % p
+          betas[offset + answer_num] = (betas[offset + answer_num] * int(beta)) % p
+
+      num_votes += 1
+
+    return alphas, betas, num_votes
+
+  def add_products(self, alphas, betas, num_votes):
+    """
+    Merge products computed by vote_products into this tally.
+    """
+    if not num_votes:
+      return
+
+    p = self.public_key.p
+    offsets, _ = self._choice_offsets()
+
+    new_tally = []
+    for question_num, question in enumerate(self.questions):
+      question_tally = []
+      for answer_num in range(len(question['answers'])):
+        alpha = alphas[offsets[question_num] + answer_num]
+        beta = betas[offsets[question_num] + answer_num]
+
+        choice_tally = self.tally[question_num][answer_num]
+        if choice_tally:
+          alpha = (alpha * choice_tally.alpha) % p
+          beta = (beta * choice_tally.beta) % p
+
+        question_tally.append(Ciphertext(alpha, beta, self.public_key))
+      new_tally.append(question_tally)
+
+    self.tally = new_tally
+    self.num_tallied += num_votes
+
+  def remove_products(self, alphas, betas, num_votes):
+    """
+    Take votes that were added earlier back out of this tally, given their products
+    from vote_products: every entry is multiplied by the inverse of the product.
+    """
+    if not num_votes:
+      return
+
+    p = self.public_key.p
+    self.add_products([inverse(alpha, p) for alpha in alphas], [inverse(beta, p) for beta in betas], -num_votes)
+
+  def reset(self):
+    """
+    Start from an empty tally in which every entry is a ciphertext, the encryption of 0
+    without randomness (alpha = beta = 1), so that it can be stored before any vote is added.
+    """
+    self.tally = [[Ciphertext(1, 1, self.public_key) for answer in question['answers']] for question in self.questions]
+    self.num_tallied = 0
+
   def add_vote(self, encrypted_vote, verify_p=True):
     # do we verify?
     if verify_p:
@@ -411,9 +582,8 @@ class Tally(WorkflowObject):
     Each decryption factor set is a list of lists of decryption factors (questions/answers).
     """
     
-    # pre-compute a dlog table
-    dlog_table = DLogTable(base = public_key.g, modulus = public_key.p)
-    dlog_table.precompute(self.num_tallied)
+    # the discrete log tables are kept between decryptions
+    dlog_service = DLogService.shared(cache_dir=settings.HELIOS_DLOG_CACHE_DIR)
     
     result = []
     
@@ -426,7 +596,7 @@ class Tally(WorkflowObject):
         dec_factor_list = [df[q_num][a_num] for df in decryption_factors]
         raw_value = self.tally[q_num][a_num].decrypt(dec_factor_list, public_key)
         
-        q_result.append(dlog_table.lookup(raw_value))
+        q_result.append(dlog_service.discrete_log(raw_value, public_key.g, public_key.p, self.num_tallied))
 
       result.append(q_result)
     
@@ -9,7 +9,7 @@ LDAP authentication relies on django-auth-ldap (https://django-auth-ldap.readthe
 from django import forms
 from django.conf import settings
 from django.urls import re_path
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
@@ -82,15 +82,19 @@ def get_auth_url(request, redirect_url = None):
     return reverse(ldap_login_view)
 
 
-def send_message(user_id, name, user_info, subject, body):
-    send_mail(
+def email_message(user_id, name, user_info, subject, body):
+    message = EmailMultiAlternatives(
         subject,
         body,
         settings.SERVER_EMAIL,
         [format_recipient(name, user_info['email'])],
-        fail_silently=False,
-        html_message=body,
     )
+    message.attach_alternative(body, 'text/html')
+    return message
+
+
+def send_message(user_id, name, user_info, subject, body):
+    email_message(user_id, name, user_info, subject, body).send(fail_silently=False)
 
 
 def check_constraint(constraint, user_info):
@@ -4,7 +4,7 @@ Username/Password Authentication
 
 from django.urls import reverse
 from django import forms
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, send_mail
 from django.conf import settings
 from django.http import HttpResponseRedirect
 from django.urls import re_path
@@ -121,10 +121,13 @@ def get_user_info_after_auth(request):
 def update_status(token, message):
   pass
   
-def send_message(user_id, user_name, user_info, subject, body):
+def email_message(user_id, user_name, user_info, subject, body):
   email = user_id
   name = user_name or email
-  send_mail(subject, body, settings.SERVER_EMAIL, [format_recipient(name, email)], fail_silently=False)    
+  return EmailMultiAlternatives(subject, body, settings.SERVER_EMAIL, [format_recipient(name, email)])
+
+def send_message(user_id, user_name, user_info, subject, body):
+  email_message(user_id, user_name, user_info, subject, body).send(fail_silently=False)
 
 
 #
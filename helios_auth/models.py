@@ -109,6 +109,16 @@ class User(models.Model):
       subject = subject.split("\n")[0]
       AUTH_SYSTEMS[self.user_type].send_message(self.user_id, self.name, self.info, subject, body)
 
+  def email_message(self, subject, body):
+    """
+    the email send_message would send, so it can be sent with others over one connection.
+    None if the auth system does not send plain emails.
+    """
+    if self.user_type in AUTH_SYSTEMS and hasattr(AUTH_SYSTEMS[self.user_type], 'email_message'):
+      subject = subject.split("\n")[0]
+      return AUTH_SYSTEMS[self.user_type].email_message(self.user_id, self.name, self.info, subject, body)
+    return None
+
   def send_notification(self, message):
     if self.user_type in AUTH_SYSTEMS:
       if hasattr(AUTH_SYSTEMS[self.user_type], 'send_notification'):
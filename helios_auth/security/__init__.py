@@ -98,9 +98,17 @@ def get_user(request):
 
   if 'user' in request.session:
     user = request.session['user']
+    user_key = (user['type'], user['user_id'])
+
+    # the view, the security checks and the templates all ask for the user, look it up once per request.
+    # keyed by the session user, so logging in or out during the request is seen
+    cached_user = getattr(request, '_helios_user', None)
+    if cached_user is not None and cached_user[0] == user_key:
+      return cached_user[1]
 
     # find the user
     user_obj = User.get_by_type_and_id(user['type'], user['user_id'])
+    request._helios_user = (user_key, user_obj)
     return user_obj
   else:
     return None  
@@ -398,3 +398,35 @@ class OAuthAuthSystemTests(TestCase):
         for system in [google, github, gitlab, linkedin]:
             result = system.get_user_info_after_auth(request)
             self.assertIsNone(result)
+
+
+class GetUserTests(TestCase):
+    """get_user looks the user up once per request"""
+
+    def setUp(self):
+        from django.test import RequestFactory
+        self.users = [models.User.update_or_create(user_type='password', user_id='user%s@example.com' % user_num,
+                                                   info={'name': 'User %s' % user_num, 'password': 'secret'})
+                      for user_num in range(2)]
+        self.request = RequestFactory().get('/')
+        self.request.session = {}
+
+    def test_one_query_per_request(self):
+        from helios_auth.security import get_user
+
+        self.assertIsNone(get_user(self.request))
+        self.assertIn('csrf_token', self.request.session)
+
+        self.request.session['user'] = {'type': 'password', 'user_id': 'user0@example.com'}
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                self.assertEqual(get_user(self.request), self.users[0])
+
+        # another user logs in during the request
+        self.request.session['user'] = {'type': 'password', 'user_id': 'user1@example.com'}
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user(self.request), self.users[1])
+            self.assertEqual(get_user(self.request), self.users[1])
+
+        del self.request.session['user']
+        self.assertIsNone(get_user(self.request))
@@ -5,6 +5,7 @@ import json
 import os
 
 import ldap
+from django.core.exceptions import ImproperlyConfigured
 from django_auth_ldap.config import LDAPSearch
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -77,6 +78,24 @@ DATABASES = {
     },
 }
 
+# every process caches in its own memory. a 'shared' cache seen by all the web and celery processes,
+# e.g. django.core.cache.backends.redis.RedisCache at redis://..., holds the versions that tell
+# the processes when their cached copies are out of date.
+# no cache client library is a dependency, so SHARED_CACHE_BACKEND has to be set along with
+# SHARED_CACHE_LOCATION, and the client it needs (e.g. redis) installed.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+if get_from_env('SHARED_CACHE_LOCATION', None):
+    if not get_from_env('SHARED_CACHE_BACKEND', None):
+        raise ImproperlyConfigured("SHARED_CACHE_LOCATION is set, SHARED_CACHE_BACKEND must be set too")
+    CACHES['shared'] = {
+        'BACKEND': get_from_env('SHARED_CACHE_BACKEND', None),
+        'LOCATION': get_from_env('SHARED_CACHE_LOCATION', None),
+    }
+
 # explicitly set the default auto-created primary field to silence warning models.W042
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
@@ -289,9 +308,34 @@ HELIOS_VOTERS_EMAIL = True
 # Number of weeks after tallying when voter emails should be disabled
 HELIOS_VOTER_EMAIL_CUTOFF_WEEKS = int(get_from_env('HELIOS_VOTER_EMAIL_CUTOFF_WEEKS', '3'))
 
+# mass emails to voters: voters per task, messages per second (0 for no limit),
+# and how many times a failed message is tried again
+HELIOS_EMAIL_CHUNK_SIZE = int(get_from_env('HELIOS_EMAIL_CHUNK_SIZE', '200'))
+HELIOS_EMAIL_RATE_LIMIT = float(get_from_env('HELIOS_EMAIL_RATE_LIMIT', '0'))
+HELIOS_EMAIL_MAX_RETRIES = int(get_from_env('HELIOS_EMAIL_MAX_RETRIES', '2'))
+
+# seconds a process keeps the opted-out email hashes in memory, 0 to look them up every time.
+# opt-outs made in another process are seen at once if there is a shared cache, see CACHES,
+# otherwise once this time is up
+HELIOS_EMAIL_OPTOUT_CACHE_SECONDS = 0 if TESTING else int(get_from_env('HELIOS_EMAIL_OPTOUT_CACHE_SECONDS', '60'))
+
+# seconds an election looked up by the election views stays cached, 0 to turn the cache off.
+# saving an election only reaches the caches of other processes through the shared cache,
+# so without one the election cache is off unless turned on here
+HELIOS_ELECTION_CACHE_SECONDS = 0 if TESTING else int(get_from_env('HELIOS_ELECTION_CACHE_SECONDS',
+                                                                   '300' if 'shared' in CACHES else '0'))
+
 # are elections private by default?
 HELIOS_PRIVATE_DEFAULT = False
 
+# worker processes used to compute an encrypted tally, defaults to a single process.
+# only used outside daemonic processes: the children of a prefork Celery worker cannot start a pool.
+# tests run in a single process because the workers would not see the test transaction.
+HELIOS_TALLY_PROCESSES = 1 if TESTING else int(get_from_env('HELIOS_TALLY_PROCESSES', '1'))
+
+# directory where discrete log tables for tally decryption are kept between runs, none keeps them in memory only
+HELIOS_DLOG_CACHE_DIR = get_from_env('HELIOS_DLOG_CACHE_DIR', None)
+
 # authentication systems enabled
 # AUTH_ENABLED_SYSTEMS = ['password','facebook', 'google', 'yahoo']
 AUTH_ENABLED_SYSTEMS = get_from_env('AUTH_ENABLED_SYSTEMS',